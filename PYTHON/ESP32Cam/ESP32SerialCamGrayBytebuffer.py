@@ -11,72 +11,62 @@ import tifffile as tif
 
 import cv2
 
-def connect_to_usb_device(manufacturer="Espressif"):
-    ports = serial.tools.list_ports.comports()
-    for port in ports:
-        if port.manufacturer == manufacturer or port.manufacturer == "Microsoft":
-            try:
-                ser = serial.Serial(port.device, baudrate=2000000, timeout=1)
-                print(f"Connected to device: {port.description}")
-                ser.write_timeout = 1
-                return ser
-            except serial.SerialException:
-                print(f"Failed to connect to device: {port.description}")
-    print("No matching USB device found.")
-    return None
+import os
+import sys
+import logging
+# focusd lives in RASPI/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "RASPI"))
+from focusd.profiling import Profiler
+from focusd.recorder import SessionRecorder
+from focusd.exposure import AutoExposure
+from focusd.tracker import SpotTracker
+from focusd.sources import SerialCamSource
+from focusd.link import LinkSupervisor
+
+logging.basicConfig(level=logging.INFO)
 
 # Specify the manufacturer to connect to
 manufacturer = 'Espressif'
 
-# Connect to the USB device
-serialdevice = connect_to_usb_device(manufacturer)
-
-
 #%%
-iError = 0
-
-t0 = time.time()
-message = ""
-imageString = ""
+# per-stage timing (acquisition, decode, sync, publish), logged every 5 s; set enabled=False to switch it off
+profiler = Profiler(log_interval=5)
+profiler.install_signal_trigger()  # kill -USR1 <pid> profiles the next 100 frames
 
 #cv2.startWindowThread()
 
-serialdevice.write(('t10\n').encode())
-serialdevice.readline()
-
-while True:
-  try:
-        #read image and decode
-        #serialdevice.write(b"")
-        serialdevice.write(('\n').encode())
-        # don't read to early
-        time.sleep(.05)
-        #serialdevice.flushInput()
-        #serialdevice.flushOutput()
-
-        #imageB64 = serialdevice.readline()
-
-        # Read a frame from the serial port
-        frame_size = 320 * 240
-        frame_bytes = serialdevice.read(frame_size)
-
-        # Convert the bytes to a numpy array
-        frame_flat = np.frombuffer(frame_bytes, dtype=np.uint8)
-        frame = frame_flat.reshape((240, 320))
-
-        # find 0,1,0,1... pattern to sync
-        pattern = (0,1,0,1,0,1,0,1,0,1)
-        window_size = len(pattern)
-        for i in range(len(frame_flat) - window_size + 1):
-            # Check if the elements in the current window match the pattern
-            if np.array_equal(frame_flat[i:i+window_size], pattern):
-                print(i)
-                break
-
-
-
-        print("framerate: "+(str(1/(time.time()-t0))))
-        t0 = time.time()
+# connect to the first matching USB device; on errors the link is resynced,
+# flushed and only then reset (DTR/RTS) with backoff, see focusd.link. The
+# source looks the port up itself, so it finds the ESP32 again after a reset
+# even if it came back under a new name
+camera = LinkSupervisor(SerialCamSource(port=None, manufacturers=(manufacturer, "Microsoft"), profiler=profiler))
+camera.open()
+
+exposure = 10
+gain = 0
+# exposure and gain are sent between frames, the firmware reads commands with a 20 ms timeout
+camera.set_exposure(exposure, gain)
+
+# keep the spot's peak at 55-85 % of full scale
+autoExposure = AutoExposure(exposure=exposure, gain=gain)
+tracker = SpotTracker(roi_size=64)
+
+# record frames, timestamps and exposure to an HDF5 session (needs h5py), e.g. "esp32_session.h5"
+recordPath = None
+recorder = SessionRecorder(recordPath, attrs={"camera": "ESP32", "manufacturer": manufacturer}) if recordPath else None
+
+for t, frame in camera:
+        settings = autoExposure.update(tracker.update(frame)["roi"])
+        if settings:
+            camera.set_exposure(**settings)
+            exposure, gain = settings["exposure"], settings["gain"]
+
+        # handing the frame on to the recording is the publish stage
+        with profiler.stage("publish"):
+            if recorder is not None:
+                recorder.write(frame, t, meta={"exposure": exposure, "gain": gain})
+
+        profiler.frame_done()
         if cv2.waitKey(25) & 0xFF == ord('q'):
             break
         cv2.imshow("image", frame)
@@ -86,33 +76,13 @@ while True:
         frame = np.mean(frame,-1)
         #cv2.waitKey(-1)
         #plt.imshow(image), plt.show()
-        #serialdevice.flushInput()
-        #serialdevice.flushOutput()
         #tif.imsave("test_stack_esp32.tif", image, append=True)
-  except Exception as e:
-      print("Error")
-      print(e)
-      serialdevice.flushInput()
-      serialdevice.flushOutput()
-      iError += 1
-      #serialdevice.reset_input_buffer()
-      # reset device here
-      if iError % 20:
-            try:
-                # close the device - similar to hard reset
-                serialdevice.setDTR(False)
-                serialdevice.setRTS(True)
-                time.sleep(.1)
-                serialdevice.setDTR(False)
-                serialdevice.setRTS(False)
-                time.sleep(.5)
-                #serialdevice.close()
-            except Exception as e: pass
-            serialdevice = connect_to_usb_device()
-            nTrial = 0
-
-
-print(iError)
+
+
+print(camera.stats())
+camera.close()
+if recorder is not None:
+    recorder.close()
 
 #%%
 
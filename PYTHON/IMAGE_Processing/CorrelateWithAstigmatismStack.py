@@ -11,6 +11,13 @@ from importlib import reload
 import matplotlib.pyplot as plt
 import tifffile as tif
 
+import os
+import sys
+# focusd lives in RASPI/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "RASPI"))
+from focusd.correlation import TemplateBank, ZSearch, blur_templates, correlate_stack, crop_templates
+from focusd.pca import TemplateBasis
+
 psfparams = nip.PSF_PARAMS()
 psfparams.aberration_zernikes
 obj3d = nip.readim("MITO_SIM")
@@ -76,22 +83,23 @@ for i in range(30,70,1):
 
 plt.plot(focusvalue)
 #%% iterate over real data
-bestFocus = []
+# all frames against all templates in this process (the script has no main
+# guard for a pool of processes); the blurred templates and their spectra are
+# computed once (see focusd.correlation).
+# Templates are ranked by their normalised cross-correlation, which does not
+# depend on brightness and background; cropped to 64x64 they can shift by +-18 px
+zRange = range(30,70,1)
+templates = crop_templates(blur_templates(h3[zRange.start:zRange.stop], 2), 64)
+rois = np.stack([np.asarray(nip.extract(iFrame, (100,100), (50,180))) for iFrame in cleanData])
+scores = correlate_stack(rois, templates, score="ncc", mode="valid")
+bestFocus = list(scores.max(axis=1))
+bank = TemplateBank(templates, rois.shape[1:], mode="valid")
+
+for i, frame in enumerate(rois):
+    bestIndex = np.argmax(scores[i])
+    bestAstigmatism = h3[zRange[bestIndex],:,:]
+    mCorrelation = bank.ncc(frame, [bestIndex])[0]
 
-for iFrame in cleanData:
-    focusvalue=[]
-    frame = nip.gaussf(iFrame,0)
-    frame = nip.extract(frame, (100,100), (50,180))
-    for i in range(30,70,1):
-        astigmatism = nip.gaussf(h3[i,],2)
-        mCorrelation = scipy.signal.correlate(frame,astigmatism)
-        
-        focusvalue.append(np.mean(mCorrelation))
-    bestFocus.append(np.max(np.array(focusvalue)))
-    bestAstigmatism = h3[np.argmax(np.array(focusvalue)),:,:]
-    
-
-    
     plt.subplot(131)
     plt.title("Realdata")
     plt.imshow(frame)
@@ -99,7 +107,7 @@ for iFrame in cleanData:
     plt.title("Simulated PSF")
     plt.imshow(bestAstigmatism)
     plt.subplot(133)
-    plt.title("Calculated CC \n" + str(bestFocus[-1]))
+    plt.title("Calculated NCC \n" + str(bestFocus[i]))
     plt.imshow(mCorrelation)
     plt.savefig("cc"+str(i)+"png")
     plt.show()
@@ -107,9 +115,22 @@ for iFrame in cleanData:
 
 plt.plot(bestFocus)
 
+#%% coarse-to-fine z search: ~5 instead of 40 correlations per frame and a
+# continuous z (parabola through the best slice and its neighbours)
+search = ZSearch(bank, score="ncc", z=np.array(zRange))
+zEstimate = [search.search(frame)["z"] for frame in rois]
+plt.plot(zEstimate)
+
+#%% PCA basis of the whole PSF stack: z from 6 dot products per frame, 6 instead
+# of 100 images in memory; the ROI has to be centred on the spot like h3
+basis = TemplateBasis.fit(blur_templates(h3, 2), z=np.arange(h3.shape[0]), n_components=6)
+basis.save("astigmatism_basis.npz")
+print(f"{basis.n_components} components explain {basis.meta['explained_variance']:.4f} of the stack")
+zPCA = [basis.estimate(frame)["z"] for frame in rois]
+plt.plot(zPCA)
+
 #%%
 focusvalues=[]
-cleanData[,10]
 for iFrame in cleanData:
     iFrame = nip.gaussf(iFrame,5)
     focusValue = np.sum(np.mean(iFrame,1)/np.mean(iFrame)>1.05)/np.sum(np.mean(iFrame,0)/np.mean(iFrame)>1.05)
@@ -5,11 +5,17 @@ Created on Mon Jun 26 15:27:14 2023
 
 @author: bene
 """
+import os
+import sys
+
 import numpy as np
-from scipy.optimize import curve_fit
 import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D
 
+# focusd lives in RASPI/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "RASPI"))
+from focusd.multigauss import MultiGaussian2D, fit_spots
+
 # The two-dimensional domain of the fit.
 xmin, xmax, nx = -5, 4, 75
 ymin, ymax, ny = -3, 7, 150
@@ -70,16 +76,6 @@ Z += noise_sigma * np.random.randn(*Z.shape)
 plt.imshow(Z)
 plt.show()
 
-# This is the callable that is passed to curve_fit. M is a (2,N) array
-# where N is the total number of data points in Z, which will be ravelled
-# to one dimension.
-def _gaussian(M, *args):
-    x, y = M
-    arr = np.zeros(x.shape)
-    for i in range(len(args)//5):
-       arr += gaussian(x, y, *args[i*5:i*5+5])
-    return arr
-
 # Initial guesses to the fit parameters.
 guess_prms = [(0, 0, 1, 1, 2),
               (-1.5, 5, 5, 1, 3),
@@ -89,14 +85,11 @@ guess_prms = [(0, 0, 1, 1, 2),
 # Flatten the initial guess parameter list.
 p0 = [p for prms in guess_prms for p in prms]
 
-# We need to ravel the meshgrids of X, Y points to a pair of 1-D arrays.
-xdata = np.vstack((X.ravel(), Y.ravel()))
-# Do the fit, using our custom _gaussian function which understands our
-# flattened (ravelled) ordering of the data points.
-popt, pcov = curve_fit(_gaussian, xdata, Z.ravel(), p0)
-fit = np.zeros(Z.shape)
-for i in range(len(popt)//5):
-    fit += gaussian(X, Y, *popt[i*5:i*5+5])
+# The model evaluates all Gaussians on the grid of x, y at once (separable
+# profiles, analytic Jacobian), see focusd/multigauss.py.
+model = MultiGaussian2D(x, y)
+popt, pcov = model.fit(Z, p0)
+fit = model(popt).copy()
 print('Fitted parameters:')
 print(popt)
 
@@ -110,4 +103,9 @@ ax = fig.add_subplot(111)
 ax.imshow(Z, origin='bottom', cmap='plasma',
           extent=(x.min(), x.max(), y.min(), y.max()))
 ax.contour(X, Y, fit, colors='w')
-plt.show()
\ No newline at end of file
+plt.show()
+
+#%% without start values: add spots while the residual has a peak above the noise
+popt_auto, pcov_auto, n_spots = fit_spots(Z, x, y, max_spots=6, offset=False)
+print(f'{n_spots} spots found:')
+print(popt_auto.reshape(n_spots, 5))
@@ -11,6 +11,12 @@ from scipy.optimize import curve_fit
 import NanoImagingPack as nip
 import tifffile as tif 
 
+import os
+import sys
+# focusd lives in RASPI/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "RASPI"))
+from focusd.background import BackgroundModel
+
 def gaussian_2d(xy, amplitude, xo, yo, sigma_x, sigma_y, theta):
     x, y = xy
     a = (np.cos(theta)**2) / (2 * sigma_x**2) + (np.sin(theta)**2) / (2 * sigma_y**2)
@@ -48,9 +54,13 @@ for iFrame in realData:
         cleanData.append(iFrame)
         
 cleanData = np.array(cleanData)
-noisy_gaussian = cleanData/nip.gaussf(np.mean(cleanData, 0),20)
-noisy_gaussian = noisy_gaussian[5,:]
-noisy_gaussian=np.array(nip.gaussf(nip.extract(noisy_gaussian, (100,100), (50,180)),1))
+# running flat field up to frame 5, corrected on the ROI only
+background = BackgroundModel(sigma=20)
+for iFrame in cleanData[:6]:
+    background.update(iFrame)
+noisy_gaussian = np.asarray(nip.extract(cleanData[5], (100,100), (50,180)), dtype=float)
+background.correct(noisy_gaussian, (50,180))
+noisy_gaussian=np.array(nip.gaussf(noisy_gaussian,1))
 noisy_gaussian=nip.gaussf(noisy_gaussian.ravel(), 4)
 
 centerMax = np.unravel_index(noisy_gaussian.argmax(), cleanData.shape[1:]) 
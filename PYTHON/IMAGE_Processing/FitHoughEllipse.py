@@ -18,6 +18,15 @@ import numpy as np
 
 from skimage.transform import rescale, resize, downscale_local_mean
 
+import os
+import sys
+# focusd lives in RASPI/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "RASPI"))
+from focusd.background import BackgroundModel
+from focusd.diagnostics import DiagnosticsSink, render_roi_trace
+from focusd.focus_algorithm import edge_extents
+from focusd.orientation import OrientationTracker
+
 
 realData = tif.imread('/Users/bene/Dropbox/12h42m28s_rec_FocusLockCamera Bene.tif')
 
@@ -33,18 +42,33 @@ for iFrame in realData:
 #%%
 focusValues = []
 focusValues2 = []
+zValues = []
 cleanData = np.array(cleanData)
-cleanData = cleanData/nip.gaussf(np.mean(cleanData, 0),20)
+# flat field from a running background estimate instead of the mean over the
+# whole recording, so frames can be processed as they come in
+background = BackgroundModel(sigma=20)
+# unwraps the orientation (period pi/2) frame by frame instead of np.unwrap
+# over the whole recording, and turns it and the axis ratio into a signed z
+ellipseTracker = OrientationTracker(filter="median", window=3)
+# the per-frame figure goes to hough_ellipse_<i>.png from a rendering thread
+# instead of blocking the loop in plt.show(); every 5th frame, at most 2/s
+sink = DiagnosticsSink(render_roi_trace, outdir=".", prefix="hough_ellipse", every=5, max_jump=np.inf,
+                       thumbnail_size=100, worker="thread")
 
 
 for i in range(len(cleanData)):
-    noisy_gaussian = cleanData[i,:]
-    image_gray=np.array(nip.gaussf(nip.extract(noisy_gaussian, (100,100), (50,180)),1))
+    background.update(cleanData[i])
+    noisy_gaussian = np.asarray(nip.extract(cleanData[i], (100,100), (50,180)), dtype=float)
+    background.correct(noisy_gaussian, (50,180))
+    image_gray=np.array(nip.gaussf(noisy_gaussian,1))
     
     image_gray = rescale(image_gray, 1, anti_aliasing=False)
     edges = canny(image_gray,2) 
 
-    focusValues2.append(np.sum(np.sum(edges,1)>0)/np.sum(np.sum(edges,0)>0))
+    # rows/columns covered by the spot outline from its projections instead of
+    # counting the rows/columns with Canny edges (focusd.benchmarks.edges)
+    extent_x, extent_y = edge_extents(image_gray)
+    focusValues2.append(extent_y/extent_x)
     
     #%
     # Perform a Hough Transform
@@ -62,25 +86,16 @@ for i in range(len(cleanData)):
     # Draw the ellipse on the original image
     cy, cx = ellipse_perimeter(yc, xc, a, b, orientation)
     image_gray[cy, cx] = 1
-    # Draw the edge (white) and the resulting ellipse (red)
-    edges = color.gray2rgb(img_as_ubyte(edges))
-    edges[cy, cx] = 0
     
-    focusValues.append(orientation )
+    state = ellipseTracker.update(orientation, best[3], best[4])
+    focusValues.append(state["smoothed"])
+    zValues.append(state["z"])
 
-    plt.subplot(131)
-    plt.title('Original picture')
-    plt.imshow(image_gray)
-    plt.subplot(132)    
-    plt.title('Edge (white) and result (red)')
-    plt.imshow(edges)
-    plt.subplot(133)
-    plt.title('Edge (white) and result (red)')
-    plt.plot(focusValues)
-    plt.plot(focusValues2)
+    # picture with the fitted ellipse next to both focus values
+    sink.submit(i, {"focus": state["smoothed"], "trace": np.column_stack((focusValues, focusValues2))},
+                roi=image_gray)
 
-    #plt.savefig("astimatism_hough"+str(i)+".png")
-    plt.show()
-    
-plt.plot(np.unwrap(np.array(focusValues), period=np.pi/2))
-plt.plot(focusValues2)
\ No newline at end of file
+sink.close()
+plt.plot(focusValues)
+plt.plot(focusValues2)
+plt.plot(zValues)
\ No newline at end of file
@@ -13,6 +13,13 @@ import matplotlib.pyplot as plt
 
 from scipy.ndimage import gaussian_filter
 
+import os
+import sys
+# focusd lives in RASPI/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "RASPI"))
+from focusd.diagnostics import DiagnosticsSink, render_roi_trace
+from focusd.tracker import SpotTracker
+
 H=240//2
 W=320//2
 
@@ -29,6 +36,12 @@ window_size = 5
   
     
 byte_array_length = H * W * 2 + 30 # extra delimeter
+# plots go to diagnostics/ from a rendering thread (no main guard for a worker
+# process), every 15th frame at most 1/s
+sink = DiagnosticsSink(render_roi_trace, prefix="ratioXY", every=15, max_rate=1, max_jump=np.inf, worker="thread")
+iFrame = 0
+# follows the spot with a fixed 20x20 ROI (the crop was hard-coded to [55:75, 120:140])
+tracker = SpotTracker(roi_size=20, auto_size=False, sigma_locate=16)
 while(1):
     # Read the data from serial
     if 1:
@@ -41,7 +54,7 @@ while(1):
         np_array = np.frombuffer(data, dtype=np.uint16)
         np_array = np_array.reshape((int(H), int(W)))
         
-        np_array = np_array[55:75, 120:140]
+        np_array = tracker.update(np_array)["roi"]
         # Apply a Gaussian filter with sigma=1
         np_array = gaussian_filter(np_array, sigma=0.5)
 
@@ -66,8 +79,8 @@ while(1):
         
 
         # Print the resulting matrix
-        plt.subplot(121), plt.imshow(np_array), plt.show()
-        plt.subplot(122), plt.plot(np.array(allMeasurements)), plt.show()
+        sink.submit(iFrame, {"focus": rolling_average, "trace": np.array(allMeasurements[-500:])}, roi=np_array)
+        iFrame += 1
 #        plt.imsave('test.png', matrix)
     
 '''
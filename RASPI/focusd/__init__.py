@@ -0,0 +1,62 @@
+"""
+focusd - focus-lock service for the openUC2 BluFocus autofocus module.
+
+Importing focusd (or one of its modules) loads NumPy only. SciPy,
+NanoImagingPack, matplotlib, skimage and tifffile are imported where a feature
+first needs them, and the classes below are loaded on first access:
+
+    import focusd
+    metric = focusd.FocusMetric(backend="iir")   # imports focusd.focus_algorithm
+
+A service that wants the first frame to be as fast as the others calls
+preload() in the background while the camera starts up.
+"""
+import importlib
+import threading
+
+_LAZY = {
+    "FocusMetric": "focus_algorithm",
+    "Calibration": "calibration",
+    "CameraManager": "manager",
+    "FocusLock": "controller",
+    "PID": "controller",
+    "RateLimiter": "controller",
+    "DiagnosticsSink": "diagnostics",
+    "Profiler": "profiling",
+    "AstigmaticSpot": "simulation",
+    "make_metric": "metrics",
+}
+
+__all__ = sorted(_LAZY) + ["preload"]
+
+# the modules the live focus path needs after startup
+PRELOAD = ("scipy.optimize", "scipy.ndimage", "scipy.signal", "scipy.interpolate")
+
+
+def __getattr__(name):
+    if name in _LAZY:
+        value = getattr(importlib.import_module("." + _LAZY[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
+
+
+def preload(modules=PRELOAD, background=True):
+    """Import the deferred dependencies ahead of their first use, by default
+    in a daemon thread; returns the thread (or None)."""
+    def load():
+        for module in modules:
+            try:
+                importlib.import_module(module)
+            except ImportError:
+                pass
+    if not background:
+        load()
+        return None
+    thread = threading.Thread(target=load, name="focusd-preload", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,211 @@
+"""
+asyncio frame sources, so acquisition, focus metric, REST (FastAPI) and CAN
+can share one event loop (§4.1 of the software specification).
+
+AsyncSerialCamSource talks to the ESP32 camera through pyserial-asyncio and
+never blocks the loop while a frame is in flight. AsyncSource runs any
+blocking FrameSource (Picamera2Source, ReplaySource, LinkSupervisor) in its
+own thread. Both are async iterators of (t, frame). offload() applies the
+numeric work to every frame in an executor and overlaps it with the
+acquisition of the next frames:
+
+    async with AsyncSerialCamSource() as camera:
+        async for t, result in offload(camera, metric.evaluate):
+            state["focus"] = result["focus"]
+
+The fits release the GIL only partly; a ProcessPoolExecutor keeps them off
+the event loop thread entirely (fn and its results have to be picklable).
+"""
+import asyncio
+import concurrent.futures
+import logging
+import time
+
+import numpy as np
+
+from .sources import find_ports, find_sync
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncFrameSource:
+    meta = {}
+
+    async def open(self):
+        pass
+
+    async def read(self):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+    def set_exposure(self, exposure=None, gain=None):
+        raise NotImplementedError(f"{type(self).__name__} has no exposure control")
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        item = await self.read()
+        if item is None:
+            raise StopAsyncIteration
+        return item
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+class AsyncSerialCamSource(AsyncFrameSource):
+    """SerialCamSource on the event loop (needs pyserial-asyncio).
+
+    Same protocol and arguments: "\\n" requests a frame, set_exposure queues
+    "t"/"g" commands of which one is sent after each frame, and the next
+    request waits for what is left of command_gap. A frame that does not
+    arrive within timeout raises TimeoutError and the partial data is
+    discarded.
+    """
+
+    def __init__(self, port=None, baudrate=2000000, shape=(240, 320), timeout=1.0, command_gap=0.03):
+        self.port = port
+        self.baudrate = baudrate
+        self.shape = shape
+        self.timeout = timeout
+        self.command_gap = command_gap
+        self.reader = None
+        self.writer = None
+        self.offset = 0
+        self.meta = {}
+        self._pending = {}
+        self._last_command = -np.inf
+
+    async def open(self):
+        import serial_asyncio
+
+        if self.port is None:
+            ports = find_ports()
+            if not ports:
+                raise IOError("No matching USB device found")
+            self.port = ports[0]
+        self.reader, self.writer = await serial_asyncio.open_serial_connection(url=self.port,
+                                                                               baudrate=self.baudrate)
+        logger.info("connected to %s", self.port)
+
+    def set_exposure(self, exposure=None, gain=None):
+        """Queue exposure (0-1200) and/or gain (0-30) for the next frame."""
+        if exposure is not None and exposure != self.meta.get("exposure"):
+            self._pending["t"] = f"t{int(round(exposure))}"
+        if gain is not None and gain != self.meta.get("gain"):
+            self._pending["g"] = f"g{int(round(gain))}"
+
+    async def read(self):
+        wait = self._last_command + self.command_gap - time.perf_counter()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        self.writer.write(b"\n")
+        t = time.time()
+        size = self.shape[0] * self.shape[1]
+        try:
+            data = await asyncio.wait_for(self.reader.readexactly(size), self.timeout)
+        except asyncio.IncompleteReadError as e:
+            raise TimeoutError(f"got {len(e.partial)} of {size} bytes from {self.port}") from None
+        except asyncio.TimeoutError:
+            # readexactly leaves what it got in the buffer, drop it with the rest of the frame
+            await self.drain()
+            raise TimeoutError(f"no frame from {self.port} within {self.timeout} s") from None
+        flat = np.frombuffer(data, dtype=np.uint8)
+        self.offset = find_sync(flat)
+        if self.offset > 0:
+            flat = np.roll(flat, -self.offset)
+        if self._pending:
+            key, command = self._pending.popitem()
+            self.writer.write((command + "\n").encode())
+            self._last_command = time.perf_counter()
+            self.meta[{"t": "exposure", "g": "gain"}[key]] = float(command[1:])
+        return t, flat.reshape(self.shape)
+
+    async def drain(self, quiet=0.02):
+        """Drop bytes until the line has been quiet for quiet seconds."""
+        dropped = 0
+        while True:
+            try:
+                chunk = await asyncio.wait_for(self.reader.read(65536), quiet)
+            except asyncio.TimeoutError:
+                return dropped
+            if not chunk:
+                return dropped
+            dropped += len(chunk)
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = self.reader = None
+
+
+class AsyncSource(AsyncFrameSource):
+    """Any blocking FrameSource, read in a thread of its own so that a slow
+    frame only waits on that thread."""
+
+    def __init__(self, source):
+        self.source = source
+        self._thread = None
+
+    @property
+    def meta(self):
+        return self.source.meta
+
+    def set_exposure(self, exposure=None, gain=None):
+        self.source.set_exposure(exposure, gain)
+
+    async def _call(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._thread, fn, *args)
+
+    async def open(self):
+        # one thread, so open/read/close keep the order the source expects
+        self._thread = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="focusd-source")
+        await self._call(self.source.open)
+
+    async def read(self):
+        return await self._call(self.source.read)
+
+    async def close(self):
+        if self._thread is not None:
+            await self._call(self.source.close)
+            self._thread.shutdown()
+            self._thread = None
+
+
+async def offload(frames, fn, executor=None, depth=2):
+    """Yield (t, fn(frame)) for the async iterable frames, with fn running in
+    executor. The default executor has a single thread, so a stateful fn
+    (tracker, background model) sees the frames one after the other. Up to
+    depth frames are queued for fn while the next one is acquired; results
+    keep the frame order. An exception of fn is returned as the result
+    instead of ending the stream.
+    """
+    loop = asyncio.get_running_loop()
+    own = executor is None
+    if own:
+        executor = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="focusd-offload")
+    pending = []
+
+    async def result(t, future):
+        try:
+            return t, await future
+        except Exception as e:
+            return t, e
+
+    try:
+        async for t, frame in frames:
+            pending.append((t, loop.run_in_executor(executor, fn, frame)))
+            if len(pending) >= depth:
+                yield await result(*pending.pop(0))
+        for t, future in pending:
+            yield await result(t, future)
+    finally:
+        if own:
+            executor.shutdown(wait=False)
@@ -0,0 +1,136 @@
+"""
+Running background / flat-field estimate for streaming correction.
+
+Fit2DGaussian.py and FitHoughEllipse.py divide every frame by
+gaussf(mean(all frames), 20), which needs the whole recording before the first
+frame can be processed; processautofocus.py subtracts a constant 40.
+BackgroundModel keeps an incrementally updated estimate instead:
+
+    method="ema"         exponential moving average (the running version of
+                         the mean over the recording; a cumulative mean for
+                         the first 1/alpha frames)
+    method="percentile"  percentile over the last `window` frames, which
+                         ignores the spot as long as it moves
+
+The estimate lives on a grid downsampled by `downsample` (the background is
+smooth at sigma=20 anyway), so an update costs a strided read of the frame.
+After every update during the first `refresh` frames (while the estimate is
+still settling) and every `refresh` updates afterwards it is blurred with
+sigma and turned into a reciprocal gain map (mode="divide", flat field) or an offset map (mode="subtract").
+correct() then applies the map to a ROI only, in place:
+
+    background = BackgroundModel(sigma=20)
+    for frame in frames:
+        background.update(frame)
+        roi = core.extract(frame, (100, 100), (50, 180)).astype(float)
+        background.correct(roi, (50, 180))
+"""
+import numpy as np
+
+from . import blur
+
+METHODS = ("ema", "percentile")
+MODES = ("divide", "subtract")
+
+
+class BackgroundModel:
+    def __init__(self, method="ema", mode="divide", sigma=20, alpha=0.02, percentile=20, window=32,
+                 downsample=4, refresh=10, backend="box", channel=-2):
+        if method not in METHODS:
+            raise ValueError(f"Unknown background method {method!r}, use one of {METHODS}")
+        if mode not in MODES:
+            raise ValueError(f"Unknown correction mode {mode!r}, use one of {MODES}")
+        self.method = method
+        self.mode = mode
+        self.sigma = sigma
+        self.alpha = alpha
+        self.percentile = percentile
+        self.window = window
+        self.downsample = downsample
+        self.refresh = refresh
+        self.backend = backend
+        self.channel = channel
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.estimate = None
+        self._stack = None
+        self._map = None
+        self._shape = None
+
+    def _small(self, frame):
+        frame = np.asarray(frame)
+        if frame.ndim == 3:
+            frame = frame[:, :, self.channel]
+        d = self.downsample
+        h, w = frame.shape[0] // d * d, frame.shape[1] // d * d
+        # block mean, so the estimate is not aliased by the camera noise
+        small = frame[:h, :w].reshape(h // d, d, w // d, d).mean(axis=(1, 3), dtype=np.float32)
+        return frame.shape, small
+
+    def update(self, frame):
+        """Add frame to the estimate; the map is recomputed with every frame up
+        to refresh and every refresh frames after that."""
+        self._shape, small = self._small(frame)
+        self.count += 1
+        if self.method == "ema":
+            if self.estimate is None:
+                self.estimate = small
+            else:
+                alpha = max(self.alpha, 1.0 / self.count)
+                self.estimate += alpha * (small - self.estimate)
+        else:
+            if self._stack is None:
+                self._stack = np.repeat(small[None], self.window, axis=0)
+            # count already includes this frame, the first one goes to slot 0
+            self._stack[(self.count - 1) % self.window] = small
+        if self._map is None or self.count <= self.refresh or self.count % self.refresh == 0:
+            self._update_map()
+
+    def _update_map(self):
+        if self.method == "percentile":
+            n = min(self.count, self.window)
+            self.estimate = np.percentile(self._stack[:n], self.percentile, axis=0).astype(np.float32)
+        smooth = blur.gaussf(self.estimate, self.sigma / self.downsample, self.backend).astype(np.float32)
+        if self.mode == "divide":
+            self._map = 1.0 / np.maximum(smooth, np.finfo(np.float32).tiny)
+        else:
+            self._map = smooth
+
+    @property
+    def map(self):
+        """Reciprocal gain (divide) or offset (subtract) on the downsampled grid."""
+        return self._map
+
+    def patch(self, shape, center):
+        """The map for a ROI of shape cut at center (as core.extract), at full
+        resolution; pixels outside the sensor take the nearest edge value."""
+        d = self.downsample
+        h, w = self._map.shape
+        ys = np.arange(shape[0]) + (center[0] - shape[0] // 2)
+        xs = np.arange(shape[1]) + (center[1] - shape[1] // 2)
+        ys = np.clip(ys // d, 0, h - 1)
+        xs = np.clip(xs // d, 0, w - 1)
+        return self._map[np.ix_(ys, xs)]
+
+    def correct(self, roi, center, out=None):
+        """Flat-field (or offset) correct roi, cut at center from the frame.
+
+        Works in place by default, so roi has to be a float array; pass out
+        to keep it. Before the first update roi is returned unchanged.
+        """
+        if out is None:
+            out = roi
+        elif out is not roi:
+            out[...] = roi
+        if self._map is None:
+            return out
+        patch = self.patch(out.shape[:2], center)
+        if out.ndim == 3:
+            patch = patch[:, :, None]
+        if self.mode == "divide":
+            out *= patch
+        else:
+            out -= patch
+        return out
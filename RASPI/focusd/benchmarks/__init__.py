@@ -0,0 +1,4 @@
+"""
+Benchmarks for the focusd pipeline, run e.g. as `python -m focusd.benchmarks.blur`
+from the RASPI folder.
+"""
@@ -0,0 +1,54 @@
+"""
+Time the blur backends at the sigmas used in the pipeline (0.5 in the ESP32
+reader, 11 for smoothing the crop, 111 for locating the spot) on a 600x600
+frame and on a 600 sample projection.
+"""
+import argparse
+import timeit
+
+import numpy as np
+from scipy import ndimage
+
+from focusd import blur
+
+SIGMAS = (0.5, 11, 111)
+
+
+def spot(shape, seed=0):
+    """Elliptical laser spot on a noisy background, roughly like the recordings."""
+    grids = np.meshgrid(*[np.arange(n) - n / 2 for n in shape], indexing="ij")
+    widths = (40, 80)[:len(shape)]
+    im = 20 + 200 * np.exp(-0.5 * sum((g / w)**2 for g, w in zip(grids, widths)))
+    return im + np.random.default_rng(seed).normal(0, 5, shape)
+
+
+def bench(shape, sigmas=SIGMAS, backends=blur.BACKENDS, repeat=5):
+    im = spot(shape)
+    rows = []
+    for sigma in sigmas:
+        # iir and box pad like mode="nearest"
+        reference = ndimage.gaussian_filter(im, sigma, mode="nearest")
+        for backend in backends:
+            try:
+                out = blur.gaussf(im, sigma, backend)
+            except ImportError:
+                continue
+            number = 3
+            t = min(timeit.repeat(lambda: blur.gaussf(im, sigma, backend), number=number, repeat=repeat)) / number
+            err = np.max(np.abs(out - reference)) / np.max(reference)
+            # iir/box below their sigma range run ndimage, report that instead of the requested name
+            used = blur.effective_backend(backend, sigma)
+            rows.append((shape, sigma, backend if used == backend else f"{backend}->{used}", t * 1e3, err))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=600)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'shape':>12} {'sigma':>6} {'backend':>14} {'ms':>9} {'rel err':>9}")
+    for shape in ((args.size, args.size), (args.size,)):
+        for shape, sigma, backend, ms, err in bench(shape, repeat=args.repeat):
+            print(f"{str(shape):>12} {sigma:>6} {backend:>14} {ms:9.3f} {err:9.4f}")
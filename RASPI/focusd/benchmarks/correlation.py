@@ -0,0 +1,109 @@
+"""
+Template matching of CorrelateWithAstigmatismStack.py on simulated data.
+
+Templates are noise-free astigmatic spots over a z range with unit energy
+(instead of the NanoImagingPack PSF stack h3), frames are background
+corrected noisy spots at random z with a little jitter. Compares the per-frame
+time of the scipy.signal.correlate loop of the script with TemplateBank and
+with correlate_stack in a process pool, and checks that all of them pick the
+same templates. score="ncc" (templates cropped to 64x64) is timed and checked
+for the same z error with frames three times brighter on a background. On a
+slowly drifting z sequence, ZSearch is compared with scoring every template,
+and TemplateBasis (PCA) with and without the jitter of the spot position.
+
+    python -m focusd.benchmarks.correlation --frames 200 --processes 4
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+from focusd.correlation import TemplateBank, ZSearch, blur_templates, correlate_stack, crop_templates
+from focusd.pca import TemplateBasis
+from focusd.simulation import AstigmaticSpot
+
+
+def make_data(n_frames, n_templates=40, size=100, seed=0, drift=False, jitter=2.0):
+    spot = AstigmaticSpot(shape=(size, size), sigma0=3, noise=0)
+    z_templates = np.linspace(-30, 30, n_templates)
+    templates = blur_templates(spot.render_batch(z_templates) - spot.background, 2)
+    templates /= np.linalg.norm(templates, axis=(-2, -1), keepdims=True)
+    rng = np.random.default_rng(seed)
+    spot = AstigmaticSpot(shape=(size, size), sigma0=3, noise=3, seed=seed)
+    z = 20 * np.sin(np.arange(n_frames) / 10) if drift else rng.uniform(-25, 25, n_frames)
+    frames = np.stack([spot.render(zi, center=rng.normal(0, jitter, 2)) for zi in z]) - spot.background
+    return z_templates, templates, z, frames
+
+
+def scipy_loop(frames, templates):
+    import scipy.signal
+
+    return np.array([[np.max(scipy.signal.correlate(frame, template)) for template in templates]
+                     for frame in frames])
+
+
+def timed(fn, *args, **kwargs):
+    t0 = time.perf_counter()
+    out = fn(*args, **kwargs)
+    return out, time.perf_counter() - t0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=64)
+    parser.add_argument("--templates", type=int, default=40)
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    z_templates, templates, z, frames = make_data(args.frames, args.templates)
+    n_ref = min(len(frames), 16)
+    reference, t_ref = timed(scipy_loop, frames[:n_ref], templates)
+    bank = TemplateBank(templates, frames.shape[1:])
+    single, t_bank = timed(lambda: np.stack([bank.scores(frame) for frame in frames]))
+    pooled, t_pool = timed(correlate_stack, frames, templates, processes=args.processes)
+    pooled32, t_pool32 = timed(correlate_stack, frames, templates, processes=args.processes, dtype=np.float32)
+    print(f"{len(frames)} frames x {len(templates)} templates, {os.cpu_count()} cores")
+    print(f"scipy.signal.correlate loop   {t_ref / n_ref * 1e3:7.1f} ms/frame")
+    print(f"TemplateBank                  {t_bank / len(frames) * 1e3:7.1f} ms/frame")
+    print(f"correlate_stack ({args.processes} processes) {t_pool / len(frames) * 1e3:7.1f} ms/frame")
+    print(f"  float32                     {t_pool32 / len(frames) * 1e3:7.1f} ms/frame")
+    same = np.argmax(reference, axis=1) == np.argmax(pooled[:n_ref], axis=1)
+    print(f"same template as scipy: {same.mean():.0%}, "
+          f"max rel. deviation {np.max(np.abs(pooled[:n_ref] - reference) / np.abs(reference)):.1e} "
+          f"(float32 {np.max(np.abs(pooled32[:n_ref] - reference) / np.abs(reference)):.1e})")
+    error = z_templates[np.argmax(pooled, axis=1)] - z
+    print(f"z error of the best template (max score): rms {np.sqrt(np.mean(error**2)):.1f} um")
+
+    def rms(scores):
+        return np.sqrt(np.mean((z_templates[np.argmax(scores, axis=1)] - z)**2))
+
+    ncc_bank = TemplateBank(crop_templates(templates, 64), frames.shape[1:], mode="valid")
+    ncc, t_ncc = timed(lambda: np.stack([ncc_bank.scores(frame, "ncc") for frame in frames]))
+    bright = 3 * frames + 50
+    ncc_bright = np.stack([ncc_bank.scores(frame, "ncc") for frame in bright])
+    max_bright = np.stack([bank.scores(frame) for frame in bright])
+    print(f"ncc {t_ncc / len(frames) * 1e3:.1f} ms/frame, rms {rms(ncc):.1f} um; "
+          f"3x brighter + 50: ncc rms {rms(ncc_bright):.1f} um, max rms {rms(max_bright):.1f} um")
+
+    z_templates, templates, z, frames = make_data(args.frames, args.templates, seed=1, drift=True)
+    bank = TemplateBank(crop_templates(templates, 64), frames.shape[1:], mode="valid")
+    search = ZSearch(bank, score="ncc", z=z_templates)
+    results, t_search = timed(lambda: [search.search(frame) for frame in frames])
+    full, t_full = timed(lambda: np.stack([bank.scores(frame, "ncc") for frame in frames]))
+    z_search = np.array([r["z"] for r in results])
+    print(f"drifting z, ncc: all templates {t_full / len(frames) * 1e3:.1f} ms/frame, rms "
+          f"{np.sqrt(np.mean((z_templates[np.argmax(full, axis=1)] - z)**2)):.2f} um; ZSearch "
+          f"{t_search / len(frames) * 1e3:.1f} ms/frame, "
+          f"{np.mean([r['evaluated'] for r in results]):.1f} templates/frame, rms "
+          f"{np.sqrt(np.mean((z_search - z)**2)):.2f} um")
+
+    basis = TemplateBasis.fit(templates, z_templates)
+    for jitter in (2.0, 0.0):
+        _, _, z, frames = make_data(args.frames, args.templates, seed=1, drift=True, jitter=jitter)
+        for method in ("nearest", "regression"):
+            results, t_pca = timed(lambda: [basis.estimate(frame, method) for frame in frames])
+            error = np.array([r["z"] for r in results]) - z
+            print(f"PCA ({basis.n_components} components, {len(templates) / basis.n_components:.0f}x less memory), "
+                  f"jitter {jitter:.0f} px, {method}: {t_pca / len(frames) * 1e3:.2f} ms/frame, "
+                  f"rms {np.sqrt(np.mean(error**2)):.2f} um")
@@ -0,0 +1,120 @@
+"""
+Edge-extent focus value of FitHoughEllipse.py with and without Canny.
+
+focusValues2 of the script is rows over columns of canny(image_gray, 2);
+focus_algorithm.edge_extents gets the extents from the max projections. Both
+are computed on
+
+  * DATA/HoughTransformEllipseSeries: image_gray is recovered from the
+    "Original picture" panel of the saved figures (viridis colours mapped back
+    to values, resampled to the 100x100 ROI; the Hough ellipse drawn into it
+    stays), so the script's own recording is not needed;
+  * a synthetic z-sweep of AstigmaticSpot, smoothed like image_gray.
+
+Canny also finds edges in the background (the bright band at the top of some
+frames), so the comparison is made with all edges and with the edges of the
+spot only (the connected edge nearest to the maximum). Prints the series,
+their (rank) correlation and the time per 100x100 ROI.
+
+    python -m focusd.benchmarks.edges
+"""
+import argparse
+import glob
+import os
+import re
+import time
+
+import numpy as np
+from scipy import ndimage
+
+from focusd.focus_algorithm import EDGE_MODES, edge_extents
+from focusd.simulation import AstigmaticSpot, camera_noise
+
+DATA = os.path.join(os.path.dirname(__file__), "..", "..", "..", "DATA", "HoughTransformEllipseSeries")
+
+
+def panel(path, shape=(100, 100)):
+    """image_gray of the left panel of a saved FitHoughEllipse.py figure."""
+    import matplotlib.pyplot as plt
+    from matplotlib import colormaps
+
+    rgb = plt.imread(path)[..., :3]
+    frame = rgb.sum(-1) < 0.3
+    # the black axes frame: first two vertical lines, then the horizontal ones between them
+    columns = np.flatnonzero(frame.sum(0) > 80)
+    left = columns[0]
+    right = columns[columns > left + 10][0]
+    rows = np.flatnonzero(frame[:, left:right + 1].sum(1) > (right - left) // 2)
+    top = rows[0]
+    bottom = rows[rows > top + 10][0]
+    box = rgb[top + 1:bottom, left + 1:right]
+    y = ((np.arange(shape[0]) + 0.5) * box.shape[0] / shape[0]).astype(int)
+    x = ((np.arange(shape[1]) + 0.5) * box.shape[1] / shape[1]).astype(int)
+    box = box[y][:, x]
+    lut = colormaps["viridis"](np.linspace(0, 1, 256))[:, :3]
+    return np.argmin(((box[..., None, :] - lut)**2).sum(-1), axis=-1) / 255.0
+
+
+def canny_ratio(image_gray, spot_only=False):
+    from skimage.feature import canny
+
+    edges = canny(image_gray, 2)
+    if spot_only:
+        labels, _ = ndimage.label(edges, np.ones((3, 3)))
+        y, x = np.unravel_index(np.argmax(image_gray), image_gray.shape)
+        ey, ex = np.nonzero(edges)
+        nearest = np.argmin((ey - y)**2 + (ex - x)**2)
+        edges = labels == labels[ey[nearest], ex[nearest]]
+    return np.sum(np.sum(edges, 1) > 0) / np.sum(np.sum(edges, 0) > 0)
+
+
+def projection_ratio(image_gray, mode):
+    extent_x, extent_y = edge_extents(image_gray, mode=mode)
+    return extent_y / extent_x
+
+
+def rank_correlation(a, b):
+    return np.corrcoef(np.argsort(np.argsort(a)), np.argsort(np.argsort(b)))[0, 1]
+
+
+def per_call(fn, image, repeat=200):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn(image)
+    return (time.perf_counter() - t0) / repeat
+
+
+def compare(name, images):
+    canny = np.array([canny_ratio(im) for im in images])
+    spot = np.array([canny_ratio(im, spot_only=True) for im in images])
+    print(f"{name} ({len(images)} frames)")
+    print(f"  {'canny':>22} " + " ".join(f"{v:5.2f}" for v in canny))
+    print(f"  {'canny (spot edges)':>22} " + " ".join(f"{v:5.2f}" for v in spot))
+    for mode in EDGE_MODES:
+        values = np.array([projection_ratio(im, mode) for im in images])
+        print(f"  {mode:>22} " + " ".join(f"{v:5.2f}" for v in values))
+        print(f"  {'':>22} correlation with canny {np.corrcoef(canny, values)[0, 1]:.2f} "
+              f"(rank {rank_correlation(canny, values):.2f}), with the spot edges "
+              f"{np.corrcoef(spot, values)[0, 1]:.2f} (rank {rank_correlation(spot, values):.2f})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", default=DATA)
+    parser.add_argument("--frames", type=int, default=41, help="frames of the synthetic sweep")
+    args = parser.parse_args()
+
+    files = sorted(glob.glob(os.path.join(args.data, "*.png")), key=lambda f: int(re.findall(r"\d+", f)[-1]))
+    if files:
+        compare(os.path.basename(os.path.normpath(args.data)), [panel(f) for f in files])
+
+    z = np.linspace(-30, 30, args.frames)
+    frames = camera_noise(AstigmaticSpot(shape=(100, 100)).render_batch(z), np.random.default_rng(0))
+    images = [ndimage.gaussian_filter(frame.astype(float), 1) for frame in frames]
+    # canny's thresholds are absolute, scale like the panels
+    images = [(im - im.min()) / (im.max() - im.min()) for im in images]
+    compare(f"synthetic z {z[0]:.0f}..{z[-1]:.0f} um", images)
+
+    image = images[len(images) // 2]
+    print(f"per 100x100 ROI: canny {per_call(canny_ratio, image, 20) * 1e3:.2f} ms, " + ", ".join(
+        f"{mode} {per_call(lambda im: projection_ratio(im, mode), image) * 1e3:.3f} ms" for mode in EDGE_MODES))
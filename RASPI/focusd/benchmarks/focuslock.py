@@ -0,0 +1,111 @@
+"""
+Closed-loop focus lock on a simulated stage: settling time after a z step,
+jitter while locked and disturbance-rejection bandwidth as a function of the
+acquisition period (frame rate) and the compute latency (frame -> move).
+
+Each frame renders the synthetic astigmatic spot at the current defocus,
+estimates sx/sy from its moments and converts it to a z error through a
+Calibration built from a simulated sweep, exactly like the real loop.
+
+    python -m focusd.benchmarks.focuslock --fps 7.5 15 30 --latency 0.005 0.02 0.04 0.08
+"""
+import argparse
+import heapq
+
+import numpy as np
+
+from focusd.calibration import Calibration
+from focusd.controller import PID, FocusLock, RateLimiter
+from focusd.focus_algorithm import moment_sigmas
+from focusd.simulation import AstigmaticSpot, SimulatedStage
+
+
+def measure(spot, z):
+    im = spot.render(z) - spot.background
+    im[im < 3 * spot.noise] = 0
+    sx, sy = moment_sigmas(im)
+    return sx / sy
+
+
+def calibrate(spot, z=np.linspace(-30, 30, 121)):
+    return Calibration.build(z, [measure(spot, zi) for zi in z])
+
+
+def simulate(disturbance, duration, fps, latency, spot, cal, pid_kwargs=None, max_step=5.0,
+             max_velocity=500.0):
+    """Run the loop; returns capture times and the true defocus at each capture."""
+    stage = SimulatedStage(max_velocity=max_velocity)
+    lock = FocusLock(stage, PID(**(pid_kwargs or {})), RateLimiter(max_step=max_step), max_error=50)
+    events = [(k / fps, 0, k) for k in range(int(duration * fps))]
+    heapq.heapify(events)
+    t_capture, defocus = [], []
+    while events:
+        t, kind, payload = heapq.heappop(events)
+        stage.advance(t)
+        if kind == 0:
+            z = stage.position + disturbance(t)
+            t_capture.append(t)
+            defocus.append(z)
+            # the z error is published compute latency after the capture
+            heapq.heappush(events, (t + latency, 1, cal.z_offset(measure(spot, z))))
+        else:
+            lock.update(payload, t)
+    return np.array(t_capture), np.array(defocus)
+
+
+def settling_time(t, err, t_step, band):
+    after = t >= t_step
+    outside = np.nonzero(after & (np.abs(err) > band))[0]
+    if len(outside) == 0:
+        return 0.0
+    if outside[-1] == len(t) - 1:
+        return np.inf
+    return t[outside[-1] + 1] - t_step
+
+
+def rejection(fps, latency, spot, cal, freq, amplitude=2.0, periods=6, **kwargs):
+    """|residual| / |disturbance| for a sinusoidal drift at freq (Hz)."""
+    duration = max(periods / freq, 20 / fps)
+    t, err = simulate(lambda t: amplitude * np.sin(2 * np.pi * freq * t), duration, fps, latency, spot, cal, **kwargs)
+    keep = t > duration / 3
+    lockin = np.abs(np.mean(err[keep] * np.exp(-2j * np.pi * freq * t[keep]))) * 2
+    return lockin / amplitude
+
+
+def bandwidth(fps, latency, spot, cal, **kwargs):
+    """Highest drift frequency that is still attenuated by 3 dB."""
+    for freq in np.geomspace(0.02, fps / 2, 25):
+        if rejection(fps, latency, spot, cal, freq, **kwargs) > 1 / np.sqrt(2):
+            return freq
+    return fps / 2
+
+
+def bench(fps, latency, spot, cal, step=5.0, **kwargs):
+    t_step = 1.0
+    t, err = simulate(lambda t: step * (t >= t_step), t_step + 10.0, fps, latency, spot, cal, **kwargs)
+    locked = t > t.max() - 4.0
+    jitter = np.std(err[locked])
+    settle = settling_time(t, err, t_step, band=max(0.05 * step, 3 * jitter))
+    return {"fps": fps, "latency": latency, "settling": settle, "jitter": jitter,
+            "overshoot": max(0.0, -np.min(err[t >= t_step]) / step) if step > 0 else 0.0,
+            "bandwidth": bandwidth(fps, latency, spot, cal, **kwargs)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fps", type=float, nargs="+", default=[7.5, 15, 30])
+    parser.add_argument("--latency", type=float, nargs="+", default=[0.005, 0.02, 0.04, 0.08])
+    parser.add_argument("--kp", type=float, default=0.2)
+    parser.add_argument("--ki", type=float, default=5.0)
+    parser.add_argument("--noise", type=float, default=2.0, help="pixel noise of the synthetic spot")
+    args = parser.parse_args()
+
+    spot = AstigmaticSpot(noise=args.noise, seed=0)
+    cal = calibrate(spot)
+    pid = {"kp": args.kp, "ki": args.ki}
+    print(f"{'fps':>6} {'latency ms':>10} {'settling s':>10} {'overshoot':>9} {'jitter um':>9} {'bandwidth Hz':>12}")
+    for fps in args.fps:
+        for latency in args.latency:
+            r = bench(fps, latency, spot, cal, pid_kwargs=pid)
+            print(f"{fps:6.1f} {latency * 1e3:10.1f} {r['settling']:10.3f} {r['overshoot']:9.1%} "
+                  f"{r['jitter']:9.3f} {r['bandwidth']:12.2f}")
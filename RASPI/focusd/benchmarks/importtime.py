@@ -0,0 +1,98 @@
+"""
+Import time of the focusd modules, measured with `python -X importtime` in a
+fresh interpreter per module (best of --repeat runs).
+
+Besides the cumulative time it lists which heavy dependencies (SciPy,
+NanoImagingPack, matplotlib, ...) each import pulled in; the numeric path must
+not load any of them at import. The results are written as JSON; with
+--baseline the run fails (exit code 1) if an import got slower than the
+baseline by more than --tolerance or started loading a heavy dependency:
+
+    python -m focusd.benchmarks.importtime --save baseline_importtime.json
+    python -m focusd.benchmarks.importtime --baseline baseline_importtime.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+MODULES = ("focusd", "focusd.profiling", "focusd.blur", "focusd.focus_algorithm", "focusd.calibration",
+           "focusd.controller", "focusd.simulation", "focusd.metrics", "focusd.diagnostics")
+
+HEAVY = ("scipy", "NanoImagingPack", "matplotlib", "skimage", "tifffile", "cv2", "astropy", "serial")
+
+RASPI = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+
+
+def importtime(module):
+    """{imported module: cumulative us} of `import module` in a new interpreter."""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [RASPI, os.environ.get("PYTHONPATH")])))
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          capture_output=True, text=True, env=env)
+    if proc.returncode:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+def measure(module, repeat=5):
+    best = None
+    for _ in range(repeat):
+        times = importtime(module)
+        if best is None or times[module] < best[module]:
+            best = times
+    heavy = sorted({name.split(".")[0] for name in best} & set(HEAVY))
+    slowest = sorted(((us, name) for name, us in best.items() if name != module), reverse=True)[:5]
+    return {"total_ms": best[module] / 1e3, "heavy": heavy,
+            "slowest": [[name, us / 1e3] for us, name in slowest]}
+
+
+def run(modules, repeat):
+    results = {}
+    for module in modules:
+        results[module] = stats = measure(module, repeat)
+        print(f"{module:>24} {stats['total_ms']:8.1f} ms  heavy: {', '.join(stats['heavy']) or '-'}")
+    return results
+
+
+def check(results, baseline, tolerance):
+    """List of regressions of results against baseline."""
+    failures = []
+    for module, ref in baseline.items():
+        new = results.get(module)
+        if new is None:
+            continue
+        if new["total_ms"] > ref["total_ms"] * (1 + tolerance):
+            failures.append(f"{module}: {new['total_ms']:.1f} ms > {ref['total_ms']:.1f} ms")
+        added = sorted(set(new["heavy"]) - set(ref["heavy"]))
+        if added:
+            failures.append(f"{module}: now imports {', '.join(added)}")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("modules", nargs="*", default=list(MODULES))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--save", help="write the results as JSON")
+    parser.add_argument("--baseline", help="compare against this JSON baseline")
+    parser.add_argument("--tolerance", type=float, default=0.5)
+    args = parser.parse_args()
+
+    results = run(args.modules, args.repeat)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures = check(results, json.load(f), args.tolerance)
+        for failure in failures:
+            print("REGRESSION", failure, file=sys.stderr)
+        sys.exit(1 if failures else 0)
@@ -0,0 +1,75 @@
+"""
+Aggregate throughput of CameraManager with 1..N simulated cameras.
+
+Every simulated camera renders a drifting astigmatic spot into ESP32-sized
+frames as fast as it is read (or at --fps), so the numbers are the processing
+limit of the host without the USB link. With enough cores the aggregate frame
+rate grows linearly with the number of cameras; efficiency is the aggregate
+rate over n times the single camera rate.
+
+    python -m focusd.benchmarks.manager --cameras 4 --seconds 5
+"""
+import argparse
+import functools
+import os
+import time
+
+import numpy as np
+
+from focusd.manager import CameraManager
+from focusd.simulation import AstigmaticSpot, camera_noise
+from focusd.sources import FrameSource
+
+METRIC = {"radius": 40, "sigma_locate": 15, "sigma_smooth": 3, "background": 10, "mode": "project"}
+
+
+class SimulatedSource(FrameSource):
+    def __init__(self, port, shape=(240, 320), fps=None, frames=None):
+        self.port = port
+        self.shape = shape
+        self.fps = fps
+        self.frames = frames
+        self.index = 0
+        self.spot = AstigmaticSpot(shape=shape, noise=0, seed=sum(port.encode()))
+
+    def read(self):
+        if self.frames is not None and self.index >= self.frames:
+            return None
+        if self.fps:
+            time.sleep(1 / self.fps)
+        z = 15 * np.sin(self.index / 50)
+        frame = camera_noise(self.spot.render_batch(z)[0], self.spot.rng)
+        self.index += 1
+        return time.time(), frame
+
+
+def run(cameras, seconds, fps=None):
+    source = functools.partial(SimulatedSource, fps=fps)
+    manager = CameraManager([f"sim{i}" for i in range(cameras)], metric=METRIC, source=source)
+    with manager:
+        # skip the start-up of the workers (imports, first FFT plans)
+        while len(manager.latest) < cameras:
+            manager.poll(timeout=0.5)
+        manager.reset_stats()
+        t_end = time.perf_counter() + seconds
+        while time.perf_counter() < t_end:
+            manager.poll(timeout=0.1)
+        stats = manager.stats()
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cameras", type=int, default=os.cpu_count())
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--fps", type=float, default=None, help="frame rate per camera, default unlimited")
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} cores")
+    single = None
+    for n in sorted({1, args.cameras}):
+        stats = run(n, args.seconds, args.fps)
+        single = single or stats["fps"]
+        per_camera = ", ".join(f"{s['fps']:.1f}" for s in stats["cameras"].values())
+        print(f"{n} cameras: {stats['fps']:.1f} fps total, {per_camera} per camera, "
+              f"efficiency {stats['fps'] / (n * single):.2f}")
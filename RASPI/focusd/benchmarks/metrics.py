@@ -0,0 +1,179 @@
+"""
+Accuracy versus latency of every focus metric in focusd.metrics.
+
+Datasets: a synthetic z-sweep (always), the PNG series in DATA/ (--data) and
+recorded TIFF stacks (positional arguments). For every metric and dataset it
+reports per-frame latency percentiles and the peak traced memory; on the
+synthetic data also the z-precision (std of the inverted z of repeated noisy
+frames at fixed z) and the capture range (z span of the monotonic part of the
+metric curve).
+
+The results are written as JSON; with --baseline the run fails (exit code 1)
+if a metric got slower or less precise than the baseline by more than --tolerance:
+
+    python -m focusd.benchmarks.metrics --save baseline_metrics.json
+    python -m focusd.benchmarks.metrics --baseline baseline_metrics.json
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+from scipy import ndimage
+
+import focusd
+from focusd.calibration import Calibration, monotonic_range
+from focusd.metrics import METRICS, make_metric
+from focusd.simulation import AstigmaticSpot, camera_noise
+
+DATA = os.path.join(os.path.dirname(__file__), "..", "..", "..", "DATA")
+
+
+def crop_roi(frame, size):
+    """size x size ROI around the maximum of the blurred frame."""
+    frame = np.asarray(frame, dtype=float)
+    if frame.ndim == 3:
+        frame = frame.mean(-1)
+    if not size or size >= min(frame.shape):
+        return frame
+    y, x = np.unravel_index(np.argmax(ndimage.uniform_filter(frame, 9)), frame.shape)
+    y = int(np.clip(y - size // 2, 0, frame.shape[0] - size))
+    x = int(np.clip(x - size // 2, 0, frame.shape[1] - size))
+    return frame[y:y + size, x:x + size]
+
+
+def synthetic(z, repeats=1, shape=(64, 64), seed=0):
+    spot = AstigmaticSpot(shape=shape)
+    rng = np.random.default_rng(seed)
+    z = np.repeat(np.asarray(z, dtype=float), repeats)
+    return z, camera_noise(spot.render_batch(z), rng).astype(float)
+
+
+def time_metric(metric, frames, memory=True):
+    """Values and latency percentiles of metric over frames, and with memory
+    the peak memory traced in a second pass (tracemalloc hooks every
+    allocation, which would inflate the latencies several times)."""
+    values, latency = [], []
+    for frame in frames:
+        t0 = time.perf_counter_ns()
+        try:
+            values.append(metric(frame))
+        except (RuntimeError, ValueError, IndexError):
+            values.append(np.nan)
+        latency.append(time.perf_counter_ns() - t0)
+    peak = np.nan
+    if memory:
+        tracemalloc.start()
+        for frame in frames:
+            try:
+                metric(frame)
+            except (RuntimeError, ValueError, IndexError):
+                pass
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    latency = np.array(latency) / 1e3
+    return np.array(values, dtype=float), {
+        "p50_us": float(np.percentile(latency, 50)), "p90_us": float(np.percentile(latency, 90)),
+        "p99_us": float(np.percentile(latency, 99)), "peak_kib": peak / 1024, "frames": len(frames),
+        "failed": int(np.sum(~np.isfinite(values)))}
+
+
+def accuracy(metric, sweep_z, probe_z=(-10.0, 0.0, 10.0), repeats=30):
+    """Capture range and z-precision of a metric on synthetic data."""
+    z, frames = synthetic(sweep_z, seed=1)
+    values = time_metric(metric, frames, memory=False)[0]
+    ok = np.isfinite(values)
+    sel = monotonic_range(z[ok], values[ok])
+    capture = z[ok][sel]
+    result = {"capture_range_um": float(capture[-1] - capture[0]) if len(capture) else 0.0}
+    try:
+        cal = Calibration.build(z[ok], values[ok])
+    except ValueError:
+        return result
+    precision = []
+    for z0 in probe_z:
+        _, frames = synthetic([z0], repeats=repeats, seed=2)
+        zs = cal.z_offsets(time_metric(metric, frames, memory=False)[0]) + cal.z_ref
+        precision.append(np.nanstd(zs))
+    result["z_precision_um"] = float(np.max(precision))
+    return result
+
+
+def datasets(stacks, data, roi, n_synthetic):
+    yield "synthetic", synthetic(np.linspace(-30, 30, n_synthetic), seed=3)[1]
+    if data:
+        import matplotlib.pyplot as plt
+        for folder in sorted(glob.glob(os.path.join(data, "*", ""))):
+            files = sorted(glob.glob(os.path.join(folder, "*.png")))
+            if files:
+                yield os.path.basename(os.path.dirname(folder)), [crop_roi(plt.imread(f), roi) for f in files]
+    for path in stacks:
+        import tifffile as tif
+        yield os.path.basename(path), [crop_roi(frame, roi) for frame in tif.imread(path)]
+
+
+def run(names, stacks, data, roi, n_synthetic, with_accuracy):
+    # keep the deferred SciPy imports out of the first frame's latency
+    focusd.preload(background=False)
+    results = {}
+    for name in names:
+        try:
+            metric = make_metric(name)
+        except ImportError as e:
+            print(f"skipping {name}: {e}", file=sys.stderr)
+            continue
+        results[name] = {}
+        for dataset, frames in datasets(stacks, data, roi, n_synthetic):
+            _, stats = time_metric(metric, frames)
+            if dataset == "synthetic" and with_accuracy:
+                stats.update(accuracy(metric, np.linspace(-30, 30, 41)))
+            results[name][dataset] = stats
+            print(f"{name:>20} {dataset:>28} p50 {stats['p50_us']:10.1f} us  p99 {stats['p99_us']:10.1f} us  "
+                  f"peak {stats['peak_kib']:8.1f} KiB  z-prec {stats.get('z_precision_um', np.nan):6.3f} um  "
+                  f"range {stats.get('capture_range_um', np.nan):5.1f} um")
+    return results
+
+
+def check(results, baseline, tolerance):
+    """List of regressions of results against baseline."""
+    failures = []
+    for name, per_dataset in baseline.items():
+        for dataset, ref in per_dataset.items():
+            new = results.get(name, {}).get(dataset)
+            if new is None:
+                continue
+            if new["p50_us"] > ref["p50_us"] * (1 + tolerance):
+                failures.append(f"{name}/{dataset}: p50 {new['p50_us']:.1f} us > {ref['p50_us']:.1f} us")
+            if "z_precision_um" in ref and "z_precision_um" in new and \
+                    new["z_precision_um"] > ref["z_precision_um"] * (1 + tolerance):
+                failures.append(f"{name}/{dataset}: z-precision {new['z_precision_um']:.3f} um > {ref['z_precision_um']:.3f} um")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("stacks", nargs="*", help="recorded TIFF stacks")
+    parser.add_argument("--metrics", nargs="+", default=list(METRICS), choices=list(METRICS))
+    parser.add_argument("--data", nargs="?", const=DATA, default=None, help="include the PNG series in DATA/")
+    parser.add_argument("--roi", type=int, default=100, help="ROI size cropped around the spot of real frames")
+    parser.add_argument("--frames", type=int, default=200, help="frames of the synthetic sweep")
+    parser.add_argument("--no-accuracy", action="store_true", help="only measure latency and memory")
+    parser.add_argument("--save", help="write the results as JSON")
+    parser.add_argument("--baseline", help="compare against this JSON baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    results = run(args.metrics, args.stacks, args.data, args.roi, args.frames, not args.no_accuracy)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures = check(results, json.load(f), args.tolerance)
+        for failure in failures:
+            print("REGRESSION", failure, file=sys.stderr)
+        sys.exit(1 if failures else 0)
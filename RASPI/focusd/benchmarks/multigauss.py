@@ -0,0 +1,62 @@
+"""
+Sum-of-Gaussians fit of PYTHON/IMAGE_Processing/Fit2DData.py.
+
+Fits the four Gaussians of the script (same parameters, start values and
+noise) with the script's curve_fit of a per-spot loop and with
+MultiGaussian2D.fit, on the script's 75x150 grid and on larger grids. Widths
+are compared by magnitude (the model does not depend on their sign).
+
+    python -m focusd.benchmarks.multigauss --scale 1 2 4
+"""
+import argparse
+import time
+
+import numpy as np
+
+from focusd.multigauss import MultiGaussian2D
+
+# x0, y0, xalpha, yalpha, A of Fit2DData.py
+GPRMS = [(0, 2, 2.5, 5.4, 1.5), (-1, 4, 6, 2.5, 1.8), (-3, -0.5, 1, 2, 4), (3, 0.5, 2, 1, 5)]
+GUESS = [(0, 0, 1, 1, 2), (-1.5, 5, 5, 1, 3), (-4, -1, 1.5, 1.5, 6), (4, 1, 1.5, 1.5, 6.5)]
+
+
+def gaussian(x, y, x0, y0, xalpha, yalpha, A):
+    return A * np.exp(-((x - x0) / xalpha)**2 - ((y - y0) / yalpha)**2)
+
+
+def _gaussian(M, *args):
+    x, y = M
+    arr = np.zeros(x.shape)
+    for i in range(len(args) // 5):
+        arr += gaussian(x, y, *args[i * 5:i * 5 + 5])
+    return arr
+
+
+def timed(fn, *args, **kwargs):
+    t0 = time.perf_counter()
+    out = fn(*args, **kwargs)
+    return out, time.perf_counter() - t0
+
+
+if __name__ == "__main__":
+    from scipy.optimize import curve_fit
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=int, nargs="+", default=[1, 2, 4], help="grid size in units of 75x150")
+    parser.add_argument("--noise", type=float, default=0.1)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    p0 = [p for prms in GUESS for p in prms]
+    for scale in args.scale:
+        x, y = np.linspace(-5, 4, 75 * scale), np.linspace(-3, 7, 150 * scale)
+        X, Y = np.meshgrid(x, y)
+        Z = sum(gaussian(X, Y, *p) for p in GPRMS) + args.noise * rng.standard_normal(X.shape)
+        xdata = np.vstack((X.ravel(), Y.ravel()))
+        (reference, _), t_ref = timed(curve_fit, _gaussian, xdata, Z.ravel(), p0)
+        model = MultiGaussian2D(x, y)
+        (popt, _), t_fit = timed(model.fit, Z, p0)
+        rms = np.sqrt(np.mean((Z - model(popt))**2))
+        print(f"{len(x)}x{len(y)}: curve_fit {t_ref * 1e3:7.1f} ms, MultiGaussian2D {t_fit * 1e3:6.1f} ms "
+              f"({t_ref / t_fit:.0f}x), max |dp| {np.max(np.abs(np.abs(popt) - np.abs(reference))):.1e}, "
+              f"rms residual {rms:.3f}")
@@ -0,0 +1,145 @@
+"""
+focusd.core against NanoImagingPack.
+
+1. Equivalence: extract and gaussf (sigma_locate and sigma_smooth of
+   processautofocus.py) and the resulting focus value of FocusMetric with
+   backend "fft" versus "nip", on recorded TIFF stacks (positional arguments),
+   the PNG series in DATA/ (--data) or a synthetic sweep.
+2. Footprint: cold start (interpreter start to the first focus value) and peak
+   RSS of a fresh process running the pipeline with and without nip.
+
+    python -m focusd.benchmarks.nipcore autofocus.tif --step 10
+"""
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+from focusd import core
+from focusd.focus_algorithm import FocusMetric, to_gray
+from focusd.simulation import AstigmaticSpot, camera_noise
+
+DATA = os.path.join(os.path.dirname(__file__), "..", "..", "..", "DATA")
+RASPI = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+
+# run in a fresh interpreter, prints the time to the first focus value and the
+# peak RSS in bytes: VmHWM from /proc, which starts over with the exec, while
+# ru_maxrss keeps the peak of the forking parent on Linux; ru_maxrss only where
+# there is no /proc (KiB on Linux, bytes on macOS)
+COLD_START = """
+import resource, sys, time
+t0 = time.perf_counter()
+if {use_nip}:
+    import NanoImagingPack
+import numpy as np
+from focusd.focus_algorithm import FocusMetric
+frame = np.load(sys.argv[1])
+focus = FocusMetric(radius={radius}, background={background}, backend={backend!r}).compute(frame)
+t = time.perf_counter() - t0
+try:
+    with open("/proc/self/status") as f:
+        rss = next(int(line.split()[1]) * 1024 for line in f if line.startswith("VmHWM"))
+except OSError:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+print(t, rss, focus)
+"""
+
+
+def synthetic(n=20, shape=(240, 320), seed=0):
+    spot = AstigmaticSpot(shape=shape, sigma0=12, amplitude=180, background=30)
+    rng = np.random.default_rng(seed)
+    return [camera_noise(spot.render(z), rng) for z in np.linspace(-30, 30, n)]
+
+
+def frames(stacks, data, step):
+    if not stacks and not data:
+        yield "synthetic", synthetic()
+    if data:
+        import matplotlib.pyplot as plt
+        for folder in sorted(glob.glob(os.path.join(data, "*", ""))):
+            files = sorted(glob.glob(os.path.join(folder, "*.png")))[::step]
+            if files:
+                yield os.path.basename(os.path.dirname(folder)), [plt.imread(f) * 255 for f in files]
+    for path in stacks:
+        import tifffile as tif
+        yield os.path.basename(path), tif.imread(path)[::step]
+
+
+def _rel(a, b):
+    a, b = np.asarray(a, dtype=float), np.asarray(b, dtype=float)
+    return float(np.max(np.abs(a - b)) / max(np.max(np.abs(b)), 1e-12))
+
+
+def equivalence(frames, radius, background, sigmas=(111, 11)):
+    import NanoImagingPack as nip
+    errors = {"extract": 0.0, "focus": 0.0}
+    errors.update({f"gaussf_{s}": 0.0 for s in sigmas})
+    fft = FocusMetric(radius=radius, background=background, backend="fft")
+    ref = FocusMetric(radius=radius, background=background, backend="nip")
+    for frame in frames:
+        im = to_gray(frame, fft.channel)
+        for s in sigmas:
+            errors[f"gaussf_{s}"] = max(errors[f"gaussf_{s}"], _rel(core.gaussf(im, s), nip.gaussf(im, s)))
+        center = fft.locate(im)
+        crop = core.extract(im, (2 * radius, 2 * radius), center)
+        if not np.array_equal(crop, np.asarray(nip.extract(im, (2 * radius, 2 * radius), center))):
+            errors["extract"] = np.inf
+        try:
+            errors["focus"] = max(errors["focus"], _rel(fft.compute(frame), ref.compute(frame)))
+        except RuntimeError:
+            pass
+    return errors
+
+
+def cold_start(frame, backend, use_nip, radius, background, repeat=3):
+    import tempfile
+    path = os.path.join(tempfile.mkdtemp(), "frame.npy")
+    np.save(path, frame)
+    code = COLD_START.format(use_nip=use_nip, backend=backend, radius=radius, background=background)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [RASPI, os.environ.get("PYTHONPATH")])))
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", code, path], capture_output=True, text=True, env=env)
+        if out.returncode:
+            raise RuntimeError(out.stderr.strip().splitlines()[-1])
+        t, rss, _ = out.stdout.split()
+        runs.append((float(t), int(rss)))
+    os.remove(path)
+    return {"cold_start_s": min(t for t, _ in runs), "peak_rss_mib": min(r for _, r in runs) / 2**20}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("stacks", nargs="*", help="recorded TIFF stacks")
+    parser.add_argument("--data", nargs="?", const=DATA, default=None, help="include the PNG series in DATA/")
+    parser.add_argument("--step", type=int, default=1, help="use every step-th frame")
+    parser.add_argument("--radius", type=int, default=100)
+    parser.add_argument("--background", type=float, default=40)
+    parser.add_argument("--save", help="write the results as JSON")
+    args = parser.parse_args()
+
+    results = {}
+    first = None
+    for name, series in frames(args.stacks, args.data, args.step):
+        first = series[0] if first is None else first
+        try:
+            results[name] = errors = equivalence(series, args.radius, args.background)
+        except ImportError as e:
+            print(f"skipping the equivalence check: {e}", file=sys.stderr)
+            continue
+        print(f"{name}: max relative deviation from nip " +
+              ", ".join(f"{key} {value:.2e}" for key, value in errors.items()))
+    for label, backend, use_nip in (("core", "fft", False), ("nip", "nip", True)):
+        try:
+            results[label] = stats = cold_start(first, backend, use_nip, args.radius, args.background)
+        except RuntimeError as e:
+            print(f"skipping {label}: {e}", file=sys.stderr)
+            continue
+        print(f"{label:>5}: cold start {stats['cold_start_s']:.2f} s, peak RSS {stats['peak_rss_mib']:.1f} MiB")
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
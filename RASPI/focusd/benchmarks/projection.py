@@ -0,0 +1,71 @@
+"""
+Compare FocusMetric(mode="project") against the original mode="blur" on
+recorded stacks: deviation of the focus value per frame and the time spent in
+the preprocessing (smooth, threshold, project).
+
+    python -m focusd.benchmarks.projection autofocus.tif autofocus2.tif --step 2
+
+Without a stack a synthetic series of astigmatic spots is used.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from focusd.focus_algorithm import FocusMetric, to_gray
+
+
+def synthetic_stack(n=40, shape=(800, 900), seed=0):
+    rng = np.random.default_rng(seed)
+    yy, xx = np.meshgrid(np.arange(shape[0]) - shape[0] / 2, np.arange(shape[1]) - shape[1] / 2, indexing="ij")
+    for ratio in np.linspace(0.5, 2, n):
+        sx, sy = 60 * np.sqrt(ratio), 60 / np.sqrt(ratio)
+        im = 20 + 200 * np.exp(-0.5 * ((xx / sx)**2 + (yy / sy)**2))
+        yield im + rng.normal(0, 5, shape)
+
+
+def compare(frames, backend="fft", **kwargs):
+    metrics = {mode: FocusMetric(backend=backend, mode=mode, **kwargs) for mode in FocusMetric.MODES}
+    focus = {mode: [] for mode in metrics}
+    timing = {mode: [] for mode in metrics}
+    for frame in frames:
+        for mode, metric in metrics.items():
+            gray = to_gray(frame, metric.channel)
+            crop = metric.crop(gray, metric.locate(gray))
+            t0 = time.perf_counter()
+            im, projX, projY = metric.preprocess(crop)
+            timing[mode].append(time.perf_counter() - t0)
+            try:
+                poptx, popty = metric.fit(projX, projY)
+                focus[mode].append(poptx[2] / popty[2])
+            except RuntimeError:
+                focus[mode].append(np.nan)
+    return {mode: np.array(v) for mode, v in focus.items()}, {mode: np.array(v) for mode, v in timing.items()}
+
+
+def report(name, focus, timing):
+    ref, new = focus["blur"], focus["project"]
+    dev = new - ref
+    ok = np.isfinite(dev)
+    print(f"{name}: {len(ref)} frames, {np.sum(~ok)} failed fits")
+    print(f"  focus deviation  mean {np.mean(dev[ok]):+.4f}  std {np.std(dev[ok]):.4f}  "
+          f"max |.| {np.max(np.abs(dev[ok])):.4f}  max rel {np.max(np.abs(dev[ok] / ref[ok])):.2%}")
+    if np.sum(ok) > 2:
+        print(f"  correlation      {np.corrcoef(ref[ok], new[ok])[0, 1]:.5f}")
+    for mode in ("blur", "project"):
+        print(f"  preprocess {mode:>8}: median {np.median(timing[mode]) * 1e3:.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("stacks", nargs="*", help="TIFF stacks recorded with the calibration sweep")
+    parser.add_argument("--step", type=int, default=1, help="use every step-th frame")
+    parser.add_argument("--backend", default="fft")
+    args = parser.parse_args()
+
+    if not args.stacks:
+        report("synthetic", *compare(synthetic_stack(), backend=args.backend))
+    for path in args.stacks:
+        import tifffile as tif
+        images = tif.imread(path)
+        report(path, *compare(images[::args.step], backend=args.backend))
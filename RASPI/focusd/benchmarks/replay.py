@@ -0,0 +1,71 @@
+"""
+Replay a recording through FocusMetric configurations and compare them.
+
+Every configuration (JSON dict of FocusMetric arguments) sees the same frames
+from a ReplaySource. At max speed (default) this reports the sustainable
+throughput and latency percentiles per configuration and how far the focus
+values of each configuration deviate from the first one; with --speed 1 it
+reports whether the pipeline keeps up with the recorded frame rate (lag).
+
+    python -m focusd.benchmarks.replay autofocus.tif --step 2 \\
+        --config '{"backend": "fft"}' --config '{"backend": "iir", "mode": "project"}'
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+import focusd
+from focusd.focus_algorithm import FocusMetric
+from focusd.sources import ReplaySource
+
+
+def run(path, config, speed=None, step=1, stop=None):
+    metric = FocusMetric(**config)
+    focus, latency = [], []
+    wall = time.perf_counter()
+    with ReplaySource(path, speed=speed, step=step, stop=stop) as source:
+        for t, frame in source:
+            t0 = time.perf_counter()
+            try:
+                focus.append(metric.compute(frame))
+            except (RuntimeError, ValueError):
+                focus.append(np.nan)
+            latency.append(time.perf_counter() - t0)
+        lag = source.lag
+    wall = time.perf_counter() - wall
+    latency = np.array(latency) * 1e3
+    return np.array(focus), {"frames": len(focus), "fps": len(focus) / wall, "p50_ms": float(np.median(latency)),
+                             "p99_ms": float(np.percentile(latency, 99)), "lag_s": lag,
+                             "failed": int(np.sum(~np.isfinite(focus)))}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recording", help="TIFF stack or focusd.recorder session (.h5)")
+    parser.add_argument("--config", action="append", type=json.loads,
+                        help="FocusMetric arguments as JSON, repeat for A/B (default: the defaults)")
+    parser.add_argument("--speed", type=float, default=None, help="replay speed, default as fast as possible")
+    parser.add_argument("--step", type=int, default=1)
+    parser.add_argument("--stop", type=int, default=None)
+    parser.add_argument("--save", help="write the statistics as JSON")
+    args = parser.parse_args()
+
+    focusd.preload(background=False)
+    configs = args.config or [{}]
+    results, reference = {}, None
+    for config in configs:
+        focus, stats = run(args.recording, config, args.speed, args.step, args.stop)
+        if reference is None:
+            reference = focus
+        ok = np.isfinite(focus) & np.isfinite(reference)
+        stats["max_dev_from_first"] = float(np.max(np.abs(focus[ok] - reference[ok]))) if ok.any() else np.nan
+        name = json.dumps(config, sort_keys=True)
+        results[name] = stats
+        print(f"{name}: {stats['frames']} frames, {stats['fps']:.1f} fps, p50 {stats['p50_ms']:.1f} ms, "
+              f"p99 {stats['p99_ms']:.1f} ms, lag {stats['lag_s']:.3f} s, {stats['failed']} failed, "
+              f"max |focus - first| {stats['max_dev_from_first']:.4f}")
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
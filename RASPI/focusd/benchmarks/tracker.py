@@ -0,0 +1,58 @@
+"""
+SpotTracker against the full-frame search of processautofocus.py on a
+simulated drifting spot (sinusoidal in y, linear in x, breathing width) with
+one blank frame in the middle to force a reacquisition. Reports the position
+error and the per-frame time of both.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from focusd.focus_algorithm import FocusMetric
+from focusd.simulation import render_spots
+from focusd.tracker import SpotTracker
+
+
+def drifting_spot(shape, n, seed=0):
+    rng = np.random.default_rng(seed)
+    h, w = shape
+    for i in range(n):
+        y, x = h / 2 + h / 5 * np.sin(i / 20), w / 5 + 0.6 * w * i / n
+        s = 8 + 4 * np.sin(i / 30)
+        frame = render_spots(shape, [(x - w / 2, y - h / 2)], [(s, 1.3 * s)], amplitude=150, background=20)[0]
+        frame += rng.normal(0, 3, shape).astype(np.float32)
+        if i == n // 2:
+            frame = rng.normal(20, 3, shape)
+        yield (y, x), i == n // 2, frame
+
+
+def run(shape, n, backend):
+    tracker = SpotTracker()
+    metric = FocusMetric(backend=backend)
+    errors = {"tracker": [], "full frame": []}
+    times = {"tracker": [], "full frame": []}
+    for truth, blank, frame in drifting_spot(shape, n):
+        t0 = time.perf_counter()
+        center = tracker.update(frame)["center"]
+        times["tracker"].append(time.perf_counter() - t0)
+        t0 = time.perf_counter()
+        full_center = metric.locate(frame)
+        metric.crop(frame, full_center)
+        times["full frame"].append(time.perf_counter() - t0)
+        if not blank:
+            errors["tracker"].append(np.hypot(center[0] - truth[0], center[1] - truth[1]))
+            errors["full frame"].append(np.hypot(full_center[0] - truth[0], full_center[1] - truth[1]))
+    for name in errors:
+        print(f"{name:>11}: error median {np.median(errors[name]):6.2f} px, max {np.max(errors[name]):7.2f} px, "
+              f"time median {np.median(times[name]) * 1e3:7.2f} ms, p99 {np.percentile(times[name], 99) * 1e3:7.2f} ms")
+    print(f"{tracker.reacquisitions} reacquisitions in {n} frames, final ROI {int(round(tracker.size))} px")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--shape", type=int, nargs=2, default=(1080, 1440))
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--backend", default="box", help="blur backend of the full-frame search")
+    args = parser.parse_args()
+    run(tuple(args.shape), args.frames, args.backend)
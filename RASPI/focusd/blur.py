@@ -0,0 +1,142 @@
+"""
+Gaussian blur backends for the focus pipeline.
+
+nip.gaussf and scipy's gaussian_filter get slower with growing sigma (or image
+size for the FFT version). The "iir" (Young-van Vliet) and "box" (three
+stacked box filters) backends cost the same per pixel for any sigma, which
+matters for the sigma=111 used to locate the spot.
+
+SciPy is imported on first use of a backend, not with the module.
+"""
+from functools import lru_cache
+
+import numpy as np
+
+BACKENDS = ("nip", "fft", "ndimage", "iir", "box")
+
+
+# poles of the 3rd order recursive Gaussian for sigma=2 (van Vliet, Young &
+# Verbeek, "Recursive Gaussian derivative filters", ICPR 1998)
+_YVV_POLES = np.array([1.41650 + 1.00829j, 1.41650 - 1.00829j, 1.86543])
+
+
+def _yvv_variance(q):
+    # a causal + anti-causal pass with poles d has variance 2*sum(d/(d-1)**2)
+    d = _YVV_POLES**(1 / q)
+    return 2 * np.real(np.sum(d / (d - 1)**2))
+
+
+@lru_cache(maxsize=32)
+def _yvv_coefficients(sigma):
+    from scipy import optimize
+    # scale the poles so that the filter variance is exactly sigma**2
+    q = optimize.brentq(lambda q: _yvv_variance(q) - sigma**2, 0.01, 10 * sigma + 10)
+    a = np.real(np.poly(1 / _YVV_POLES**(1 / q)))
+    return np.array([a.sum()]), a
+
+
+def _history_state(a, hist):
+    # lfilter state (transposed direct form II, b has a single tap) for a filter
+    # whose last outputs were hist[0] (most recent), hist[1], hist[2]
+    return -np.stack([a[1] * hist[0] + a[2] * hist[1] + a[3] * hist[2],
+                      a[2] * hist[0] + a[3] * hist[1],
+                      a[3] * hist[0]])
+
+
+@lru_cache(maxsize=32)
+def _yvv_boundary(sigma):
+    # Triggs & Sdika, "Boundary conditions for Young-van Vliet recursive
+    # filtering", 2006: the first anti-causal outputs depend linearly on how far
+    # the last causal outputs are from the (constantly continued) edge value
+    from scipy import signal
+    b, a = _yvv_coefficients(sigma)
+    tail = np.zeros(int(10 * sigma) + 50)
+    M = np.zeros((3, 3))
+    for k in range(3):
+        hist = np.zeros(3)
+        hist[k] = 1
+        forward, _ = signal.lfilter(b, a, tail, zi=_history_state(a, hist))
+        M[:, k] = signal.lfilter(b, a, forward[::-1])[::-1][:3]
+    return M
+
+
+def _iir_axis(im, sigma, axis):
+    from scipy import signal
+    b, a = _yvv_coefficients(sigma)
+    im = np.moveaxis(im, axis, -1)
+    # causal pass, primed with the steady state of the left edge value
+    first = im[..., :1]
+    y, _ = signal.lfilter(b, a, im, zi=signal.lfilter_zi(b, a) * first)
+    # anti-causal pass, primed as if the right edge value continued forever
+    last = im[..., -1]
+    dev = np.stack([y[..., -1], y[..., -2], y[..., -3]]) - last
+    hist = last + np.tensordot(_yvv_boundary(sigma), dev, axes=1)
+    y, _ = signal.lfilter(b, a, y[..., ::-1], zi=np.moveaxis(_history_state(a, hist), 0, -1))
+    return np.moveaxis(y[..., ::-1], -1, axis)
+
+
+def box_sizes(sigma, n=3):
+    """Widths of n box filters whose cascade approximates a Gaussian of sigma."""
+    w_ideal = np.sqrt(12 * sigma**2 / n + 1)
+    wl = int(np.floor(w_ideal))
+    if wl % 2 == 0:
+        wl -= 1
+    wu = wl + 2
+    m = round((12 * sigma**2 - n * wl**2 - 4 * n * wl - 3 * n) / (-4 * wl - 4))
+    return [wl if i < m else wu for i in range(n)]
+
+
+def effective_backend(backend, sigma):
+    """The backend gaussf uses for sigma: the recursive coefficients are only
+    valid from sigma=0.5 on, and below sigma ~1.4 the box cascade has boxes of
+    width 1 (at sigma=0.5 only, i.e. no blur), so both fall back to ndimage."""
+    if backend == "iir" and sigma < 0.5:
+        return "ndimage"
+    if backend == "box" and box_sizes(sigma)[0] < 3:
+        return "ndimage"
+    return backend
+
+
+def _box_axis(im, sigma, axis):
+    from scipy import ndimage
+    for size in box_sizes(sigma):
+        # uniform_filter1d keeps a running sum, so the cost does not depend on size
+        im = ndimage.uniform_filter1d(im, size, axis=axis, mode="nearest")
+    return im
+
+
+def gaussf(im, sigma, backend="ndimage", axes=None):
+    """Gaussian blur of im with standard deviation sigma (pixels) along axes.
+
+    backend is one of BACKENDS. "nip" is the original nip.gaussf and needs
+    NanoImagingPack; "fft" gives the same result (focusd.core.gaussf) and,
+    like the others, only needs SciPy.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown blur backend {backend!r}, use one of {BACKENDS}")
+    im = np.asarray(im, dtype=float)
+    if sigma <= 0:
+        return im
+    backend = effective_backend(backend, sigma)
+    if axes is None:
+        axes = tuple(range(im.ndim))
+    if backend == "nip":
+        import NanoImagingPack as nip
+        if len(axes) == im.ndim:
+            return np.asarray(nip.gaussf(im, sigma))
+        return np.asarray(nip.gaussf(im, [sigma if ax in axes else 0 for ax in range(im.ndim)]))
+    if backend == "fft":
+        from .core import gaussf as fft_gaussf
+        return fft_gaussf(im, [sigma if ax in axes else 0 for ax in range(im.ndim)])
+    if backend == "ndimage":
+        from scipy import ndimage
+        return ndimage.gaussian_filter(im, [sigma if ax in axes else 0 for ax in range(im.ndim)])
+    blur_axis = _iir_axis if backend == "iir" else _box_axis
+    for ax in axes:
+        im = blur_axis(im, sigma, ax)
+    return im
+
+
+def gaussf1d(proj, sigma, backend="ndimage"):
+    """Blur a 1D projection, e.g. projX/projY, instead of the full 2D frame."""
+    return gaussf(np.ravel(proj), sigma, backend)
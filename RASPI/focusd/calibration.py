@@ -0,0 +1,155 @@
+"""
+z-calibration of the focus value.
+
+The calibration sweep in processautofocus.py moves the stage in steps of zval
+and records the focus value F = sx/sy per step. Calibration.build fits a
+monotonic spline to F(z) over the monotonic part of the curve (the capture
+range), and tabulates its inverse z(F) on a dense, uniform grid of F. At
+runtime z_offset(F) is then a table lookup with linear interpolation.
+
+The calibration is stored as a small compressed .npz file:
+
+    cal = Calibration.build(z, focus)
+    cal.save("autofocus_calibration.npz")
+    cal = Calibration.load("autofocus_calibration.npz")
+    dz = cal.z_offset(sx / sy)
+"""
+import json
+import time
+
+import numpy as np
+
+CALIBRATION_VERSION = 1
+
+
+def isotonic(y, w=None):
+    """Least squares non-decreasing fit to y (pool adjacent violators)."""
+    y = np.asarray(y, dtype=float)
+    w = np.ones_like(y) if w is None else np.asarray(w, dtype=float)
+    values, weights, counts = [], [], []
+    for yi, wi in zip(y, w):
+        values.append(yi)
+        weights.append(wi)
+        counts.append(1)
+        while len(values) > 1 and values[-2] > values[-1]:
+            wsum = weights[-2] + weights[-1]
+            values[-2] = (values[-2] * weights[-2] + values[-1] * weights[-1]) / wsum
+            weights[-2] = wsum
+            counts[-2] += counts[-1]
+            del values[-1], weights[-1], counts[-1]
+    return np.repeat(values, counts)
+
+
+def monotonic_range(z, focus, smooth=5):
+    """Slice of the (z sorted) sweep between the extrema of the focus curve,
+    i.e. the region where F(z) can be inverted."""
+    kernel = np.ones(min(smooth, len(focus))) / min(smooth, len(focus))
+    f = np.convolve(np.pad(focus, len(kernel) // 2, mode="edge"), kernel, mode="valid")[:len(focus)]
+    lo, hi = sorted((int(np.argmin(f)), int(np.argmax(f))))
+    return slice(lo, hi + 1)
+
+
+class Calibration:
+    """Lookup table z(F) with O(1) evaluation.
+
+    focus0 and focus_step describe the uniform grid of focus values the
+    table z_lut is sampled on; z_ref is the z position of the set point
+    (focus_ref, by default F=1, i.e. a round spot), so z_offset returns the
+    distance from the set point.
+    """
+
+    def __init__(self, focus0, focus_step, z_lut, z_ref=0.0, focus_ref=1.0, meta=None):
+        self.focus0 = float(focus0)
+        self.focus_step = float(focus_step)
+        self.z_lut = np.asarray(z_lut, dtype=np.float32)
+        self.z_ref = float(z_ref)
+        self.focus_ref = float(focus_ref)
+        self.meta = meta or {}
+        # plain python floats make the scalar lookup in z_offset a lot cheaper
+        self._lut = self.z_lut.astype(float).tolist()
+        self._inv_step = 1.0 / self.focus_step
+        self._last = len(self._lut) - 1
+
+    @property
+    def focus_range(self):
+        return self.focus0, self.focus0 + self._last * self.focus_step
+
+    @classmethod
+    def build(cls, z, focus, focus_ref=1.0, n_lut=4096, n_dense=8192, meta=None):
+        """Fit the sweep (z in um, focus values F) and tabulate z(F)."""
+        z = np.asarray(z, dtype=float)
+        focus = np.asarray(focus, dtype=float)
+        ok = np.isfinite(z) & np.isfinite(focus)
+        order = np.argsort(z[ok])
+        z, focus = z[ok][order], focus[ok][order]
+
+        sel = monotonic_range(z, focus)
+        z, focus = z[sel], focus[sel]
+        if len(z) < 4:
+            raise ValueError("Calibration sweep has less than 4 points in its monotonic range")
+        sign = 1.0 if focus[-1] >= focus[0] else -1.0
+        f_mono = sign * isotonic(sign * focus)
+
+        # merge the plateaus left by the isotonic fit so that the spline
+        # nodes are strictly monotonic
+        f_nodes = np.unique(f_mono)
+        z_nodes = np.array([np.mean(z[f_mono == f]) for f in f_nodes])
+        order = np.argsort(z_nodes)
+        z_nodes, f_nodes = z_nodes[order], f_nodes[order]
+        if len(z_nodes) < 2:
+            raise ValueError("Focus values do not change over the calibration sweep")
+        from scipy.interpolate import PchipInterpolator
+        spline = PchipInterpolator(z_nodes, f_nodes)
+
+        z_dense = np.linspace(z_nodes[0], z_nodes[-1], n_dense)
+        f_dense = spline(z_dense)
+        if sign < 0:
+            z_dense, f_dense = z_dense[::-1], f_dense[::-1]
+        f_grid = np.linspace(f_dense[0], f_dense[-1], n_lut)
+        z_lut = np.interp(f_grid, f_dense, z_dense)
+        z_ref = float(np.interp(focus_ref, f_dense, z_dense))
+
+        meta = dict(meta or {})
+        meta.update(created=time.time(), n_points=int(len(z)), z_range=[float(z[0]), float(z[-1])])
+        return cls(f_grid[0], f_grid[1] - f_grid[0], z_lut, z_ref, focus_ref, meta)
+
+    def z_offset(self, focus):
+        """z distance (um) from the set point for a single focus value.
+
+        Focus values outside the calibrated range are clamped to its ends."""
+        u = (focus - self.focus0) * self._inv_step
+        if u <= 0:
+            return self._lut[0] - self.z_ref
+        if u >= self._last:
+            return self._lut[self._last] - self.z_ref
+        i = int(u)
+        z0 = self._lut[i]
+        return z0 + (u - i) * (self._lut[i + 1] - z0) - self.z_ref
+
+    def z_offsets(self, focus):
+        """Vectorised z_offset for an array of focus values."""
+        u = np.clip((np.asarray(focus, dtype=float) - self.focus0) * self._inv_step, 0, self._last)
+        i = np.minimum(u.astype(int), self._last - 1)
+        z0 = self.z_lut[i]
+        return z0 + (u - i) * (self.z_lut[i + 1] - z0) - self.z_ref
+
+    def z_offset_from_sigmas(self, sx, sy):
+        return self.z_offset(sx / sy)
+
+    def in_range(self, focus):
+        lo, hi = self.focus_range
+        return lo <= focus <= hi
+
+    def save(self, path):
+        np.savez_compressed(path, version=CALIBRATION_VERSION, focus0=self.focus0,
+                            focus_step=self.focus_step, z_lut=self.z_lut, z_ref=self.z_ref,
+                            focus_ref=self.focus_ref, meta=json.dumps(self.meta))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            version = int(data["version"])
+            if version != CALIBRATION_VERSION:
+                raise ValueError(f"{path} has calibration version {version}, expected {CALIBRATION_VERSION}")
+            return cls(float(data["focus0"]), float(data["focus_step"]), data["z_lut"],
+                       float(data["z_ref"]), float(data["focus_ref"]), json.loads(str(data["meta"])))
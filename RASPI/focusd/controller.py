@@ -0,0 +1,94 @@
+"""
+Closed-loop focus lock.
+
+Each processed frame yields an error signal (z offset from the set point via
+the Calibration, or the raw ratioXY of the ESP32 reader times a gain). The PID
+turns it into a relative move of the z stage; the RateLimiter keeps the motor
+from being flooded with tiny or too large steps.
+
+    lock = FocusLock(stage, PID(kp=0.2, ki=5.0), RateLimiter(max_step=5))
+    for t, frame in source:
+        lock.update(cal.z_offset(metric.compute(frame)), t)
+
+A stage is anything with a move_relative(dz) method (dz in um).
+"""
+import numpy as np
+
+
+class PID:
+    """PID on the focus error with an optional velocity feed-forward.
+
+    The PID is evaluated in velocity form: since the stage takes relative moves,
+    update returns the change of the correction since the last frame (um), so
+    ki alone already removes a constant offset and kp adds damping.
+    ff_velocity (um/s) compensates a known drift (e.g. thermal) without
+    waiting for the integrator; integral_limit bounds the integrated error to
+    avoid wind-up while the stage is rate limited.
+    """
+
+    def __init__(self, kp=0.2, ki=5.0, kd=0.0, ff_velocity=0.0, integral_limit=np.inf):
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.ff_velocity = ff_velocity
+        self.integral_limit = integral_limit
+        self.reset()
+
+    def reset(self):
+        self.integral = 0.0
+        self.output = 0.0
+        self.last_error = None
+        self.last_t = None
+
+    def update(self, error, t):
+        dt = 0.0 if self.last_t is None else t - self.last_t
+        self.integral = float(np.clip(self.integral + error * dt, -self.integral_limit, self.integral_limit))
+        derivative = 0.0 if self.last_error is None or dt <= 0 else (error - self.last_error) / dt
+        self.last_error = error
+        self.last_t = t
+        output = self.kp * error + self.ki * self.integral + self.kd * derivative
+        step = -(output - self.output) + self.ff_velocity * dt
+        self.output = output
+        return step
+
+
+class RateLimiter:
+    """Clamp each move to max_step, drop moves below deadband and send at most
+    one move every min_interval seconds (smaller moves are accumulated)."""
+
+    def __init__(self, max_step=np.inf, min_interval=0.0, deadband=0.0):
+        self.max_step = max_step
+        self.min_interval = min_interval
+        self.deadband = deadband
+        self.pending = 0.0
+        self.last_t = -np.inf
+
+    def __call__(self, step, t):
+        self.pending += step
+        if t - self.last_t < self.min_interval or abs(self.pending) < self.deadband:
+            return 0.0
+        step = float(np.clip(self.pending, -self.max_step, self.max_step))
+        self.pending = 0.0
+        self.last_t = t
+        return step
+
+
+class FocusLock:
+    """Glue between an error signal, the controller and the stage."""
+
+    def __init__(self, stage, pid=None, limiter=None, max_error=np.inf):
+        self.stage = stage
+        self.pid = pid or PID()
+        self.limiter = limiter or RateLimiter()
+        # errors beyond max_error (e.g. lost spot, fit failure) are ignored
+        self.max_error = max_error
+        self.enabled = True
+
+    def update(self, error, t):
+        """Feed one error sample (um) taken at time t, returns the move sent."""
+        if not self.enabled or not np.isfinite(error) or abs(error) > self.max_error:
+            return 0.0
+        step = self.limiter(self.pid.update(error, t), t)
+        if step:
+            self.stage.move_relative(step)
+        return step
@@ -0,0 +1,79 @@
+"""
+NumPy/SciPy replacements for the two NanoImagingPack functions on the hot path
+of processautofocus.py, so the focus daemon runs without importing nip.
+
+extract(im, size, center) matches nip.extract: the ROI starts at
+center - size//2 and parts outside the image are padded with pad_value.
+gaussf(im, sigma) matches nip.gaussf: a Gaussian sampled on the (centred)
+image grid, normalised to sum 1 and applied by FFT, i.e. with periodic
+borders. Both return plain ndarrays; see focusd.benchmarks.nipcore for the
+comparison with nip.
+"""
+import numpy as np
+
+
+def _per_axis(value, ndim, default):
+    # nip convention: a scalar applies to all axes, a shorter sequence to the
+    # last axes
+    if np.isscalar(value):
+        return [value] * ndim
+    value = list(value)
+    return [default] * (ndim - len(value)) + value[-ndim:]
+
+
+def extract(im, size=None, center=None, pad_value=0.0):
+    """size ROI of im centred at center (defaults: full size, image centre)."""
+    im = np.asarray(im)
+    shape = im.shape
+    size = list(shape) if size is None else _per_axis(size, im.ndim, None)
+    size = [s if s is not None else shape[d] for d, s in enumerate(size)]
+    mid = [s // 2 for s in shape]
+    center = mid if center is None else _per_axis(center, im.ndim, None)
+    center = [mid[d] if c is None else int(c) + (c < 0) * shape[d] for d, c in enumerate(center)]
+
+    src, dst = [], []
+    for d in range(im.ndim):
+        start = center[d] - size[d] // 2
+        lo, hi = max(start, 0), min(max(start + size[d], 0), shape[d])
+        hi = max(hi, lo)
+        src.append(slice(lo, hi))
+        dst.append(slice(lo - start, hi - start))
+    if all(s.start == 0 and s.stop == n for s, n in zip(dst, size)):
+        return im[tuple(src)]
+    out = np.full(size, pad_value, dtype=np.result_type(im, np.asarray(pad_value).dtype))
+    out[tuple(dst)] = im[tuple(src)]
+    return out
+
+
+def _kernel_ft(n, sigma, real):
+    # Fourier transform of the sampled, normalised 1D Gaussian of nip.gaussian
+    x = np.arange(n) - n // 2
+    g = np.exp(-x**2 / (2 * sigma**2))
+    g = np.fft.ifftshift(g / g.sum())
+    return np.fft.rfft(g) if real else np.fft.fft(g)
+
+
+def gaussf(im, sigma, workers=None):
+    """Gaussian blur of im with standard deviation sigma (scalar or per axis,
+    0 = no blur) with periodic borders, as nip.gaussf."""
+    from scipy import fft
+
+    im = np.asarray(im)
+    if not np.iscomplexobj(im):
+        im = im.astype(float, copy=False)
+    sigma = _per_axis(sigma, im.ndim, 0)
+    axes = [d for d in range(im.ndim) if sigma[d] > 0 and im.shape[d] > 1]
+    if not axes:
+        return im.copy()
+    real = not np.iscomplexobj(im)
+    if real:
+        F = fft.rfftn(im, axes=axes, workers=workers)
+    else:
+        F = fft.fftn(im, axes=axes, workers=workers)
+    # the kernel is separable, so its transform is an outer product of 1D ones
+    for i, d in enumerate(axes):
+        k = _kernel_ft(im.shape[d], sigma[d], real and i == len(axes) - 1)
+        F *= k.reshape([-1 if ax == d else 1 for ax in range(im.ndim)])
+    if real:
+        return fft.irfftn(F, s=[im.shape[d] for d in axes], axes=axes, workers=workers)
+    return fft.ifftn(F, axes=axes, workers=workers)
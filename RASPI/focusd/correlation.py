@@ -0,0 +1,304 @@
+"""
+Cross-correlation of frames with a stack of astigmatic PSF templates
+(PYTHON/IMAGE_Processing/CorrelateWithAstigmatismStack.py).
+
+TemplateBank holds the blurred templates and their spectra for one ROI
+shape, so a frame costs one forward FFT and one batched inverse FFT for all
+templates instead of one scipy.signal.correlate per template. Correlation maps
+are the "full" mode of scipy.signal.correlate(frame, template):
+
+    bank = TemplateBank(blur_templates(h3[30:70], sigma=2), roi.shape)
+    scores = bank.scores(roi, score="max")
+    z_index = 30 + np.argmax(scores)
+
+score="ncc" ranks the templates by their normalised cross-correlation, i.e.
+independent of the brightness and background of the frame. The template means
+and norms are computed once, the local sums of the frame under the template
+come from summed-area tables, and the correlation maps of all templates from
+the same batched transform. The templates have to be smaller than the ROI to
+allow for shifts, e.g. crop_templates(templates, 64) for a 100x100 ROI:
+
+    bank = TemplateBank(crop_templates(templates, 64), roi.shape, mode="valid")
+    z_index = 30 + np.argmax(bank.scores(roi, score="ncc"))
+
+correlate_stack scores a whole recording in a process pool. The templates,
+their spectra and the frames are put into shared memory once; a task is only
+a range of frame numbers and returns the scores of those frames.
+"""
+import multiprocessing
+import os
+
+import numpy as np
+
+from . import core
+
+SCORES = ("max", "mean", "ncc")
+MODES = ("full", "valid")
+
+
+def blur_templates(stack, sigma=2):
+    """nip.gaussf(stack[i], sigma) for every template."""
+    stack = np.asarray(stack, dtype=float)
+    return np.stack([core.gaussf(template, sigma) if sigma else template for template in stack])
+
+
+def crop_templates(templates, size):
+    """Central size x size part of every template (where the spot is)."""
+    size = (size, size) if np.isscalar(size) else tuple(size)
+    return np.stack([core.extract(template, size) for template in np.asarray(templates)])
+
+
+def window_sums(im, shape):
+    """Sums of im over every shape-sized window that fits into it (the
+    "valid" positions), from a summed-area table."""
+    h, w = shape
+    sat = np.zeros((im.shape[0] + 1, im.shape[1] + 1))
+    np.cumsum(np.cumsum(im, axis=0), axis=1, out=sat[1:, 1:])
+    return sat[h:, w:] - sat[:-h, w:] - sat[h:, :-w] + sat[:-h, :-w]
+
+
+class TemplateBank:
+    """Templates (N, h, w) prepared for frames of shape frame_shape.
+
+    mode="full" gives the maps of scipy.signal.correlate; mode="valid" only
+    the positions where the template lies completely inside the frame, which
+    is all score="ncc" needs and takes transforms of the frame size only
+    (those positions do not wrap around). workers is passed to scipy.fft
+    (threads per transform). dtype=np.float32 transforms in single precision,
+    about 1.5x faster. spectra can be given to reuse the transforms computed by another bank of the same
+    templates and frame shape (see correlate_stack).
+    """
+
+    def __init__(self, templates, frame_shape, workers=1, spectra=None, dtype=float, mode="full"):
+        from scipy import fft
+
+        if mode not in MODES:
+            raise ValueError(f"Unknown mode {mode!r}, use one of {MODES}")
+        self.dtype = np.dtype(dtype)
+        self.templates = np.asarray(templates, dtype=self.dtype)
+        self.frame_shape = tuple(frame_shape)
+        self.workers = workers
+        self.mode = mode
+        h, w = self.templates.shape[-2:]
+        if h > self.frame_shape[0] or w > self.frame_shape[1]:
+            raise ValueError(f"templates ({h}, {w}) are larger than the frames {self.frame_shape}")
+        self.full_shape = (self.frame_shape[0] + h - 1, self.frame_shape[1] + w - 1)
+        # region of the (circular) correlation that is returned, padded to sizes scipy.fft is fast for
+        if mode == "full":
+            self.region = (slice(0, self.full_shape[0]), slice(0, self.full_shape[1]))
+            self.fft_shape = tuple(fft.next_fast_len(n, real=True) for n in self.full_shape)
+        else:
+            self.region = (slice(h - 1, self.frame_shape[0]), slice(w - 1, self.frame_shape[1]))
+            self.fft_shape = tuple(fft.next_fast_len(n, real=True) for n in self.frame_shape)
+        self.sums = self.templates.sum(axis=(-2, -1))
+        # for the normalised cross-correlation
+        self.size = h * w
+        self.means = self.sums / self.size
+        self.norms = np.sqrt(np.sum((self.templates - self.means[:, None, None])**2, axis=(-2, -1), dtype=float))
+        if spectra is None:
+            # correlate(f, t) == convolve(f, t[::-1, ::-1])
+            spectra = fft.rfftn(self.templates[:, ::-1, ::-1], self.fft_shape, axes=(-2, -1), workers=workers)
+        self.spectra = spectra
+
+    def __len__(self):
+        return len(self.templates)
+
+    def spectrum(self, frame):
+        """Transform of frame, to correlate it with several template subsets."""
+        from scipy import fft
+
+        frame = np.asarray(frame, dtype=self.dtype)
+        if frame.shape != self.frame_shape:
+            raise ValueError(f"frame shape {frame.shape} does not match the bank ({self.frame_shape})")
+        return fft.rfftn(frame, self.fft_shape, workers=self.workers)
+
+    def correlate(self, frame, index=slice(None), spectrum=None):
+        """Correlation maps of frame with the templates[index], (k, H, W)."""
+        from scipy import fft
+
+        if spectrum is None:
+            spectrum = self.spectrum(frame)
+        maps = fft.irfftn(self.spectra[index] * spectrum, self.fft_shape, axes=(-2, -1), workers=self.workers)
+        return maps[(Ellipsis,) + self.region]
+
+    def ncc(self, frame, index=slice(None), spectrum=None):
+        """Normalised cross-correlation (-1..1) of frame with the
+        templates[index] at every valid position, (k, H-h+1, W-w+1)."""
+        frame = np.asarray(frame, dtype=float)
+        maps = self.correlate(frame, index, spectrum)
+        if self.mode == "full":
+            h, w = self.templates.shape[-2:]
+            maps = maps[..., h - 1:self.frame_shape[0], w - 1:self.frame_shape[1]]
+        shape = self.templates.shape[-2:]
+        local_sum = window_sums(frame, shape)
+        local_var = np.maximum(window_sums(frame * frame, shape) - local_sum**2 / self.size, 0)
+        # sum f * (t - mean t) = correlation - mean t * local sum of f
+        means = np.atleast_1d(self.means[index])[:, None, None]
+        norms = np.atleast_1d(self.norms[index])[:, None, None]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            out = (maps - means * local_sum) / (norms * np.sqrt(local_var))
+        return np.nan_to_num(out, nan=0.0, posinf=0.0, neginf=0.0)
+
+    def scores(self, frame, score="max", index=slice(None), spectrum=None):
+        """One score per template: "max" or "mean" of the correlation map, as
+        in CorrelateWithAstigmatismStack.py, or "ncc", the best normalised
+        cross-correlation over all positions."""
+        if score == "max":
+            return self.correlate(frame, index, spectrum).max(axis=(-2, -1))
+        if score == "mean":
+            if self.mode == "full":
+                # every product f[i] * t[j] appears once in the full map
+                return np.asarray(frame, dtype=float).sum() * self.sums[index] / np.prod(self.full_shape)
+            return self.correlate(frame, index, spectrum).mean(axis=(-2, -1))
+        if score == "ncc":
+            return self.ncc(frame, index, spectrum).max(axis=(-2, -1))
+        raise ValueError(f"Unknown score {score!r}, use one of {SCORES}")
+
+
+# the shared arrays of a correlate_stack worker process
+_shared = {}
+
+
+def _share(array, blocks):
+    from multiprocessing import shared_memory
+
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, array.dtype, buffer=shm.buf)[...] = array
+    blocks.append(shm)
+    return shm.name, array.shape, array.dtype.str
+
+
+def _attach(name, shape, dtype):
+    from multiprocessing import shared_memory
+
+    shm = shared_memory.SharedMemory(name=name)
+    _shared.setdefault("blocks", []).append(shm)
+    return np.ndarray(shape, np.dtype(dtype), buffer=shm.buf)
+
+
+def _init_worker(frames, templates, spectra, workers, mode):
+    frames = _attach(*frames)
+    templates = _attach(*templates)
+    _shared["frames"] = frames
+    _shared["bank"] = TemplateBank(templates, frames.shape[1:], workers, _attach(*spectra), templates.dtype, mode)
+
+
+def _score_range(start, stop, score):
+    bank = _shared["bank"]
+    frames = _shared["frames"]
+    return start, np.stack([bank.scores(frames[i], score) for i in range(start, stop)])
+
+
+def correlate_stack(frames, templates, score="max", processes=None, workers=None, chunk=8, dtype=float,
+                    mode="full"):
+    """Scores (n_frames, n_templates) of every frame (ROIs of one shape)
+    against every template.
+
+    By default (processes=None or 1) everything runs in this process, with
+    workers scipy.fft threads (default: all cores). processes > 1 splits the
+    frames across a pool of that many worker processes, workers then defaults
+    to the cores left per process; with the "spawn" start method (macOS,
+    Windows) the calling script has to guard its top level with
+    if __name__ == "__main__".
+    """
+    frames = np.ascontiguousarray(frames, dtype=dtype)
+    templates = np.ascontiguousarray(templates, dtype=dtype)
+    processes = processes or 1
+    workers = workers or max(1, os.cpu_count() // processes)
+    bank = TemplateBank(templates, frames.shape[1:], workers, dtype=dtype, mode=mode)
+    if processes == 1 or len(frames) <= chunk:
+        return np.stack([bank.scores(frame, score) for frame in frames])
+
+    blocks = []
+    try:
+        shared = (_share(frames, blocks), _share(templates, blocks), _share(bank.spectra, blocks), workers, mode)
+        out = np.empty((len(frames), len(templates)))
+        with multiprocessing.Pool(processes, _init_worker, shared) as pool:
+            tasks = [(i, min(i + chunk, len(frames)), score) for i in range(0, len(frames), chunk)]
+            for start, scores in pool.starmap(_score_range, tasks):
+                out[start:start + len(scores)] = scores
+        return out
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+
+def parabolic_peak(left, center, right):
+    """Offset (-0.5..0.5) of the vertex of the parabola through three equally
+    spaced samples, 0 if they do not form a maximum."""
+    curvature = left - 2 * center + right
+    if curvature >= 0:
+        return 0.0
+    return float(np.clip(0.5 * (left - right) / curvature, -0.5, 0.5))
+
+
+class ZSearch:
+    """Coarse-to-fine search for the best matching template of a frame.
+
+    Without a previous estimate every coarse_step-th template is scored, then
+    the step is halved around the best one down to single slices. With a
+    previous estimate only its neighbours are scored and the search climbs
+    towards the better side; if it has to climb more than max_climb slices
+    the frame starts over with the coarse search. In both cases the peak
+    is refined with a parabola through the best slice and its neighbours,
+    so the estimate is continuous. z gives the z position of every template
+    (default: the template index).
+
+    Assumes the score is unimodal in z, as score="ncc" is. The raw
+    correlation maximum is only for background corrected ROIs and templates
+    of equal energy; otherwise it grows towards the widest templates.
+    """
+
+    def __init__(self, bank, score="max", z=None, coarse_step=8, max_climb=4, track=True):
+        self.bank = bank
+        self.score = score
+        self.z = np.arange(len(bank), dtype=float) if z is None else np.asarray(z, dtype=float)
+        if len(self.z) != len(bank):
+            raise ValueError(f"z has {len(self.z)} entries for {len(bank)} templates")
+        self.coarse_step = max(1, coarse_step)
+        self.max_climb = max_climb
+        self.track = track
+        self.reset()
+
+    def reset(self):
+        self.index = None
+
+    def search(self, frame):
+        """Returns {"index", "z", "score", "evaluated"}; index is the fractional
+        template index of the peak, evaluated the number of templates scored."""
+        n = len(self.bank)
+        spectrum = self.bank.spectrum(frame)
+        cache = {}
+
+        def scores(indices):
+            new = sorted({i for i in indices if 0 <= i < n and i not in cache})
+            if new:
+                cache.update(zip(new, self.bank.scores(frame, self.score, new, spectrum)))
+            return max((i for i in indices if 0 <= i < n), key=cache.get)
+
+        best = None
+        if self.track and self.index is not None:
+            best = scores((self.index - 1, self.index, self.index + 1))
+            climbed = 0
+            # climb until the best slice is better than both its neighbours
+            while not all(i in cache for i in (best - 1, best + 1) if 0 <= i < n):
+                if climbed == self.max_climb:
+                    best = None
+                    break
+                best = scores((best - 1, best, best + 1))
+                climbed += 1
+        if best is None:
+            step = self.coarse_step
+            best = scores(range(0, n, step))
+            while step > 1:
+                step //= 2
+                best = scores((best - step, best, best + step))
+            best = scores((best - 1, best, best + 1))
+        offset = 0.0
+        if 0 < best < n - 1:
+            offset = parabolic_peak(cache[best - 1], cache[best], cache[best + 1])
+        self.index = best
+        index = best + offset
+        return {"index": index, "z": float(np.interp(index, np.arange(n), self.z)), "score": float(cache[best]),
+                "evaluated": len(cache)}
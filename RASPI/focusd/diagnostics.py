@@ -0,0 +1,191 @@
+"""
+Diagnostic plots rendered off the processing loop.
+
+The processing loop hands fit results and a downsampled ROI thumbnail to a
+DiagnosticsSink; a separate process (worker="process") or thread
+(worker="thread") renders them into PNG files. Only every Nth frame and anomalous frames (failed fit, non-finite or
+jumping focus value) are sent, the renderer is capped at max_rate plots per
+second and a full queue drops the plot instead of blocking, so the loop runs
+at the same speed with or without diagnostics.
+
+    sink = DiagnosticsSink(render_focus_fit, every=25)
+    for i, frame in enumerate(frames):
+        result = metric.evaluate(frame)
+        sink.submit(i, result)
+    sink.close()
+
+The worker process is started with the sink, so under the spawn start method
+(macOS, Windows) a script creating a process sink at top level has to guard it
+with if __name__ == "__main__". Scripts without that guard use
+worker="thread"; the thread renders under the GIL, so it costs the loop some
+time per plot but never blocks it.
+"""
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def thumbnail(im, size=64):
+    """Strided downsample of im to at most size pixels along each axis, and
+    the step used."""
+    im = np.asarray(im)
+    step = max(1, int(np.ceil(max(im.shape[:2]) / size)))
+    return np.ascontiguousarray(im[::step, ::step]), step
+
+
+def render_focus_fit(payload, path):
+    """The three panel plot of processautofocus.py: x fit, y fit and ROI."""
+    from matplotlib.figure import Figure
+    from .focus_algorithm import DoubleGaussian1D, Gaussian1D
+
+    projX, projY = payload["projX"], payload["projY"]
+    x, y = np.arange(len(projX)), np.arange(len(projY))
+    fig = Figure(figsize=(10, 5))
+    fig.suptitle(f"Autofocus Fit for Step {payload['index']} with Focus Value {payload['focus']:.2f}")
+    ax = fig.add_subplot(1, 3, 1)
+    if payload.get("poptx") is not None:
+        ax.plot(x, DoubleGaussian1D(x, *payload["poptx"]), label="Fit")
+    ax.plot(x, projX, label="Data")
+    ax.set(title="X Fit", xlabel="X Position", ylabel="Intensity")
+    ax.legend()
+    ax = fig.add_subplot(1, 3, 2)
+    if payload.get("popty") is not None:
+        ax.plot(y, Gaussian1D(y, *payload["popty"]), label="Fit")
+    ax.plot(y, projY, label="Data")
+    ax.set(title="Y Fit", xlabel="Y Position", ylabel="Intensity")
+    ax.legend()
+    ax = fig.add_subplot(1, 3, 3)
+    step = payload["step"]
+    ax.imshow(payload["thumbnail"], extent=(0, payload["thumbnail"].shape[1] * step,
+                                            payload["thumbnail"].shape[0] * step, 0))
+    if np.isfinite(payload.get("sx", np.nan)):
+        x0, y0, sx, sy = payload["x0"], payload["y0"], payload["sx"], payload["sy"]
+        ax.plot((x0, x0 + sx), (y0, y0))
+        ax.plot((x0, x0), (y0, y0 + sy))
+    fig.savefig(path)
+
+
+def render_roi_trace(payload, path):
+    """ROI next to the trace(s) of the focus signal (ESP32 readers,
+    FitHoughEllipse.py); a 2D trace is plotted column by column."""
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(8, 4))
+    fig.add_subplot(1, 2, 1).imshow(payload["thumbnail"])
+    ax = fig.add_subplot(1, 2, 2)
+    ax.plot(payload.get("trace", []))
+    ax.set(title=f"frame {payload['index']}: {payload['focus']:.3g}")
+    fig.savefig(path)
+
+
+def _render_worker(jobs, render, outdir, prefix, max_rate, use_agg=True):
+    if use_agg:
+        # a thread must not switch the backend of the pyplot the script may be using
+        import matplotlib
+        matplotlib.use("Agg")
+    os.makedirs(outdir, exist_ok=True)
+    last = 0.0
+    while True:
+        payload = jobs.get()
+        if payload is None:
+            break
+        # anomalies are always plotted, the periodic plots only at max_rate
+        now = time.monotonic()
+        if not payload["anomalous"] and now - last < 1.0 / max_rate:
+            continue
+        last = now
+        try:
+            render(payload, os.path.join(outdir, f"{prefix}_{payload['index']}.png"))
+        except Exception:
+            logger.exception("rendering diagnostics for frame %s failed", payload["index"])
+
+
+class DiagnosticsSink:
+    """Queue fit results to a rendering process or thread, see the module
+    docstring.
+
+    render(payload, path) is called in the worker with a dict containing
+    index, focus, anomalous, thumbnail, step and whatever small entries
+    (projections, fit parameters, trace) the result carried. For
+    worker="process" it has to be a module level function so it can be sent
+    to the worker process; for worker="thread" it must not use pyplot (draw on
+    a matplotlib.figure.Figure like the renderers here).
+    """
+
+    WORKERS = ("process", "thread")
+
+    # entries of FocusMetric.evaluate results that are sent along (not "im")
+    KEYS = ("focus", "sx", "sy", "x0", "y0", "poptx", "popty", "projX", "projY", "trace")
+
+    def __init__(self, render=render_focus_fit, outdir="diagnostics", prefix="autofocus_fit", every=25,
+                 max_rate=2.0, max_jump=0.5, queue_size=4, thumbnail_size=64, worker="process"):
+        if worker not in self.WORKERS:
+            raise ValueError(f"Unknown worker {worker!r}, use one of {self.WORKERS}")
+        self.worker = worker
+        self.every = every
+        self.max_jump = max_jump
+        self.thumbnail_size = thumbnail_size
+        self.dropped = 0
+        self.sent = 0
+        self.count = 0
+        self._last_focus = None
+        if worker == "thread":
+            self.jobs = queue.Queue(queue_size)
+            self.process = threading.Thread(target=_render_worker, daemon=True,
+                                            args=(self.jobs, render, outdir, prefix, max_rate, False))
+        else:
+            self.jobs = multiprocessing.Queue(queue_size)
+            self.process = multiprocessing.Process(target=_render_worker, daemon=True,
+                                                   args=(self.jobs, render, outdir, prefix, max_rate))
+        self.process.start()
+
+    def is_anomalous(self, result):
+        focus = result.get("focus", np.nan) if result else np.nan
+        if not np.isfinite(focus):
+            return True
+        last, self._last_focus = self._last_focus, focus
+        return last is not None and abs(focus - last) > self.max_jump
+
+    def submit(self, index, result, roi=None):
+        """Offer one frame's result (e.g. FocusMetric.evaluate output); never blocks."""
+        anomalous = self.is_anomalous(result)
+        self.count += 1
+        if not anomalous and (not self.every or (self.count - 1) % self.every):
+            return False
+        roi = result.get("im") if roi is None else roi
+        payload = {k: result[k] for k in self.KEYS if k in result}
+        payload.setdefault("focus", np.nan)
+        payload.update(index=index, anomalous=anomalous)
+        payload["thumbnail"], payload["step"] = thumbnail(roi, self.thumbnail_size) if roi is not None \
+            else (np.zeros((1, 1)), 1)
+        try:
+            self.jobs.put_nowait(payload)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self.sent += 1
+        return True
+
+    def close(self, timeout=10):
+        """Let the worker finish the queued plots and stop it."""
+        try:
+            self.jobs.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive() and self.worker == "process":
+            # a daemon thread cannot be stopped, it ends with the interpreter
+            self.process.terminate()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,120 @@
+"""
+Auto exposure for the focus camera, driven by the ROI only.
+
+The ESP32 firmware runs with AEC/AGC off and exposure ("t<value>") and gain
+("g<value>") were set by hand. A saturated spot flattens the Gaussian
+profiles, a dim one drowns in noise. AutoExposure looks at a histogram of the
+ROI that the pipeline extracted anyway: the peak level (a high percentile,
+robust against hot pixels) should stay in the target band and only a tiny
+fraction of pixels may be saturated. Outside the band it changes exposure
+first and gain last when brightening (gain adds noise), and the other way
+round when darkening, in steps of at most max_step. The band is the
+hysteresis, confirm_frames frames have to agree before a change, and after a
+change settle_frames frames are skipped until the camera applied it.
+
+    auto = AutoExposure(exposure=100, gain=0)
+    for t, frame in source:
+        track = tracker.update(frame)
+        settings = auto.update(track["roi"])
+        if settings:
+            source.set_exposure(**settings)    # applied between frames
+"""
+import numpy as np
+
+
+class AutoExposure:
+    def __init__(self, exposure=100, gain=0, exposure_range=(1, 1200), gain_range=(0, 30), gain_step=1,
+                 full_scale=255, target=(0.55, 0.85), max_saturated=0.002, percentile=99.5, max_step=1.5,
+                 confirm_frames=2, settle_frames=2, integer=True):
+        if not 0 < target[0] < target[1] <= 1:
+            raise ValueError(f"target band {target} has to be within (0, 1]")
+        self.exposure = exposure
+        self.gain = gain
+        self.exposure_range = exposure_range
+        self.gain_range = gain_range
+        self.gain_step = gain_step
+        self.full_scale = full_scale
+        self.target = target
+        self.max_saturated = max_saturated
+        self.percentile = percentile
+        self.max_step = max_step
+        self.confirm_frames = confirm_frames
+        self.settle_frames = settle_frames
+        self.integer = integer
+        self.changes = 0
+        self._outside = 0
+        self._since_change = settle_frames
+
+    def histogram(self, roi):
+        """Counts over 0..full_scale, one bin per level (at most 4096 bins);
+        the bins of float ROIs are centred on the levels, so only values that
+        round to full scale fall into the last one."""
+        roi = np.asarray(roi)
+        n = min(self.full_scale + 1, 4096)
+        if roi.dtype.kind in "ui" and n == self.full_scale + 1:
+            return np.bincount(np.clip(roi.ravel(), 0, self.full_scale), minlength=n)
+        edges = (np.arange(n + 1) - 0.5) * (self.full_scale / (n - 1))
+        counts, _ = np.histogram(np.clip(roi, 0, self.full_scale), bins=edges)
+        return counts
+
+    def stats(self, roi):
+        """Peak level (the percentile, as fraction of full scale) from the
+        histogram and the fraction of pixels at full scale."""
+        roi = np.asarray(roi)
+        counts = self.histogram(roi)
+        total = counts.sum()
+        if not total:
+            return 0.0, 0.0
+        level = np.searchsorted(np.cumsum(counts), self.percentile / 100 * total)
+        # counted directly, a float value just below full scale is not saturated
+        return level / (len(counts) - 1), np.count_nonzero(roi >= self.full_scale) / total
+
+    def update(self, roi):
+        """Feed the ROI of one frame; returns {"exposure", "gain"} when they
+        should change, else None."""
+        self._since_change += 1
+        if self._since_change <= self.settle_frames:
+            return None
+        peak, saturated = self.stats(roi)
+        low, high = self.target
+        if saturated > self.max_saturated:
+            # a saturated peak says nothing about how much too bright it is
+            factor = 1 / self.max_step
+        elif peak > high:
+            factor = max(1 / self.max_step, np.mean(self.target) / peak)
+        elif peak < low:
+            factor = min(self.max_step, np.mean(self.target) / max(peak, 1e-3))
+        else:
+            self._outside = 0
+            return None
+        self._outside += 1
+        if self._outside < self.confirm_frames:
+            return None
+        exposure, gain = self._step(factor)
+        if exposure == self.exposure and gain == self.gain:
+            # at the limits
+            return None
+        self.exposure, self.gain = exposure, gain
+        self.changes += 1
+        self._outside = 0
+        self._since_change = 0
+        return {"exposure": exposure, "gain": gain}
+
+    def _step(self, factor):
+        exposure, gain = self.exposure, self.gain
+        (e_min, e_max), (g_min, g_max) = self.exposure_range, self.gain_range
+        if factor > 1:
+            if exposure < e_max:
+                exposure = min(e_max, exposure * factor)
+                if self.integer:
+                    exposure = max(int(round(exposure)), self.exposure + 1)
+            else:
+                gain = min(g_max, gain + self.gain_step)
+        else:
+            if gain > g_min:
+                gain = max(g_min, gain - self.gain_step)
+            else:
+                exposure = max(e_min, exposure * factor)
+                if self.integer:
+                    exposure = max(e_min, min(int(round(exposure)), self.exposure - 1))
+        return exposure, gain
@@ -0,0 +1,281 @@
+"""
+Focus metric of processautofocus.py (see §5 of the software specification).
+
+The projections of the spot are fitted with a double Gaussian along x and a
+single Gaussian along y; the focus value is the ratio of the fitted sigmas.
+"""
+import time
+from functools import lru_cache
+
+import numpy as np
+
+from . import blur, core
+from .profiling import Profiler
+
+
+# Define the model function. In our case, a 1D Gaussian.
+def Gaussian1D(xdata, i0, x0, sX, amp):
+    x = xdata
+    x0 = float(x0)
+    eq = i0+amp*np.exp(-((x-x0)**2/2/sX**2))
+    return eq
+
+
+def DoubleGaussian1D(xdata, i0, x0, sX, amp, dist):
+    x = xdata
+    x0 = float(x0)
+    eq = i0+amp*np.exp(-((x-(x0-dist/2))**2/2/sX**2)) + amp*np.exp(-((x-(x0+dist/2))**2/2/sX**2))
+    return eq
+
+
+def variance_difference(roi):
+    """ratioXY of the ESP32 reader: var of the x projection minus var of the
+    y projection, ~0 in focus and signed above/below."""
+    return np.var(np.mean(roi, axis=0)) - np.var(np.mean(roi, axis=1))
+
+
+def moment_sigmas(im):
+    """sx, sy of a background-free spot from its second moments, a cheap
+    alternative to the Gaussian fits."""
+    projX = np.sum(im, axis=0)
+    projY = np.sum(im, axis=1)
+    x = np.arange(len(projX))
+    y = np.arange(len(projY))
+    total = np.sum(projX)
+    x0 = np.sum(x * projX) / total
+    y0 = np.sum(y * projY) / total
+    return np.sqrt(np.sum((x - x0)**2 * projX) / total), np.sqrt(np.sum((y - y0)**2 * projY) / total)
+
+
+EDGE_MODES = ("threshold", "sobel")
+
+
+@lru_cache(maxsize=8)
+def _slope_kernel(sigma):
+    # derivative of a Gaussian, scaled to return the slope of a ramp (np.convolve flips it)
+    r = max(int(np.ceil(3 * sigma)), 1)
+    x = np.arange(-r, r + 1)
+    g = np.exp(-x * x / (2.0 * sigma * sigma))
+    return -x * g / np.sum(x * x * g)
+
+
+def _run(proj, peak, level):
+    # first and last crossing of level around proj[peak], interpolated between pixels
+    below = np.flatnonzero(proj <= level)
+    before, after = below[below < peak], below[below > peak]
+    i = before[-1] + 1 if len(before) else 0
+    j = after[0] - 1 if len(after) else len(proj) - 1
+    first, last = float(i), float(j)
+    if i > 0:
+        first -= (proj[i] - level) / (proj[i] - proj[i - 1])
+    if j < len(proj) - 1:
+        last += (proj[j] - level) / (proj[j] - proj[j + 1])
+    return first, last
+
+
+def _steepest(proj, peak, sigma):
+    # distance between the steepest rise before and the steepest fall after the peak
+    kernel = _slope_kernel(sigma)
+    slope = np.convolve(np.pad(proj, len(kernel) // 2, mode="edge"), kernel, mode="valid")
+    positions = []
+    for s, start, stop in ((slope, 0, peak + 1), (-slope, peak, len(slope))):
+        i = start + int(np.argmax(s[start:stop]))
+        position = float(i)
+        if 0 < i < len(s) - 1 and s[i - 1] - 2 * s[i] + s[i + 1] < 0:
+            # vertex of the parabola through the peak and its neighbours
+            position += 0.5 * (s[i - 1] - s[i + 1]) / (s[i - 1] - 2 * s[i] + s[i + 1])
+        positions.append(position)
+    return positions[1] - positions[0]
+
+
+def edge_extents(im, level=0.5, background=None, mode="threshold", sigma=2):
+    """x and y extent of the spot outline from max projections of im, the
+    rows and columns a Canny edge image of the spot would cover (focusValues2
+    of FitHoughEllipse.py) without the 2D edge detection.
+
+    The spot is the region around the maximum above background (default:
+    median of im) + level * (max - background); the x projection is taken
+    over its rows and the y projection over its columns, so other bright
+    structures do not count. mode="threshold" measures where the projections
+    cross that level, interpolated between pixels; mode="sobel" the distance
+    between the steepest rise and fall of the projections, smoothed with a
+    Gaussian derivative of width sigma. NaN if nothing is above the background.
+    """
+    im = np.asarray(im, dtype=float)
+    if mode not in EDGE_MODES:
+        raise ValueError(f"Unknown mode {mode!r}, use one of {EDGE_MODES}")
+    if background is None:
+        # median without the full sort of np.median
+        background = np.partition(im.ravel(), im.size // 2)[im.size // 2]
+    peak_y, peak_x = np.unravel_index(np.argmax(im), im.shape)
+    if not im[peak_y, peak_x] > background:
+        return np.nan, np.nan
+    level = background + level * (im[peak_y, peak_x] - background)
+    y0, y1 = _run(im.max(axis=1), peak_y, level)
+    projX = im[int(np.floor(y0)):int(np.ceil(y1)) + 1].max(axis=0)
+    x0, x1 = _run(projX, peak_x, level)
+    projY = im[:, int(np.floor(x0)):int(np.ceil(x1)) + 1].max(axis=1)
+    y0, y1 = _run(projY, peak_y, level)
+    if mode == "sobel":
+        return _steepest(projX, peak_x, sigma), _steepest(projY, peak_y, sigma)
+    return x1 - x0, y1 - y0
+
+
+def to_gray(frame, channel=-2):
+    """Pick one colour channel of an RGB frame (the script uses [:,:,-2])."""
+    frame = np.asarray(frame)
+    if frame.ndim == 3:
+        frame = frame[:, :, channel]
+    return frame.astype(float)
+
+
+class FocusMetric:
+    """Compute the focus value F = sx/sy of a single camera frame.
+
+    backend selects the Gaussian blur from focusd.blur for both the spot
+    localisation (sigma_locate) and the smoothing of the crop (sigma_smooth).
+
+    mode="blur" smooths the 2D crop before thresholding and projecting, as
+    processautofocus.py does. mode="project" thresholds the crop after a cheap
+    presmooth x presmooth box filter, projects it and then smooths only the two
+    1D projections, i.e. O(N^2 + N*k) instead of O(N^2*k) per frame. Since the
+    threshold does not commute with the blur the focus values differ slightly,
+    see focusd.benchmarks.projection.
+
+    profiler (focusd.profiling.Profiler) times the stages locate, crop,
+    background, blur, projection and fit; by default timing is disabled. The
+    caller times the hand-off of the result with the same profiler as stage
+    "publish" (see processautofocus.py and focusd.manager).
+
+    With a tracker (focusd.tracker.SpotTracker) the spot is followed from frame
+    to frame and its ROI replaces locate/crop (radius is then unused); for a
+    tracker with auto_size=False the fitted sigmas size its ROI.
+
+    background_model (focusd.background.BackgroundModel) is updated with every
+    frame and corrects the ROI in place before preprocessing (stage
+    "background"); with its mode="divide" the ROI is in units of the
+    background, so background (the threshold) has to be chosen accordingly.
+    """
+
+    MODES = ("blur", "project")
+
+    def __init__(self, radius=300, background=40, sigma_locate=111, sigma_smooth=11,
+                 backend="fft", channel=-2, maxfev=50000, mode="blur", presmooth=3, profiler=None,
+                 tracker=None, background_model=None):
+        if backend not in blur.BACKENDS:
+            raise ValueError(f"Unknown blur backend {backend!r}, use one of {blur.BACKENDS}")
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown mode {mode!r}, use one of {self.MODES}")
+        self.radius = radius
+        self.background = background
+        self.sigma_locate = sigma_locate
+        self.sigma_smooth = sigma_smooth
+        self.backend = backend
+        self.channel = channel
+        self.maxfev = maxfev
+        self.mode = mode
+        self.presmooth = presmooth
+        self.profiler = profiler or Profiler(enabled=False)
+        self.tracker = tracker
+        self.background_model = background_model
+
+    def locate(self, im):
+        """Coordinates of the maximum of the strongly blurred frame."""
+        im_gauss = blur.gaussf(im, self.sigma_locate, self.backend)
+        return np.unravel_index(np.argmax(im_gauss), im_gauss.shape)
+
+    def crop(self, im, center):
+        return core.extract(im, (self.radius*2, self.radius*2), center)
+
+    def preprocess(self, im):
+        """Smooth and threshold the crop, return it with its x/y projections."""
+        if self.mode == "project":
+            return self._preprocess_projections(im)
+        prof = self.profiler
+        t0 = prof.tic()
+        im = blur.gaussf(im, self.sigma_smooth, self.backend)
+        prof.toc("blur", t0)
+        t0 = prof.tic()
+        im = im-np.mean(im)/2
+        im[im < self.background] = 0
+        projX = np.mean(im, axis=0)
+        projY = np.mean(im, axis=1)
+        prof.toc("projection", t0)
+        return im, projX, projY
+
+    def _preprocess_projections(self, im):
+        prof = self.profiler
+        t0 = prof.tic()
+        # the blur preserves the mean, so the offset can be taken before smoothing
+        offset = np.mean(im)/2
+        if self.presmooth > 1:
+            from scipy import ndimage
+            im = ndimage.uniform_filter(im, self.presmooth)
+        im = im-offset
+        im[im < self.background] = 0
+        projX = np.mean(im, axis=0)
+        projY = np.mean(im, axis=1)
+        prof.toc("projection", t0)
+        t0 = prof.tic()
+        projX = blur.gaussf1d(projX, self.sigma_smooth, self.backend)
+        projY = blur.gaussf1d(projY, self.sigma_smooth, self.backend)
+        prof.toc("blur", t0)
+        return im, projX, projY
+
+    def fit(self, projX, projY):
+        # scipy.optimize is the slowest import of the pipeline, load it with the first fit
+        from scipy.optimize import curve_fit
+        w1 = len(projX)
+        h1 = len(projY)
+        x = np.arange(w1)
+        y = np.arange(h1)
+
+        # Initial guess for the gauss fit
+        i0 = np.mean(projX)
+        amp = np.max(projX) - i0
+        sX = np.std(projX)
+        sY = np.std(projY)
+        init_guess_x = [i0, w1/2, sX, amp, 100]
+        init_guess_y = [i0, h1/2, sY, amp]
+
+        poptx, _ = curve_fit(DoubleGaussian1D, x, projX, p0=init_guess_x, maxfev=self.maxfev)
+        popty, _ = curve_fit(Gaussian1D, y, projY, p0=init_guess_y, maxfev=self.maxfev)
+        return poptx, popty
+
+    def evaluate(self, frame):
+        """Run the full pipeline and return a dict with the focus value and
+        the intermediate results (crop, projections, fit parameters)."""
+        t = time.time()
+        prof = self.profiler
+        t0 = prof.tic()
+        if self.tracker is not None:
+            track = self.tracker.update(frame)
+            im, center = track["roi"], track["center"]
+            prof.toc("locate", t0)
+        else:
+            im = to_gray(frame, self.channel)
+            center = self.locate(im)
+            prof.toc("locate", t0)
+            t0 = prof.tic()
+            im = self.crop(im, center)
+            prof.toc("crop", t0)
+        if self.background_model is not None:
+            t0 = prof.tic()
+            self.background_model.update(frame)
+            im = self.background_model.correct(np.asarray(im, dtype=float), center)
+            prof.toc("background", t0)
+        im, projX, projY = self.preprocess(im)
+        t0 = prof.tic()
+        poptx, popty = self.fit(projX, projY)
+        prof.toc("fit", t0)
+        sx, sy = poptx[2], popty[2]
+        if self.tracker is not None and not self.tracker.auto_size:
+            # the x profile is two Gaussians dist apart
+            self.tracker.set_sigmas(abs(sx) + abs(poptx[4]) / 2, sy)
+        return {"t": t, "focus": float(sx / sy), "sx": sx, "sy": sy,
+                "x0": poptx[1], "y0": popty[1], "poptx": poptx, "popty": popty,
+                "center": center, "im": im, "projX": projX, "projY": projY}
+
+    def compute(self, frame):
+        """Focus value of frame as a single float."""
+        return self.evaluate(frame)["focus"]
@@ -0,0 +1,176 @@
+"""
+Link health of the ESP32 serial camera.
+
+A marginal USB cable loses or shifts bytes now and then; resetting the ESP32
+for every such error (as the old error handler of
+ESP32SerialCamGrayBytebuffer.py effectively did) costs several hundred ms of
+dead time each. LinkSupervisor wraps a SerialCamSource, tells the errors
+apart and escalates only while they repeat:
+
+    timeout   short read, the frame did not arrive within the timeout
+    framing   the frame arrived but the sync pattern is missing
+    lost      the port raised an OS error (unplugged, brown-out)
+
+    1. resync   drop the rest of the frame in flight, keep the link
+    2. flush    clear both buffers and wait for the line to go quiet
+    3. reset    hard reset through DTR/RTS and reconnect, with exponential
+                backoff while resets keep failing
+
+A lost device goes straight to step 3. Any good frame returns to step 1 and
+resets the backoff. stats() reports the state, the uptime since the last
+(re)connect, counters per error kind and action and the error rate over the
+last window reads:
+
+    with LinkSupervisor(SerialCamSource(profiler=profiler)) as camera:
+        for t, frame in camera:
+            ...
+"""
+import collections
+import logging
+import time
+
+from .sources import FrameSource, SerialCamSource
+
+logger = logging.getLogger(__name__)
+
+ERRORS = ("timeout", "framing", "lost")
+ACTIONS = ("resync", "flush", "reset")
+
+
+class LinkSupervisor(FrameSource):
+    """Read frames from source (a SerialCamSource, by default built from
+    kwargs) and recover from errors without giving up the stream.
+
+    flush_after and reset_after are the numbers of consecutive errors after
+    which a flush and a hard reset replace the resync. Failed resets are
+    retried after backoff seconds, doubling up to max_backoff. With
+    max_failures, read() raises ConnectionError after that many consecutive
+    errors instead of retrying forever.
+    """
+
+    def __init__(self, source=None, flush_after=2, reset_after=4, backoff=0.5, max_backoff=30.0,
+                 boot_time=0.5, window=200, max_failures=None, **kwargs):
+        if not 0 < flush_after <= reset_after:
+            raise ValueError("need 0 < flush_after <= reset_after")
+        self.source = source if source is not None else SerialCamSource(**kwargs)
+        self.flush_after = flush_after
+        self.reset_after = reset_after
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.boot_time = boot_time
+        self.max_failures = max_failures
+        self.errors = dict.fromkeys(ERRORS, 0)
+        self.actions = dict.fromkeys(ACTIONS, 0)
+        self.frames = 0
+        self.failures = 0
+        self.state = "closed"
+        self.last_error = None
+        self.connected_at = None
+        self._delay = backoff
+        self._resets = 0
+        self._recent = collections.deque(maxlen=window)
+
+    @property
+    def meta(self):
+        return self.source.meta
+
+    def set_exposure(self, exposure=None, gain=None):
+        self.source.set_exposure(exposure, gain)
+
+    def open(self):
+        self.source.open()
+        self.state = "ok"
+        self.connected_at = time.monotonic()
+
+    def read(self):
+        while True:
+            try:
+                if self.source.serial is None:
+                    # a reconnect failed
+                    raise ConnectionError("not connected")
+                item = self.source.read()
+            except TimeoutError as e:
+                kind, error = "timeout", e
+            except OSError as e:
+                # SerialException is an OSError too
+                kind, error = "lost", e
+            else:
+                if item is None:
+                    return None
+                if self.source.offset >= 0:
+                    self._ok()
+                    return item
+                kind, error = "framing", None
+            self._recover(kind, error)
+
+    def _ok(self):
+        self.frames += 1
+        self.failures = 0
+        self._delay = self.backoff
+        self._resets = 0
+        self._recent.append(False)
+        if self.state != "ok":
+            logger.info("link to %s recovered", self.source.port)
+            self.state = "ok"
+
+    def _recover(self, kind, error=None):
+        self.errors[kind] += 1
+        self.failures += 1
+        self.last_error = kind if error is None else f"{kind}: {error}"
+        self._recent.append(True)
+        if self.max_failures is not None and self.failures >= self.max_failures:
+            self.state = "failed"
+            raise ConnectionError(f"{self.failures} consecutive errors on {self.source.port}, "
+                                  f"last {self.last_error}")
+        if kind == "lost" or self.failures >= self.reset_after:
+            action = "reset"
+        elif self.failures >= self.flush_after:
+            action = "flush"
+        else:
+            action = "resync"
+        self.actions[action] += 1
+        self.state = "recovering"
+        logger.debug("%s on %s, %s", self.last_error, self.source.port, action)
+        try:
+            if action == "resync":
+                self.source.drain()
+            elif action == "flush":
+                self.source.flush()
+            else:
+                self._reset()
+        except OSError as e:
+            # the port went away while recovering, the next read counts it as lost
+            logger.debug("%s on %s failed: %s", action, self.source.port, e)
+
+    def _reset(self):
+        if self._resets:
+            # the previous reset did not bring the link back
+            logger.warning("link to %s still down, next reset in %.1f s", self.source.port, self._delay)
+            time.sleep(self._delay)
+            self._delay = min(2 * self._delay, self.max_backoff)
+        self._resets += 1
+        self.state = "resetting"
+        self.connected_at = None
+        self.source.reset(self.boot_time)
+        self.connected_at = time.monotonic()
+
+    @property
+    def uptime(self):
+        """Seconds since the link was last (re)connected, 0 while it is down."""
+        return time.monotonic() - self.connected_at if self.connected_at is not None else 0.0
+
+    @property
+    def error_rate(self):
+        """Fraction of the last window reads that failed."""
+        return sum(self._recent) / len(self._recent) if self._recent else 0.0
+
+    def stats(self):
+        return {"state": self.state, "uptime": self.uptime, "frames": self.frames, "error_rate": self.error_rate,
+                "failures": self.failures, "last_error": self.last_error, "backoff": self._delay,
+                **{f"errors_{kind}": n for kind, n in self.errors.items()},
+                **{f"actions_{action}": n for action, n in self.actions.items()}}
+
+    def close(self):
+        self.source.close()
+        self.state = "closed"
+        self.connected_at = None
@@ -0,0 +1,200 @@
+"""
+Several focus heads on one host.
+
+connect_to_usb_device in ESP32SerialCamGrayBytebuffer.py opens the first
+matching port only. CameraManager opens every port from find_ports() (or the
+ones given) in its own worker process, so acquisition, decoding and the fits
+of one camera never wait for another and the heads spread over the cores.
+Each worker runs an independent FocusMetric and, if there is one for its port,
+its own Calibration; only the scalar results come back through one queue:
+
+    with CameraManager(calibrations={"/dev/ttyACM0": "head0.npz"}) as manager:
+        for result in manager.results():
+            print(result["port"], result["focus"], result["z"])
+
+Port names can change between reboots, the links in /dev/serial/by-id/ do
+not and work as ports and calibration keys. source is called as
+source(port) in the worker and has to be picklable (a class or a
+functools.partial), e.g. functools.partial(ReplaySource, speed=1) with
+recordings as "ports" to test the manager without hardware. Serial cameras
+are read through a LinkSupervisor (focusd.link), so a worker resyncs, flushes
+or resets its ESP32 instead of counting timeouts forever.
+"""
+import logging
+import multiprocessing
+import queue
+import time
+
+import numpy as np
+
+from .link import LinkSupervisor
+from .sources import SerialCamSource, find_ports
+
+logger = logging.getLogger(__name__)
+
+
+def _worker(port, source, metric, calibration, results, stop, link, profile):
+    # runs in the worker process: one camera, one pipeline
+    from .calibration import Calibration
+    from .focus_algorithm import FocusMetric
+    from .profiling import Profiler
+
+    profiler = Profiler(enabled=bool(profile), log_interval=profile,
+                        log=lambda line: logger.info("%s %s", port, line))
+    metric = FocusMetric(profiler=profiler, **metric)
+    calibration = Calibration.load(calibration) if calibration else None
+    index, timeouts, dropped = 0, 0, 0
+    try:
+        camera = source(port)
+        if isinstance(camera, SerialCamSource):
+            camera = LinkSupervisor(camera, **link)
+        with camera:
+            while not stop.is_set():
+                try:
+                    item = camera.read()
+                except TimeoutError:
+                    timeouts += 1
+                    continue
+                if item is None:
+                    break
+                t, frame = item
+                t0 = time.perf_counter()
+                try:
+                    result = metric.evaluate(frame)
+                    focus, sx, sy = result["focus"], float(result["sx"]), float(result["sy"])
+                except (RuntimeError, ValueError):
+                    # the fit did not converge
+                    focus = sx = sy = np.nan
+                z = calibration.z_offset(focus) if calibration is not None and np.isfinite(focus) else np.nan
+                if isinstance(camera, LinkSupervisor):
+                    timeouts = camera.errors["timeout"]
+                message = {"port": port, "index": index, "t": t, "focus": focus, "sx": sx, "sy": sy, "z": z,
+                           "latency": time.perf_counter() - t0, "timeouts": timeouts, "dropped": dropped}
+                index += 1
+                with profiler.stage("publish"):
+                    try:
+                        results.put_nowait(message)
+                    except queue.Full:
+                        dropped += 1
+                profiler.frame_done()
+    except Exception as e:
+        logger.exception("camera %s failed", port)
+        results.put({"port": port, "error": repr(e)})
+    results.put({"port": port, "done": True, "frames": index})
+
+
+class CameraManager:
+    """One acquisition and focus worker process per camera.
+
+    ports defaults to find_ports(manufacturers). metric holds the FocusMetric
+    arguments of all workers; calibrations maps ports to calibration files
+    (a single path is used for every port). Results arrive in one queue of
+    queue_size entries; a worker drops results instead of blocking when it
+    is full (counted in the results as "dropped"). link holds the
+    LinkSupervisor arguments for serial cameras. With profile (seconds) every
+    worker logs its stage timings (focusd.profiling, including "publish", the
+    hand-off to the results queue) at that interval.
+    """
+
+    def __init__(self, ports=None, metric=None, calibrations=None, source=SerialCamSource, queue_size=1024,
+                 manufacturers=("Espressif", "Microsoft"), context=None, link=None, profile=None):
+        self.ports = list(find_ports(manufacturers) if ports is None else ports)
+        if not self.ports:
+            raise IOError("No matching USB device found")
+        self.metric = dict(metric or {})
+        if isinstance(calibrations, str) or calibrations is None:
+            calibrations = dict.fromkeys(self.ports, calibrations)
+        self.calibrations = calibrations
+        self.source = source
+        self.link = dict(link or {})
+        self.profile = profile
+        self.context = context or multiprocessing.get_context()
+        self.queue = self.context.Queue(queue_size)
+        self.stop_event = self.context.Event()
+        self.processes = {}
+        self.latest = {}
+        self.errors = {}
+        self.frames = dict.fromkeys(self.ports, 0)
+        self._running = set()
+        self._t_start = None
+
+    def start(self):
+        for port in self.ports:
+            process = self.context.Process(
+                target=_worker, name=f"focusd-{port}", daemon=True,
+                args=(port, self.source, self.metric, self.calibrations.get(port), self.queue, self.stop_event,
+                      self.link, self.profile))
+            process.start()
+            self.processes[port] = process
+            self._running.add(port)
+        self._t_start = time.perf_counter()
+        return self
+
+    def reset_stats(self):
+        """Count frames and time the frame rate from now on, e.g. once the
+        workers are warmed up."""
+        self.frames = dict.fromkeys(self.ports, 0)
+        self._t_start = time.perf_counter()
+
+    def _handle(self, message):
+        port = message["port"]
+        if "error" in message:
+            self.errors[port] = message["error"]
+            return None
+        if message.get("done"):
+            self._running.discard(port)
+            return None
+        self.latest[port] = message
+        self.frames[port] += 1
+        return message
+
+    def poll(self, timeout=0.0):
+        """Results that arrived so far, waiting up to timeout for the first."""
+        out = []
+        try:
+            message = self.queue.get(timeout=timeout) if timeout else self.queue.get_nowait()
+            while True:
+                message = self._handle(message)
+                if message is not None:
+                    out.append(message)
+                message = self.queue.get_nowait()
+        except queue.Empty:
+            pass
+        return out
+
+    def results(self):
+        """Yield results of all cameras until every worker has finished."""
+        while self._running:
+            try:
+                message = self._handle(self.queue.get(timeout=0.5))
+            except queue.Empty:
+                self._running &= {port for port, process in self.processes.items() if process.is_alive()}
+                continue
+            if message is not None:
+                yield message
+
+    def stats(self):
+        """Frames and frame rate per camera and in total since start()."""
+        elapsed = time.perf_counter() - self._t_start if self._t_start else np.nan
+        per_port = {port: {"frames": n, "fps": n / elapsed, "alive": port in self._running,
+                           "timeouts": self.latest.get(port, {}).get("timeouts", 0),
+                           "dropped": self.latest.get(port, {}).get("dropped", 0),
+                           "error": self.errors.get(port)}
+                    for port, n in self.frames.items()}
+        total = sum(self.frames.values())
+        return {"cameras": per_port, "frames": total, "fps": total / elapsed}
+
+    def stop(self, timeout=2.0):
+        self.stop_event.set()
+        for port, process in self.processes.items():
+            process.join(timeout)
+            if process.is_alive():
+                logger.warning("worker for %s did not stop, terminating it", port)
+                process.terminate()
+        self._running.clear()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,146 @@
+"""
+The focus metrics tried so far in this project, behind one interface: each
+metric is a callable taking a 2D grayscale ROI and returning a float that
+varies monotonically with z over its capture range.
+
+    curve_fit_ratio      sx/sy from Gaussian fits to the projections (processautofocus.py)
+    moment_ratio         sx/sy from the second moments of the thresholded spot
+    variance_difference  ratioXY of ESP32SerialCamSendDecodedBytes.py
+    edge_extent_ratio    rows/columns with Canny edges (focusValues2 in FitHoughEllipse.py)
+    edge_extent_projection  the same extents from the max projections, without Canny
+    hough_orientation    orientation of the Hough ellipse (FitHoughEllipse.py)
+    psf_correlation      z of the best matching simulated PSF (CorrelateWithAstigmatismStack.py)
+
+Use make_metric(name, **kwargs) to get a configured instance.
+"""
+import numpy as np
+
+from . import focus_algorithm
+
+
+class CurveFitRatio:
+    def __init__(self, background=5, sigma_smooth=2, backend="iir", mode="blur"):
+        self.metric = focus_algorithm.FocusMetric(background=background, sigma_smooth=sigma_smooth,
+                                                  backend=backend, mode=mode)
+
+    def __call__(self, roi):
+        _, projX, projY = self.metric.preprocess(np.asarray(roi, dtype=float))
+        poptx, popty = self.metric.fit(projX, projY)
+        return poptx[2] / popty[2]
+
+
+class MomentRatio:
+    def __init__(self, threshold=0.1):
+        self.threshold = threshold
+
+    def __call__(self, roi):
+        im = np.asarray(roi, dtype=float)
+        im = im - np.median(im)
+        im[im < self.threshold * np.max(im)] = 0
+        sx, sy = focus_algorithm.moment_sigmas(im)
+        return sx / sy
+
+
+class VarianceDifference:
+    def __init__(self, sigma=0.5):
+        self.sigma = sigma
+
+    def __call__(self, roi):
+        from scipy import ndimage
+        return focus_algorithm.variance_difference(ndimage.gaussian_filter(np.asarray(roi, dtype=float), self.sigma))
+
+
+class EdgeExtentRatio:
+    def __init__(self, sigma_smooth=1, sigma_canny=2):
+        from skimage.feature import canny
+        self.canny = canny
+        self.sigma_smooth = sigma_smooth
+        self.sigma_canny = sigma_canny
+
+    def __call__(self, roi):
+        from scipy import ndimage
+        edges = self.canny(ndimage.gaussian_filter(np.asarray(roi, dtype=float), self.sigma_smooth), self.sigma_canny)
+        return np.sum(np.sum(edges, 1) > 0) / np.sum(np.sum(edges, 0) > 0)
+
+
+class EdgeExtentProjection:
+    """EdgeExtentRatio from focus_algorithm.edge_extents: thresholded (or
+    Sobel filtered) max projections instead of a Canny edge image, continuous
+    instead of counted in pixels."""
+
+    def __init__(self, sigma_smooth=1, level=0.5, mode="threshold", sigma=2):
+        if mode not in focus_algorithm.EDGE_MODES:
+            raise ValueError(f"Unknown mode {mode!r}, use one of {focus_algorithm.EDGE_MODES}")
+        self.sigma_smooth = sigma_smooth
+        self.level = level
+        self.mode = mode
+        self.sigma = sigma
+
+    def __call__(self, roi):
+        im = np.asarray(roi, dtype=float)
+        if self.sigma_smooth:
+            from scipy import ndimage
+            im = ndimage.gaussian_filter(im, self.sigma_smooth)
+        extent_x, extent_y = focus_algorithm.edge_extents(im, self.level, mode=self.mode, sigma=self.sigma)
+        return extent_y / extent_x
+
+
+class HoughOrientation:
+    def __init__(self, sigma_smooth=1, sigma_canny=2, accuracy=10, min_size=8):
+        from skimage.feature import canny
+        from skimage.transform import hough_ellipse
+        self.canny = canny
+        self.hough_ellipse = hough_ellipse
+        self.sigma_smooth = sigma_smooth
+        self.sigma_canny = sigma_canny
+        self.accuracy = accuracy
+        self.min_size = min_size
+
+    def __call__(self, roi):
+        from scipy import ndimage
+        edges = self.canny(ndimage.gaussian_filter(np.asarray(roi, dtype=float), self.sigma_smooth), self.sigma_canny)
+        result = self.hough_ellipse(edges, accuracy=self.accuracy, min_size=self.min_size)
+        if len(result) == 0:
+            return np.nan
+        result.sort(order="accumulator")
+        return float(result[-1][5])
+
+
+class PSFCorrelation:
+    """Correlate the ROI with a bank of simulated PSFs (templates, one per z in
+    z) and return the z of the best match."""
+
+    def __init__(self, templates=None, z=None, sigma=2):
+        from scipy import ndimage
+        if templates is None:
+            from .simulation import AstigmaticSpot
+            z = np.arange(-30, 30, 1.5)
+            templates = AstigmaticSpot(shape=(64, 64), background=0, noise=0).render_batch(z)
+        self.templates = [ndimage.gaussian_filter(np.asarray(t, dtype=float), sigma) for t in templates]
+        self.z = np.arange(len(self.templates)) if z is None else np.asarray(z)
+
+    def __call__(self, roi):
+        from scipy import signal
+        roi = np.asarray(roi, dtype=float)
+        scores = [np.max(signal.correlate(roi, t, method="fft")) for t in self.templates]
+        return float(self.z[int(np.argmax(scores))])
+
+
+METRICS = {
+    "curve_fit_ratio": CurveFitRatio,
+    "moment_ratio": MomentRatio,
+    "variance_difference": VarianceDifference,
+    "edge_extent_ratio": EdgeExtentRatio,
+    "edge_extent_projection": EdgeExtentProjection,
+    "hough_orientation": HoughOrientation,
+    "psf_correlation": PSFCorrelation,
+}
+
+
+def make_metric(name, **kwargs):
+    """Instantiate a metric by name; raises ImportError if its optional
+    dependency (e.g. scikit-image) is missing."""
+    try:
+        return METRICS[name](**kwargs)
+    except KeyError:
+        raise ValueError(f"Unknown focus metric {name!r}, use one of {list(METRICS)}") from None
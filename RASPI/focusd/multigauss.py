@@ -0,0 +1,204 @@
+"""
+Least-squares fit of a sum of 2D Gaussians on a pixel grid
+(PYTHON/IMAGE_Processing/Fit2DData.py).
+
+Every spot is A * exp(-((x-x0)/xalpha)**2 - ((y-y0)/yalpha)**2), parameters
+per spot in the order of Fit2DData.py: x0, y0, xalpha, yalpha, A. On a grid
+the Gaussian factorises into a row and a column profile, so the model of all
+spots is one (ny, n) @ (n, nx) matrix product of their profiles, and every
+column of the Jacobian is the outer product of two profiles. The fit
+therefore never needs the (ny * nx, n_params) Jacobian: its normal matrix
+J^T J is the elementwise product of the Gram matrices of the row and of the
+column factors, and J^T r one matrix product with the residual, which is what
+the Levenberg-Marquardt iteration of fit() works with:
+
+    model = MultiGaussian2D(x, y)
+    popt, pcov = model.fit(Z, p0)         # p0: 5 parameters per spot
+    fit = model(popt)
+
+The number of spots follows from the length of p0. fit_spots adds spots
+(e.g. the ghost reflections of the coverslip beamsplitter) as long as the
+residual has a peak above min_amplitude.
+"""
+import numpy as np
+
+N_PARAMS = 5
+
+
+class MultiGaussian2D:
+    """Model on the grid of the axes x (nx,) and y (ny,) (as np.meshgrid(x, y));
+    offset=True adds a constant background as last parameter."""
+
+    def __init__(self, x, y, offset=False):
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.offset = offset
+        self.shape = (len(self.y), len(self.x))
+        self._n = None
+
+    def n_spots(self, params):
+        n, rest = divmod(len(params) - bool(self.offset), N_PARAMS)
+        if rest or n < 1:
+            raise ValueError(f"{len(params)} parameters are not {N_PARAMS} per spot"
+                             f"{' plus the offset' if self.offset else ''}")
+        return n
+
+    def _buffers(self, n):
+        # (re)allocate when the number of spots changes
+        if self._n != n:
+            ny, nx = self.shape
+            m = N_PARAMS * n + bool(self.offset)
+            self._n = n
+            self._model = np.empty(self.shape)
+            self._jac = None
+            # row and column factor of every Jacobian column, the offset's are ones
+            self._fy = np.ones((m, ny))
+            self._fx = np.ones((m, nx))
+
+    def _profiles(self, params):
+        n = self.n_spots(params)
+        self._buffers(n)
+        p = np.asarray(params[:N_PARAMS * n], dtype=float).reshape(n, N_PARAMS)
+        x0, y0, xalpha, yalpha, amplitude = (p[:, i:i + 1] for i in range(N_PARAMS))
+        u = (self.x - x0) / xalpha
+        v = (self.y - y0) / yalpha
+        ex = np.exp(-u * u)
+        ey = np.exp(-v * v)
+        return n, amplitude, u, v, ex, ey, xalpha, yalpha
+
+    def __call__(self, params):
+        """Model image (ny, nx); the array is reused by the next call."""
+        n, amplitude, u, v, ex, ey, _, _ = self._profiles(params)
+        np.matmul((amplitude * ey).T, ex, out=self._model)
+        if self.offset:
+            self._model += params[-1]
+        return self._model
+
+    def factors(self, params):
+        """Row (n_params, ny) and column (n_params, nx) factors of the
+        Jacobian: d model / d params[i] = outer(fy[i], fx[i])."""
+        n, amplitude, u, v, ex, ey, xalpha, yalpha = self._profiles(params)
+        fy = self._fy[:N_PARAMS * n].reshape(n, N_PARAMS, -1)
+        fx = self._fx[:N_PARAMS * n].reshape(n, N_PARAMS, -1)
+        # d/dp of A ex ey for p = x0, y0, xalpha, yalpha, A
+        fy[:, 0], fx[:, 0] = amplitude * ey, ex * 2 * u / xalpha
+        fy[:, 1], fx[:, 1] = amplitude * ey * 2 * v / yalpha, ex
+        fy[:, 2], fx[:, 2] = amplitude * ey, ex * 2 * u * u / xalpha
+        fy[:, 3], fx[:, 3] = amplitude * ey * 2 * v * v / yalpha, ex
+        fy[:, 4], fx[:, 4] = ey, ex
+        return self._fy, self._fx
+
+    def jacobian(self, params):
+        """Derivatives (ny * nx, n_params) of the model by the parameters;
+        the array is reused by the next call."""
+        fy, fx = self.factors(params)
+        if self._jac is None:
+            self._jac = np.empty(self.shape + (len(fy),))
+        np.einsum("py,px->yxp", fy, fx, out=self._jac)
+        return self._jac.reshape(-1, len(fy))
+
+    def normal_equations(self, params, residual):
+        """J^T J and J^T residual without forming J."""
+        fy, fx = self.factors(params)
+        return (fy @ fy.T) * (fx @ fx.T), np.einsum("px,px->p", fy @ residual, fx)
+
+    def fit(self, data, p0, sigma=None, max_iter=200, xtol=1e-10, ftol=1e-12, **kwargs):
+        """Least-squares fit to data (ny, nx) from the start parameters p0;
+        returns popt, pcov like curve_fit.
+
+        Unweighted fits run Levenberg-Marquardt on the normal equations
+        above. With sigma (per pixel) or curve_fit arguments such as bounds
+        the fit is left to curve_fit with the analytic Jacobian. Raises
+        RuntimeError if the fit does not converge within max_iter iterations.
+        """
+        data = np.asarray(data, dtype=float)
+        if data.shape != self.shape:
+            raise ValueError(f"data shape {data.shape} does not match the grid {self.shape}")
+        if sigma is not None or kwargs:
+            from scipy.optimize import curve_fit
+
+            sigma = None if sigma is None else np.broadcast_to(sigma, self.shape).ravel()
+            # curve_fit wants xdata; the model always evaluates the whole grid
+            index = np.arange(data.size)
+            return curve_fit(lambda _, *p: self(p).ravel(), index, data.ravel(), p0=p0, sigma=sigma,
+                             jac=lambda _, *p: self.jacobian(p), **kwargs)
+
+        p = np.array(p0, dtype=float)
+        self.n_spots(p)
+        residual = data - self(p)
+        cost = float(np.vdot(residual, residual))
+        # damping scaled by the largest diagonal of J^T J seen so far (as MINPACK)
+        # and updated from the ratio of actual to predicted decrease (Madsen & Nielsen)
+        damping, growth, scale = 1.0, 2.0, None
+        for _ in range(max_iter):
+            jtj, jtr = self.normal_equations(p, residual)
+            scale = np.diag(jtj).copy() if scale is None else np.maximum(scale, np.diag(jtj))
+            scale[scale <= 0] = 1.0
+            while True:
+                try:
+                    step = np.linalg.solve(jtj + damping * np.diag(scale), jtr)
+                    trial = p + step
+                    trial_residual = data - self(trial)
+                    trial_cost = float(np.vdot(trial_residual, trial_residual))
+                    predicted = step @ (damping * scale * step + jtr)
+                    gain = (cost - trial_cost) / predicted if predicted > 0 else -1.0
+                except np.linalg.LinAlgError:
+                    gain = -1.0
+                if gain > 0:
+                    damping *= max(1 / 3, 1 - (2 * gain - 1)**3)
+                    growth = 2.0
+                    break
+                damping *= growth
+                growth *= 2
+                if damping > 1e16:
+                    # no step decreases the cost any more: converged as far as it goes
+                    return p, self._covariance(p, residual, cost)
+            converged = (np.linalg.norm(step) <= xtol * (np.linalg.norm(p) + xtol)
+                         or cost - trial_cost <= ftol * cost)
+            p, residual, cost = trial, trial_residual, trial_cost
+            if converged:
+                return p, self._covariance(p, residual, cost)
+        raise RuntimeError(f"Optimal parameters not found: no convergence within {max_iter} iterations")
+
+    def _covariance(self, params, residual, cost):
+        # as curve_fit: inverse normal matrix scaled by the residual variance
+        jtj, _ = self.normal_equations(params, residual)
+        dof = max(residual.size - len(params), 1)
+        try:
+            return np.linalg.inv(jtj) * cost / dof
+        except np.linalg.LinAlgError:
+            return np.full((len(params), len(params)), np.inf)
+
+
+def fit_spots(data, x=None, y=None, max_spots=3, min_amplitude=None, width=None, offset=True, **kwargs):
+    """Fit as many spots as the data needs, up to max_spots.
+
+    Starts with one spot at the maximum and adds one at the peak of the
+    residual while that peak exceeds min_amplitude (default: 5 times the
+    noise, estimated from the differences of neighbouring pixels so that
+    spots not fitted yet do not count as noise). width is the start
+    xalpha/yalpha (default: a tenth of the grid). Returns popt, pcov, the number of spots.
+    """
+    data = np.asarray(data, dtype=float)
+    x = np.arange(data.shape[1], dtype=float) if x is None else np.asarray(x, dtype=float)
+    y = np.arange(data.shape[0], dtype=float) if y is None else np.asarray(y, dtype=float)
+    model = MultiGaussian2D(x, y, offset=offset)
+    width = width or 0.1 * max(x[-1] - x[0], y[-1] - y[0])
+    background = float(np.median(data)) if offset else 0.0
+    params, popt, pcov = [], None, None
+    residual = data - background
+    if min_amplitude is None:
+        # MAD of the differences along x, where smooth spots hardly contribute
+        step = np.diff(data, axis=1)
+        min_amplitude = 5 * 1.4826 * np.median(np.abs(step - np.median(step))) / np.sqrt(2)
+    for _ in range(max_spots):
+        iy, ix = np.unravel_index(np.argmax(residual), residual.shape)
+        if popt is not None:
+            if residual[iy, ix] < min_amplitude:
+                break
+            params = list(popt[:len(popt) - bool(offset)])
+            background = popt[-1] if offset else 0.0
+        params += [x[ix], y[iy], width, width, residual[iy, ix]]
+        popt, pcov = model.fit(data, params + ([background] if offset else []), **kwargs)
+        residual = data - model(popt)
+    return popt, pcov, model.n_spots(popt)
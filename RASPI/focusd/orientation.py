@@ -0,0 +1,146 @@
+"""
+Streaming orientation and axis ratio of the Hough ellipse (FitHoughEllipse.py).
+
+hough_ellipse reports the orientation only modulo pi/2 (the semi-axes a and b
+swap roles), so the script unwraps the whole series with
+np.unwrap(focusValues, period=np.pi/2) after the recording. OrientationTracker
+unwraps one sample at a time with the same rule, relative to the last sample
+it accepted. Its output is np.unwrap up to a constant multiple of pi/2: the
+first sample is taken modulo pi/2, so that the axis and the sign of z below
+do not depend on how the first ellipse was reported. The state is a few
+numbers, so it can run in the acquisition loop:
+
+    tracker = OrientationTracker(filter="median", window=5)
+    for frame in frames:
+        ...
+        state = tracker.update(orientation, a, b)
+        lock.update(cal.z_offset(state["z"]), t)
+
+The smoothed, unwrapped orientation is the astigmatism axis. With the
+semi-axes, every sample also gives a signed z proxy
+
+    z = (a - b) / (a + b) * cos(2 * (orientation - axis))
+
+the ellipticity along the astigmatism axis (about log(a / b) / 2 near focus).
+It is 0 for a round spot, changes sign through focus and stays the same when
+a and b swap. For spots that the Hough transform fits as lines (a or b = 0,
+most frames of DATA/HoughTransformEllipseSeries) z saturates at +-1 and only
+the unwrapped orientation follows z, as in the script. Near focus the
+orientation of a nearly round ellipse is noise: samples with an ellipticity
+1 - min(a, b) / max(a, b) below min_ellipticity are unwrapped but do not move
+the axis. Orientation and z are smoothed with one of FILTERS:
+
+    "none"        the raw samples
+    "ema"         exponential moving average with weight alpha
+    "median"      running median of the last window samples (drops single
+                  outliers of the Hough fit)
+    "alpha_beta"  alpha-beta filter (per sample), follows a ramp without lag
+"""
+import math
+from collections import deque
+
+
+FILTERS = ("none", "ema", "median", "alpha_beta")
+
+
+class Smoother:
+    """One of FILTERS on a scalar series; update(x) returns the filtered value."""
+
+    def __init__(self, filter="ema", alpha=0.3, beta=0.05, window=5):
+        if filter not in FILTERS:
+            raise ValueError(f"Unknown filter {filter!r}, use one of {FILTERS}")
+        self.filter = filter
+        self.alpha = alpha
+        self.beta = beta
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        self.value = None
+        self.rate = 0.0
+        self._recent = deque(maxlen=self.window)
+
+    def update(self, x):
+        if self.value is None or self.filter == "none":
+            self.value = x
+        elif self.filter == "ema":
+            self.value += self.alpha * (x - self.value)
+        elif self.filter == "alpha_beta":
+            predicted = self.value + self.rate
+            residual = x - predicted
+            self.value = predicted + self.alpha * residual
+            self.rate += self.beta * residual
+        if self.filter == "median":
+            self._recent.append(x)
+            ordered = sorted(self._recent)
+            middle = len(ordered) // 2
+            self.value = ordered[middle] if len(ordered) % 2 else 0.5 * (ordered[middle - 1] + ordered[middle])
+        return self.value
+
+
+class OrientationTracker:
+    """Unwrap, smooth and turn into a z proxy the orientation (rad) and
+    semi-axes of one ellipse per frame.
+
+    period is the ambiguity of the orientation (pi/2 for hough_ellipse). axis
+    is the direction of the astigmatism axis; by default the (smoothed,
+    unwrapped) orientation of the elliptic samples, starting in [0, period).
+    z > 0 where the spot is elongated along the axis.
+    """
+
+    def __init__(self, period=math.pi / 2, filter="ema", alpha=0.3, beta=0.05, window=5, min_ellipticity=0.1,
+                 axis=None):
+        self.period = period
+        self.min_ellipticity = min_ellipticity
+        self.fixed_axis = axis
+        self._orientation = Smoother(filter, alpha, beta, window)
+        self._z = Smoother(filter, alpha, beta, window)
+        self.reset()
+
+    def reset(self):
+        self.samples = 0
+        self.last = None
+        self.unwrapped = None
+        self.axis = self.fixed_axis
+        self._orientation.reset()
+        self._z.reset()
+
+    def unwrap(self, orientation):
+        """orientation continued from the last accepted sample, as np.unwrap
+        (discont = period / 2) continues a series."""
+        if self.last is None:
+            return float(orientation % self.period)
+        step = orientation - self.last
+        if abs(step) >= self.period / 2:
+            step = (step + self.period / 2) % self.period - self.period / 2
+        return self.unwrapped + step
+
+    def update(self, orientation, a=None, b=None):
+        """Feed the orientation (rad) and optionally the semi-axes of one
+        frame; returns a dict with the unwrapped orientation (raw), its smoothed
+        value, the astigmatism axis, the ellipticity and z (smoothed) / z_raw
+        (NaN without semi-axes)."""
+        self.samples += 1
+        unwrapped = self.unwrap(orientation)
+        if a is None or b is None:
+            ellipticity = math.nan
+            reliable = True
+        else:
+            a, b = abs(float(a)), abs(float(b))
+            ellipticity = 1 - min(a, b) / max(a, b) if max(a, b) > 0 else 0.0
+            reliable = ellipticity >= self.min_ellipticity
+        if reliable or self.last is None:
+            self.last = float(orientation)
+            self.unwrapped = unwrapped
+            smoothed = self._orientation.update(unwrapped)
+            if self.fixed_axis is None:
+                self.axis = smoothed
+        else:
+            smoothed = self._orientation.value
+        z_raw = math.nan
+        z = self._z.value if self._z.value is not None else math.nan
+        if a is not None and b is not None and a + b > 0:
+            z_raw = (a - b) / (a + b) * math.cos(2 * (orientation - self.axis))
+            z = self._z.update(z_raw)
+        return {"orientation": unwrapped, "smoothed": smoothed, "axis": self.axis, "ellipticity": ellipticity,
+                "z": z, "z_raw": z_raw}
@@ -0,0 +1,133 @@
+"""
+Principal component basis of the astigmatic template stack.
+
+Neighbouring z-slices of the PSF stack h3 are nearly the same image, so a few
+principal components describe the whole stack. TemplateBasis.fit decomposes
+the (blurred) templates once; at runtime a ROI costs one projection onto
+n_components images, and z follows from the coefficients by the nearest
+template (refined with a parabola between its neighbours) or by a polynomial
+regression fitted on the templates (clipped to their z range). Neither depends on the number of
+z-slices, and only the components are kept in memory:
+
+    basis = TemplateBasis.fit(blur_templates(h3[30:70], 2), z=np.arange(30, 70))
+    basis.save("astigmatism_basis.npz")
+    z = basis.estimate(roi)["z"]
+
+Unlike the correlation, the projection is not shift invariant: the ROI has to
+be centred on the spot like the templates (e.g. by focusd.tracker). ROIs and
+templates are compared after removing their mean and scaling them to unit
+norm, so brightness and background do not matter.
+"""
+import json
+import time
+
+import numpy as np
+
+from .correlation import parabolic_peak
+
+BASIS_VERSION = 1
+METHODS = ("nearest", "regression")
+
+
+def _normalize(x):
+    # rows of x without their mean, scaled to unit norm
+    x = x - x.mean(axis=-1, keepdims=True)
+    norm = np.linalg.norm(x, axis=-1, keepdims=True)
+    return x / np.where(norm > 0, norm, 1)
+
+
+class TemplateBasis:
+    """Components (k, h, w) of the normalised templates around their mean,
+    the coefficients (N, k) of the templates and their z positions; weights
+    are the regression coefficients of z on the polynomial features of the
+    coefficients."""
+
+    def __init__(self, mean, components, coefficients, z, weights=None, degree=1, meta=None):
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.components = np.asarray(components, dtype=np.float32)
+        self.coefficients = np.asarray(coefficients, dtype=float)
+        self.z = np.asarray(z, dtype=float)
+        self.weights = None if weights is None else np.asarray(weights, dtype=float)
+        self.degree = degree
+        self.meta = meta or {}
+        self.shape = self.components.shape[1:]
+        # flat views for the projection
+        self._mean = self.mean.ravel().astype(float)
+        self._components = self.components.reshape(len(self.components), -1)
+
+    @property
+    def n_components(self):
+        return len(self.components)
+
+    @classmethod
+    def fit(cls, templates, z=None, n_components=6, degree=1, meta=None):
+        """Decompose templates (N, h, w) with an SVD; z (default: the template
+        index) labels the templates, degree is the order of the regression
+        (above 1 only with few components, it extrapolates badly)."""
+        templates = np.asarray(templates, dtype=float)
+        n = len(templates)
+        z = np.arange(n, dtype=float) if z is None else np.asarray(z, dtype=float)
+        if len(z) != n:
+            raise ValueError(f"z has {len(z)} entries for {n} templates")
+        if not 0 < n_components <= n:
+            raise ValueError(f"n_components has to be between 1 and the number of templates ({n})")
+        x = _normalize(templates.reshape(n, -1))
+        mean = x.mean(axis=0)
+        _, s, vt = np.linalg.svd(x - mean, full_matrices=False)
+        components = vt[:n_components]
+        coefficients = (x - mean) @ components.T
+        meta = dict(meta or {})
+        meta.update(created=time.time(), n_templates=n,
+                    explained_variance=float(np.sum(s[:n_components]**2) / np.sum(s**2)))
+        basis = cls(mean.reshape(templates.shape[1:]), components.reshape((n_components,) + templates.shape[1:]),
+                    coefficients, z, degree=degree, meta=meta)
+        basis.weights, *_ = np.linalg.lstsq(basis._features(coefficients), z, rcond=None)
+        return basis
+
+    def _features(self, coefficients):
+        # 1, c_i, c_i**2, ... up to degree (no cross terms)
+        coefficients = np.atleast_2d(coefficients)
+        return np.hstack([np.ones((len(coefficients), 1))] + [coefficients**d for d in range(1, self.degree + 1)])
+
+    def project(self, roi):
+        """Coefficients of the normalised ROI and the norm of the part of it
+        the basis does not describe (0: looks like a template, 1: not at all)."""
+        roi = np.asarray(roi, dtype=float)
+        if roi.shape != self.shape:
+            raise ValueError(f"ROI shape {roi.shape} does not match the basis ({self.shape})")
+        x = _normalize(roi.ravel()) - self._mean
+        coefficients = self._components @ x
+        residual = np.sqrt(max(x @ x - coefficients @ coefficients, 0.0))
+        return coefficients, residual
+
+    def estimate(self, roi, method="nearest"):
+        """{"z", "index", "coefficients", "residual"} of one ROI; index is the
+        fractional template index for method="nearest", else NaN."""
+        coefficients, residual = self.project(roi)
+        if method == "nearest":
+            distances = np.sum((self.coefficients - coefficients)**2, axis=1)
+            best = int(np.argmin(distances))
+            index = float(best)
+            if 0 < best < len(distances) - 1:
+                index += parabolic_peak(-distances[best - 1], -distances[best], -distances[best + 1])
+            z = float(np.interp(index, np.arange(len(self.z)), self.z))
+        elif method == "regression":
+            index = np.nan
+            z = float(np.clip((self._features(coefficients) @ self.weights)[0], self.z.min(), self.z.max()))
+        else:
+            raise ValueError(f"Unknown method {method!r}, use one of {METHODS}")
+        return {"z": z, "index": index, "coefficients": coefficients, "residual": residual}
+
+    def save(self, path):
+        np.savez_compressed(path, version=BASIS_VERSION, mean=self.mean, components=self.components,
+                            coefficients=self.coefficients, z=self.z, weights=self.weights, degree=self.degree,
+                            meta=json.dumps(self.meta))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            version = int(data["version"])
+            if version != BASIS_VERSION:
+                raise ValueError(f"{path} has basis version {version}, expected {BASIS_VERSION}")
+            return cls(data["mean"], data["components"], data["coefficients"], data["z"], data["weights"],
+                       int(data["degree"]), json.loads(str(data["meta"])))
@@ -0,0 +1,153 @@
+"""
+Per-stage timing of the focus pipeline.
+
+    profiler = Profiler(log_interval=10)
+    t = profiler.tic()
+    frame = source.read()
+    profiler.toc("acquisition", t)
+    ...
+    profiler.frame_done()    # logs one line every log_interval seconds
+
+Timings are kept in a rolling window per stage; stats() returns percentiles
+for a status endpoint. With enabled=False tic/toc return immediately, so the
+calls can stay in the hot loop.
+
+For hot spots in the field, profile_next(n) runs cProfile over the next n
+frames and py_spy(seconds) attaches py-spy (if installed) to this process;
+install_signal_trigger() starts the former on `kill -USR1 <pid>`.
+"""
+import collections
+import cProfile
+import logging
+import os
+import pstats
+import signal
+import subprocess
+import time
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_NULL = nullcontext()
+
+
+class Profiler:
+    def __init__(self, enabled=True, window=1000, log_interval=None, log=None):
+        self.enabled = enabled
+        self.window = window
+        self.log_interval = log_interval
+        self.log = log or logger.info
+        self.samples = collections.defaultdict(lambda: collections.deque(maxlen=self.window))
+        self.frames = 0
+        self._frame_times = collections.deque(maxlen=window)
+        self._last_log = time.perf_counter()
+        self._cprofile = None
+        self._cprofile_frames = 0
+        self._cprofile_path = None
+
+    def tic(self):
+        return time.perf_counter_ns() if self.enabled else 0
+
+    def toc(self, name, t0):
+        if self.enabled:
+            self.samples[name].append(time.perf_counter_ns() - t0)
+
+    def stage(self, name):
+        """Context manager timing its block as stage name."""
+        return self._stage(name) if self.enabled else _NULL
+
+    @contextmanager
+    def _stage(self, name):
+        t0 = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.samples[name].append(time.perf_counter_ns() - t0)
+
+    def frame_done(self):
+        """Call once per frame: counts frames, runs the cProfile countdown and
+        writes the periodic log line."""
+        if self._cprofile is not None:
+            self._cprofile_frames -= 1
+            if self._cprofile_frames <= 0:
+                self._stop_cprofile()
+        if not self.enabled:
+            return
+        self.frames += 1
+        now = time.perf_counter()
+        self._frame_times.append(now)
+        if self.log_interval and now - self._last_log >= self.log_interval:
+            self._last_log = now
+            self.log(self.log_line())
+
+    def fps(self):
+        if len(self._frame_times) < 2:
+            return 0.0
+        return (len(self._frame_times) - 1) / (self._frame_times[-1] - self._frame_times[0])
+
+    def stats(self):
+        """{stage: {count, mean_us, p50_us, p90_us, p99_us, max_us}} over the window."""
+        result = {}
+        for name, values in self.samples.items():
+            if not values:
+                continue
+            us = np.fromiter(values, dtype=float, count=len(values)) / 1e3
+            p50, p90, p99 = np.percentile(us, (50, 90, 99))
+            result[name] = {"count": len(us), "mean_us": float(us.mean()), "p50_us": float(p50),
+                            "p90_us": float(p90), "p99_us": float(p99), "max_us": float(us.max())}
+        return result
+
+    def histogram(self, name, bins=None):
+        """Counts of the rolling window of stage name in log spaced bins (us)."""
+        us = np.fromiter(self.samples[name], dtype=float) / 1e3
+        if bins is None:
+            bins = np.geomspace(1, 1e7, 29)
+        return np.histogram(us, bins)
+
+    def log_line(self):
+        parts = [f"{self.fps():.1f} fps"]
+        for name, s in self.stats().items():
+            parts.append(f"{name} {s['p50_us'] / 1e3:.2f}/{s['p99_us'] / 1e3:.2f} ms")
+        return "timing (p50/p99): " + ", ".join(parts)
+
+    def reset(self):
+        self.samples.clear()
+        self._frame_times.clear()
+
+    def profile_next(self, n_frames=100, path=None):
+        """Run cProfile over the next n_frames frames; the top functions are
+        logged and, with path, the full stats dumped for snakeviz & co."""
+        if self._cprofile is not None:
+            return
+        self._cprofile = cProfile.Profile()
+        self._cprofile_frames = n_frames
+        self._cprofile_path = path
+        self._cprofile.enable()
+
+    def _stop_cprofile(self):
+        self._cprofile.disable()
+        stats = pstats.Stats(self._cprofile).sort_stats("cumulative")
+        if self._cprofile_path:
+            stats.dump_stats(self._cprofile_path)
+        lines = []
+        for (file, line, func), (_, calls, _, cumtime, _) in list(stats.stats.items()):
+            lines.append((cumtime, f"{cumtime * 1e3:9.1f} ms {calls:7d}x {func} ({os.path.basename(file)}:{line})"))
+        self.log("cProfile hot spots:\n" + "\n".join(text for _, text in sorted(lines, reverse=True)[:15]))
+        self._cprofile = None
+
+    def py_spy(self, duration=10, path="focusd-pyspy.svg"):
+        """Record a py-spy flame graph of this process in the background."""
+        try:
+            return subprocess.Popen(["py-spy", "record", "--pid", str(os.getpid()), "--duration", str(duration),
+                                     "--output", path], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except FileNotFoundError:
+            logger.warning("py-spy is not installed")
+            return None
+
+    def install_signal_trigger(self, signum=getattr(signal, "SIGUSR1", None), n_frames=100, path=None):
+        """Start profile_next(n_frames) when the process receives signum."""
+        if signum is None:
+            return
+        signal.signal(signum, lambda *_: self.profile_next(n_frames, path))
@@ -0,0 +1,241 @@
+"""
+Focus-lock session recordings: frames, per-frame metadata and focus results in
+one chunked, compressed HDF5 file with a time index.
+
+File layout:
+
+    /frames          (N, H, W[, C]) camera frames, chunks of chunk_frames frames
+    /t               (N,) frame timestamps (s, time.time() by default)
+    /meta/<name>     (N,) per-frame camera settings, e.g. exposure, gain
+    /results/<name>  (N,) scalar focus results, e.g. focus, sx, sy, z
+    attrs            version, created, plus the attrs passed to the recorder
+
+Meta and result columns are created when a name first shows up; earlier frames
+read as NaN. SessionRecorder hands the data to a writer thread, so write()
+never waits for compression or the SD card:
+
+    with SessionRecorder("session.h5", attrs={"camera": "ESP32"}) as rec:
+        for t, frame in source:
+            result = metric.evaluate(frame)
+            rec.write(frame, t, meta={"exposure": 10}, result=result)
+
+SessionReader gives random access by frame number or time without loading the
+file, e.g. reader[1000], reader.at(t), reader.between(t0, t1).
+Needs h5py.
+"""
+import json
+import logging
+import queue
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+RECORDING_VERSION = 1
+
+
+def _scalars(result):
+    # the float entries of a FocusMetric.evaluate result (or any dict)
+    out = {}
+    for key, value in (result or {}).items():
+        if isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, bool):
+            out[key] = float(value)
+    return out
+
+
+class SessionRecorder:
+    """Append frames to an HDF5 session file from a background thread.
+
+    chunk_frames frames form one compressed chunk (compression "lzf" is fast
+    enough for the Pi, "gzip" is smaller); queue_size frames are buffered
+    before write() starts dropping (counted in dropped). With
+    skip_duplicates, a frame equal to the previous one is not stored (the
+    camera sometimes delivers the same buffer twice).
+    """
+
+    def __init__(self, path, chunk_frames=16, compression="lzf", queue_size=64, skip_duplicates=True,
+                 flush_interval=5.0, attrs=None):
+        import h5py
+
+        self.path = path
+        self.chunk_frames = chunk_frames
+        self.compression = compression
+        self.skip_duplicates = skip_duplicates
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.dropped = 0
+        self.duplicates = 0
+        self._last = None
+        self._error = None
+        self.file = h5py.File(path, "w")
+        self.file.attrs["version"] = RECORDING_VERSION
+        self.file.attrs["created"] = time.time()
+        for key, value in (attrs or {}).items():
+            self.file.attrs[key] = value if isinstance(value, (str, int, float)) else json.dumps(value)
+        self.queue = queue.Queue(queue_size)
+        self.thread = threading.Thread(target=self._run, name="focusd-recorder", daemon=True)
+        self.thread.start()
+
+    def write(self, frame, t=None, meta=None, result=None):
+        """Queue one frame; returns False if it was dropped or a duplicate."""
+        if self._error is not None:
+            raise RuntimeError(f"recording to {self.path} failed") from self._error
+        frame = np.asarray(frame)
+        if self.skip_duplicates and self._last is not None and np.array_equal(frame, self._last):
+            self.duplicates += 1
+            return False
+        self._last = frame
+        item = (frame, time.time() if t is None else float(t), dict(meta or {}), _scalars(result))
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def _column(self, group, name, n):
+        # a float column that reads NaN for the frames before it existed
+        group = self.file.require_group(group)
+        if name not in group:
+            group.create_dataset(name, shape=(n,), maxshape=(None,), dtype="f8",
+                                 chunks=(max(self.chunk_frames, 1024),), fillvalue=np.nan)
+        return group[name]
+
+    def _append(self, batch):
+        frames = np.stack([item[0] for item in batch])
+        n0 = self.written
+        n1 = n0 + len(batch)
+        if "frames" not in self.file:
+            self.file.create_dataset("frames", shape=(0,) + frames.shape[1:], maxshape=(None,) + frames.shape[1:],
+                                     dtype=frames.dtype, chunks=(self.chunk_frames,) + frames.shape[1:],
+                                     compression=self.compression, shuffle=True)
+            self.file.create_dataset("t", shape=(0,), maxshape=(None,), dtype="f8", chunks=(1024,))
+        for name in ("frames", "t"):
+            self.file[name].resize(n1, axis=0)
+        self.file["frames"][n0:n1] = frames
+        self.file["t"][n0:n1] = [item[1] for item in batch]
+        for group, index in (("meta", 2), ("results", 3)):
+            names = set().union(*(item[index] for item in batch))
+            for name in names:
+                column = self._column(group, name, n0)
+                column.resize((n1,))
+                column[n0:n1] = [item[index].get(name, np.nan) for item in batch]
+            # columns not present in this batch still have to grow
+            for name in self.file.get(group, {}):
+                if name not in names and self.file[group][name].shape[0] < n1:
+                    self.file[group][name].resize((n1,))
+        self.written = n1
+
+    def _run(self):
+        batch, last_flush, done = [], time.monotonic(), False
+        while not done:
+            try:
+                item = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                item = False
+            if item is None:
+                done = True
+            elif item is not False:
+                batch.append(item)
+            # write whole chunks while streaming, the rest on timeout or close
+            if batch and (len(batch) >= self.chunk_frames or item is False or done):
+                try:
+                    self._append(batch)
+                except Exception as e:
+                    logger.exception("writing %s failed", self.path)
+                    self._error = e
+                    return
+                batch = []
+            if time.monotonic() - last_flush > self.flush_interval:
+                self.file.flush()
+                last_flush = time.monotonic()
+
+    def close(self, timeout=30):
+        """Write the queued frames and close the file.
+
+        Waits at most timeout seconds for the writer; raises RuntimeError if
+        it is still busy (the file stays open) or if it failed (after closing
+        the file with the frames written until then).
+        """
+        if self.file is None:
+            return
+        if self.thread.is_alive():
+            try:
+                self.queue.put(None, timeout=timeout)
+            except queue.Full:
+                pass
+            self.thread.join(timeout)
+        if self.thread.is_alive():
+            raise RuntimeError(f"writing {self.path} did not finish within {timeout} s")
+        self.file.attrs["frames"] = self.written
+        self.file.attrs["dropped"] = self.dropped
+        self.file.close()
+        self.file = None
+        if self._error is not None:
+            raise RuntimeError(f"recording to {self.path} failed") from self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SessionReader:
+    """Random access to a SessionRecorder file; frames are read on demand."""
+
+    def __init__(self, path):
+        import h5py
+
+        self.path = path
+        self.file = h5py.File(path, "r")
+        self.frames = self.file["frames"]
+        self.t = self.file["t"][:]
+        self.attrs = dict(self.file.attrs)
+
+    def __len__(self):
+        return len(self.t)
+
+    def __getitem__(self, index):
+        return self.frames[index]
+
+    def meta(self, name):
+        return self.file["meta"][name][:]
+
+    def results(self, name):
+        return self.file["results"][name][:]
+
+    def names(self, group):
+        return list(self.file[group]) if group in self.file else []
+
+    def index(self, t):
+        """Number of the last frame recorded at or before t."""
+        return int(np.clip(np.searchsorted(self.t, t, side="right") - 1, 0, len(self.t) - 1))
+
+    def at(self, t):
+        return self.frames[self.index(t)]
+
+    def between(self, t0, t1):
+        """Slice of the frames recorded in [t0, t1)."""
+        return slice(int(np.searchsorted(self.t, t0)), int(np.searchsorted(self.t, t1)))
+
+    def iter_frames(self, start=0, stop=None, step=1):
+        """Yield (index, t, frame), reading one chunk of frames at a time."""
+        stop = len(self) if stop is None else min(stop, len(self))
+        chunk = (self.frames.chunks or (16,))[0] * max(step, 1)
+        for i0 in range(start, stop, chunk):
+            block = self.frames[i0:min(i0 + chunk, stop):step]
+            for k, frame in enumerate(block):
+                i = i0 + k * step
+                yield i, self.t[i], frame
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,174 @@
+"""
+Synthetic astigmatic spots and a simulated z stage, to test the focus lock
+without hardware.
+
+render_spots draws a whole batch of rotated elliptical Gaussians in one
+broadcasted expression, and generate_dataset streams a z-sweep with camera
+noise to a chunked TIFF stack for regression tests and benchmarks:
+
+    spot = AstigmaticSpot(shape=(120, 160))
+    generate_dataset("sweep.tif", np.linspace(-30, 30, 10000), spot)
+"""
+import json
+
+import numpy as np
+
+
+def make_gauss(mesh, sxy, rxy, rot):
+    """Rotated elliptical Gaussian on mesh, centred at sxy with radii rxy
+    (from PYTHON/IMAGE_Processing/Fit2DData.py)."""
+    x, y = mesh[0] - sxy[0], mesh[1] - sxy[1]
+    px = x * np.cos(rot) - y * np.sin(rot)
+    py = y * np.cos(rot) + x * np.sin(rot)
+    fx = np.exp(-0.5 * (px/rxy[0])**2)
+    fy = np.exp(-0.5 * (py/rxy[1])**2)
+    return fx * fy
+
+
+def render_spots(shape, centers, sigmas, rot=0.0, amplitude=1.0, background=0.0, out=None):
+    """Render N rotated elliptical Gaussians into an (N, H, W) float32 array.
+
+    centers: (N, 2) x/y offsets from the image centre, sigmas: (N, 2) sx/sy,
+    rot (rad), amplitude and background: scalars or length N. out can be a
+    preallocated (N, H, W) float32 buffer that is reused between chunks.
+    """
+    centers = np.atleast_2d(np.asarray(centers, dtype=np.float32))
+    sigmas = np.atleast_2d(np.asarray(sigmas, dtype=np.float32))
+    n = max(len(centers), len(sigmas))
+    h, w = shape
+    # (N, 1, 1) parameters against a (1, H, 1) / (1, 1, W) grid
+    cx, cy = (centers[:, i].reshape(-1, 1, 1) for i in (0, 1))
+    sx, sy = (sigmas[:, i].reshape(-1, 1, 1) for i in (0, 1))
+    rot = np.broadcast_to(np.asarray(rot, dtype=np.float32), (n,)).reshape(-1, 1, 1)
+    x = (np.arange(w, dtype=np.float32) - w / 2).reshape(1, 1, w) - cx
+    y = (np.arange(h, dtype=np.float32) - h / 2).reshape(1, h, 1) - cy
+    cos, sin = np.cos(rot), np.sin(rot)
+    if out is None:
+        out = np.empty((n, h, w), dtype=np.float32)
+    # exponent of make_gauss, written out so that numpy evaluates it in place
+    np.multiply(x * cos - y * sin, 1 / sx, out=out)
+    np.square(out, out=out)
+    py = (y * cos + x * sin) / sy
+    out += py * py
+    out *= -0.5
+    np.exp(out, out=out)
+    out *= np.asarray(amplitude, dtype=np.float32).reshape(-1, 1, 1)
+    out += np.asarray(background, dtype=np.float32).reshape(-1, 1, 1)
+    return out
+
+
+def camera_noise(signal, rng, photons_per_count=4.0, read_noise=2.0, bit_depth=8):
+    """Poisson shot noise, Gaussian read noise (counts) and quantisation of
+    an expected signal in counts; returns uint8 (or uint16) frames."""
+    electrons = rng.poisson(np.maximum(signal, 0) * photons_per_count).astype(np.float32)
+    counts = electrons / photons_per_count
+    if read_noise:
+        counts += rng.normal(0, read_noise, counts.shape).astype(np.float32)
+    dtype = np.uint8 if bit_depth <= 8 else np.uint16
+    return np.clip(np.rint(counts), 0, 2**bit_depth - 1).astype(dtype)
+
+
+class AstigmaticSpot:
+    """Spot of the cylindrical lens detection path as a function of defocus z (um).
+
+    The two line foci sit at z = +focal_shift and z = -focal_shift; in between
+    the widths grow like a Gaussian beam with Rayleigh range depth, so
+    sx(0) == sy(0) and F = sx/sy is monotonic for |z| < sqrt(focal_shift**2 + depth**2).
+    """
+
+    def __init__(self, sigma0=4.0, focal_shift=20.0, depth=15.0, rot=0.0, shape=(64, 64),
+                 amplitude=200.0, background=20.0, noise=2.0, seed=None):
+        self.sigma0 = sigma0
+        self.focal_shift = focal_shift
+        self.depth = depth
+        self.rot = rot
+        self.shape = shape
+        self.amplitude = amplitude
+        self.background = background
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+        self.mesh = np.meshgrid(np.arange(shape[1]) - shape[1] / 2, np.arange(shape[0]) - shape[0] / 2)
+
+    def sigmas(self, z):
+        sx = self.sigma0 * np.sqrt(1 + ((z - self.focal_shift) / self.depth)**2)
+        sy = self.sigma0 * np.sqrt(1 + ((z + self.focal_shift) / self.depth)**2)
+        return sx, sy
+
+    def render(self, z, center=(0, 0)):
+        im = self.background + self.amplitude * make_gauss(self.mesh, center, self.sigmas(z), np.deg2rad(self.rot))
+        if self.noise:
+            im = im + self.rng.normal(0, self.noise, im.shape)
+        return im
+
+    def render_batch(self, z, centers=None, out=None):
+        """Noise free (N, H, W) float32 spots for an array of defocus values."""
+        z = np.atleast_1d(z)
+        if centers is None:
+            centers = np.zeros((len(z), 2))
+        return render_spots(self.shape, centers, np.stack(self.sigmas(z), axis=-1), np.deg2rad(self.rot),
+                            self.amplitude, self.background, out=out)
+
+
+def generate_dataset(path, z, spot=None, chunk=256, jitter=0.0, photons_per_count=4.0, read_noise=2.0,
+                     bit_depth=8, seed=0):
+    """Render the z-sweep z (um) in chunks and append it to the TIFF stack path.
+
+    jitter moves the spot centre randomly by that many pixels (std). The ground
+    truth (z, sx, sy, centres) is written next to it as <path>.json.
+    Returns the number of frames written.
+    """
+    import tifffile as tif
+
+    spot = spot or AstigmaticSpot()
+    rng = np.random.default_rng(seed)
+    z = np.asarray(z, dtype=float)
+    centers = rng.normal(0, jitter, (len(z), 2)) if jitter else np.zeros((len(z), 2))
+    buffer = np.empty((min(chunk, len(z)),) + tuple(spot.shape), dtype=np.float32)
+    with tif.TiffWriter(path, bigtiff=len(z) * np.prod(spot.shape) > 2**31) as writer:
+        for start in range(0, len(z), chunk):
+            stop = min(start + chunk, len(z))
+            frames = spot.render_batch(z[start:stop], centers[start:stop], out=buffer[:stop - start])
+            # without shaped metadata every frame is its own page, so readers see one (N, H, W) series
+            writer.write(camera_noise(frames, rng, photons_per_count, read_noise, bit_depth), metadata=None)
+    sx, sy = spot.sigmas(z)
+    with open(str(path) + ".json", "w") as f:
+        json.dump({"z": z.tolist(), "sx": np.asarray(sx).tolist(), "sy": np.asarray(sy).tolist(),
+                   "centers": centers.tolist(), "shape": list(spot.shape), "rot": spot.rot,
+                   "amplitude": spot.amplitude, "background": spot.background,
+                   "photons_per_count": photons_per_count, "read_noise": read_noise}, f)
+    return len(z)
+
+
+class SimulatedStage:
+    """z stage that executes relative moves after latency seconds with a
+    limited velocity (um/s). The simulation clock is advanced explicitly."""
+
+    def __init__(self, position=0.0, max_velocity=np.inf, latency=0.0):
+        self.position = position
+        self.target = position
+        self.max_velocity = max_velocity
+        self.latency = latency
+        self.t = 0.0
+        self.queue = []
+        self.n_moves = 0
+
+    def move_relative(self, dz):
+        self.queue.append((self.t + self.latency, dz))
+        self.n_moves += 1
+
+    def _travel(self, t):
+        dt = t - self.t
+        if dt > 0:
+            delta = np.clip(self.target - self.position, -self.max_velocity * dt, self.max_velocity * dt)
+            self.position += delta
+        self.t = t
+
+    def advance(self, t):
+        """Move the clock to t, applying all moves that became due."""
+        self.queue.sort()
+        while self.queue and self.queue[0][0] <= t:
+            due, dz = self.queue.pop(0)
+            self._travel(due)
+            self.target += dz
+        self._travel(t)
+        return self.position
@@ -0,0 +1,365 @@
+"""
+Frame sources: one interface for the ESP32 serial camera, the Pi camera
+(libcamera through picamera2) and recorded data.
+
+A source is iterable and yields (t, frame); meta holds the camera settings of
+the last frame (exposure, gain) where the source knows them:
+
+    with ReplaySource("session.h5", speed=None) as source:
+        for t, frame in source:
+            focus = metric.compute(frame)
+
+Subclasses implement open(), read() (returns (t, frame), or None at the end)
+and close(), and where the camera allows set_exposure(exposure, gain), which
+must not block the acquisition (see focusd.exposure).
+"""
+import logging
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class FrameSource:
+    meta = {}
+
+    def open(self):
+        pass
+
+    def read(self):
+        raise NotImplementedError
+
+    def set_exposure(self, exposure=None, gain=None):
+        raise NotImplementedError(f"{type(self).__name__} has no exposure control")
+
+    def close(self):
+        pass
+
+    def __iter__(self):
+        while True:
+            item = self.read()
+            if item is None:
+                return
+            yield item
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def find_ports(manufacturers=("Espressif", "Microsoft")):
+    """Serial ports whose USB manufacturer matches, as in connect_to_usb_device."""
+    import serial.tools.list_ports
+    return [port.device for port in serial.tools.list_ports.comports() if port.manufacturer in manufacturers]
+
+
+# first ten pixels of every frame, set by the firmware to find the frame start
+SYNC_PATTERN = np.array([0, 1, 0, 1, 0, 1, 0, 1, 0, 1], dtype=np.uint8)
+
+
+def find_sync(buffer, pattern=SYNC_PATTERN):
+    """Offset of pattern in buffer, or -1 (vectorised version of the loop in
+    ESP32SerialCamGrayBytebuffer.py)."""
+    n = len(pattern)
+    if len(buffer) < n:
+        return -1
+    # candidates where the first byte matches, then compare the windows
+    candidates = np.flatnonzero(buffer[:len(buffer) - n + 1] == pattern[0])
+    for k in range(1, n):
+        candidates = candidates[buffer[candidates + k] == pattern[k]]
+        if not len(candidates):
+            return -1
+    return int(candidates[0])
+
+
+class SerialCamSource(FrameSource):
+    """ESP32 camera sending raw 320x240 gray frames on request over USB serial
+    (firmware of ESP32SerialCamGrayBytebuffer.py): "\\n" requests a frame,
+    "t<value>" sets the exposure and "g<value>" the gain.
+
+    port defaults to the first port from find_ports(manufacturers); such a
+    port is looked up again by reset() when the device came back under a new
+    name. Frames are rotated so
+    that the sync pattern is at the start. profiler (focusd.profiling.Profiler)
+    times the stages acquisition, decode and sync.
+
+    The firmware reads commands with a 20 ms timeout, so a command written
+    right before the frame request would swallow it. set_exposure therefore
+    only queues the commands (the latest value per setting wins); read() sends
+    one of them right after a frame has arrived, so the processing of that
+    frame covers command_gap, and the next request only waits for what is left
+    of it. Exposure and gain changed together take effect over two frames.
+    """
+
+    def __init__(self, port=None, baudrate=2000000, shape=(240, 320), timeout=1.0, settle=0.05, profiler=None,
+                 command_gap=0.03, manufacturers=("Espressif", "Microsoft")):
+        from .profiling import Profiler
+
+        self.port = port
+        # a given port is kept, with several heads another one could be found
+        self.rediscover = port is None
+        self.manufacturers = manufacturers
+        self.baudrate = baudrate
+        self.shape = shape
+        self.timeout = timeout
+        self.settle = settle
+        self.profiler = profiler or Profiler(enabled=False)
+        self.command_gap = command_gap
+        self.serial = None
+        self.offset = 0
+        self.meta = {}
+        self._pending = {}
+        self._last_command = -np.inf
+
+    def open(self):
+        if self.port is None:
+            ports = find_ports(self.manufacturers)
+            if not ports:
+                raise IOError("No matching USB device found")
+            self.port = ports[0]
+        self.serial = self._connect(self.port)
+        logger.info("connected to %s", self.port)
+
+    def _connect(self, port):
+        import serial
+
+        connection = serial.Serial(port, baudrate=self.baudrate, timeout=self.timeout)
+        connection.write_timeout = self.timeout
+        return connection
+
+    def send(self, command):
+        """Send a firmware command such as "t100" (exposure) or "g1" (gain) now."""
+        self.serial.write((command + "\n").encode())
+        self._last_command = time.perf_counter()
+        key = {"t": "exposure", "g": "gain"}.get(command[:1])
+        if key:
+            self.meta[key] = float(command[1:])
+
+    def set_exposure(self, exposure=None, gain=None):
+        """Queue exposure (0-1200) and/or gain (0-30) for the next frame."""
+        if exposure is not None and exposure != self.meta.get("exposure"):
+            self._pending["t"] = f"t{int(round(exposure))}"
+        if gain is not None and gain != self.meta.get("gain"):
+            self._pending["g"] = f"g{int(round(gain))}"
+
+    def read(self):
+        prof = self.profiler
+        # usually the caller's processing took longer than the gap
+        wait = self._last_command + self.command_gap - time.perf_counter()
+        if wait > 0:
+            time.sleep(wait)
+        self.serial.write(b"\n")
+        # don't read too early
+        time.sleep(self.settle)
+        t0 = prof.tic()
+        t = time.time()
+        size = self.shape[0] * self.shape[1]
+        data = self.serial.read(size)
+        prof.toc("acquisition", t0)
+        if len(data) < size:
+            raise TimeoutError(f"got {len(data)} of {size} bytes from {self.port}")
+        t0 = prof.tic()
+        flat = np.frombuffer(data, dtype=np.uint8)
+        prof.toc("decode", t0)
+        t0 = prof.tic()
+        self.offset = find_sync(flat)
+        if self.offset > 0:
+            flat = np.roll(flat, -self.offset)
+        prof.toc("sync", t0)
+        if self._pending:
+            self.send(self._pending.popitem()[1])
+        return t, flat.reshape(self.shape)
+
+    def drain(self, quiet=0.02):
+        """Read and drop bytes until the line has been quiet for quiet seconds,
+        i.e. the rest of a misaligned or partial frame."""
+        dropped = 0
+        deadline = time.perf_counter() + self.timeout
+        while time.perf_counter() < deadline:
+            waiting = self.serial.in_waiting
+            if waiting:
+                dropped += len(self.serial.read(waiting))
+                continue
+            time.sleep(quiet)
+            if not self.serial.in_waiting:
+                break
+        return dropped
+
+    def flush(self):
+        """Clear both buffers and wait for the transfer in flight to end."""
+        self.serial.reset_output_buffer()
+        self.serial.reset_input_buffer()
+        time.sleep(self.settle)
+        return self.drain()
+
+    def reset(self, boot_time=0.5):
+        """Hard reset of the ESP32 through DTR/RTS (as the error handler of
+        ESP32SerialCamGrayBytebuffer.py did) and reconnect; exposure and gain
+        are sent again after the next frames. A found port that has
+        disappeared (the device re-enumerated, e.g. as ttyACM1 instead of
+        ttyACM0) is looked up again."""
+        if self.serial is not None:
+            try:
+                self.serial.dtr = False
+                self.serial.rts = True
+                time.sleep(0.1)
+                self.serial.rts = False
+            except OSError:
+                # the device is gone already
+                pass
+        self.close()
+        time.sleep(boot_time)
+        if self.rediscover and self.port not in find_ports(self.manufacturers):
+            logger.info("%s is gone, looking for the camera again", self.port)
+            self.port = None
+        self.open()
+        settings, self.meta = self.meta, {}
+        self.set_exposure(settings.get("exposure"), settings.get("gain"))
+
+    def close(self):
+        if self.serial is not None:
+            self.serial.close()
+            self.serial = None
+
+
+class Picamera2Source(FrameSource):
+    """CSI camera through libcamera/picamera2 (the Pi side of the spec)."""
+
+    def __init__(self, size=(640, 480), fps=15, format="RGB888", controls=None):
+        self.size = size
+        self.fps = fps
+        self.format = format
+        self.controls = dict(controls or {})
+        self.camera = None
+        self.meta = {}
+
+    def open(self):
+        from picamera2 import Picamera2
+
+        self.camera = Picamera2()
+        config = self.camera.create_video_configuration(
+            main={"size": tuple(self.size), "format": self.format},
+            controls={"FrameRate": self.fps, **self.controls})
+        self.camera.configure(config)
+        self.camera.start()
+
+    def set_controls(self, **controls):
+        """e.g. ExposureTime=10000, AnalogueGain=1.0"""
+        self.camera.set_controls(controls)
+
+    def set_exposure(self, exposure=None, gain=None):
+        """exposure in us, gain as analogue gain factor; libcamera applies
+        them a few frames later without blocking."""
+        controls = {"AeEnable": False}
+        if exposure is not None:
+            controls["ExposureTime"] = int(exposure)
+        if gain is not None:
+            controls["AnalogueGain"] = float(gain)
+        self.camera.set_controls(controls)
+
+    def read(self):
+        request = self.camera.capture_request()
+        try:
+            frame = request.make_array("main")
+            md = request.get_metadata()
+        finally:
+            request.release()
+        self.meta = {"exposure": md.get("ExposureTime", np.nan), "gain": md.get("AnalogueGain", np.nan)}
+        t = md["SensorTimestamp"] / 1e9 if "SensorTimestamp" in md else time.time()
+        return t, frame
+
+    def close(self):
+        if self.camera is not None:
+            self.camera.stop()
+            self.camera.close()
+            self.camera = None
+
+
+class ReplaySource(FrameSource):
+    """Play back a TIFF stack or a focusd.recorder session.
+
+    speed=1 reproduces the recorded timing (TIFF stacks have none, they play
+    at fps), speed=2 twice as fast, speed=None as fast as the consumer reads.
+    start/stop/step select frames, loop restarts at the end. The yielded t is
+    the recorded time, so results do not depend on the replay speed; lag is
+    the largest delay behind the recorded schedule seen so far, i.e. how far
+    the consumer fell behind.
+    """
+
+    def __init__(self, path, speed=1.0, fps=15.0, start=0, stop=None, step=1, loop=False):
+        self.path = path
+        self.speed = speed
+        self.fps = fps
+        self.start = start
+        self.stop = stop
+        self.step = step
+        self.loop = loop
+        self.meta = {}
+        self.lag = 0.0
+        self._reader = None
+        self._tiff = None
+
+    def open(self):
+        if self.path.endswith((".h5", ".hdf5")):
+            from .recorder import SessionReader
+            self._reader = SessionReader(self.path)
+            self.t = self._reader.t
+            self._meta = {name: self._reader.meta(name) for name in self._reader.names("meta")}
+            n = len(self._reader)
+        else:
+            import tifffile as tif
+            self._tiff = tif.TiffFile(self.path)
+            # one page per frame, as written by tif.imwrite(..., append=True)
+            n = len(self._tiff.pages)
+            self.t = np.arange(n) / self.fps
+            self._meta = {}
+        self.indices = range(self.start, n if self.stop is None else min(self.stop, n), self.step)
+        self._rewind()
+
+    def _rewind(self):
+        self._next = iter(self.indices)
+        self._t0_wall = None
+        self._t0 = None
+
+    def frame(self, i):
+        if self._reader is not None:
+            return self._reader[i]
+        return self._tiff.pages[i].asarray()
+
+    def read(self):
+        i = next(self._next, None)
+        if i is None:
+            if not self.loop or not len(self.indices):
+                return None
+            self._rewind()
+            i = next(self._next)
+        t = float(self.t[i])
+        if self.speed:
+            now = time.perf_counter()
+            if self._t0_wall is None:
+                self._t0_wall, self._t0 = now, t
+            due = self._t0_wall + (t - self._t0) / self.speed
+            if due > now:
+                time.sleep(due - now)
+            else:
+                self.lag = max(self.lag, now - due)
+        self.meta = {name: float(values[i]) for name, values in self._meta.items()}
+        return t, self.frame(i)
+
+    def set_exposure(self, exposure=None, gain=None):
+        """Recorded frames cannot change; ignored so closed loops can be replayed."""
+
+    def __len__(self):
+        return len(self.indices)
+
+    def close(self):
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+        if self._tiff is not None:
+            self._tiff.close()
+            self._tiff = None
@@ -0,0 +1,144 @@
+"""
+Follow the laser spot from frame to frame instead of searching the full frame.
+
+processautofocus.py blurs the whole frame with sigma=111 to find the spot and
+the ESP32 reader crops a fixed [55:75, 120:140]. SpotTracker predicts the next
+position from the previous centroid and velocity (alpha-beta filter), looks
+for the spot only in a window around the prediction and returns a ROI sized
+from the spot's sigmas. Only when the spot is not found in the window (low
+peak-to-noise ratio, centroid at the window edge) it scans the full frame,
+downsampled, as the script did.
+
+    tracker = SpotTracker(roi_size=64)
+    for frame in frames:
+        track = tracker.update(frame)
+        focus = metric(track["roi"])
+"""
+import numpy as np
+
+from . import blur, core
+from .focus_algorithm import moment_sigmas, to_gray
+
+
+class SpotTracker:
+    """Track the spot and cut a square ROI around it.
+
+    roi_size is the initial ROI edge length (px); with auto_size it follows
+    2*sigma_scale*max(sx, sy) of the spot's second moments, smoothed with
+    size_smoothing and clipped to [min_size, max_size]. set_sigmas() feeds
+    fitted sigmas instead. The search window extends the ROI by margin
+    (fraction of the ROI size) on each side. alpha and beta are the position
+    and velocity gains of the alpha-beta filter.
+    """
+
+    def __init__(self, roi_size=64, min_size=16, max_size=600, auto_size=True, sigma_scale=3.0,
+                 size_smoothing=0.3, margin=0.5, alpha=0.7, beta=0.2, min_snr=8.0, threshold=0.2,
+                 sigma_locate=111, channel=-2):
+        self.roi_size = roi_size
+        self.min_size = min_size
+        self.max_size = max_size
+        self.auto_size = auto_size
+        self.sigma_scale = sigma_scale
+        self.size_smoothing = size_smoothing
+        self.margin = margin
+        self.alpha = alpha
+        self.beta = beta
+        self.min_snr = min_snr
+        self.threshold = threshold
+        self.sigma_locate = sigma_locate
+        self.channel = channel
+        self.reset()
+
+    def reset(self):
+        self.center = None
+        self.velocity = np.zeros(2)
+        self.size = float(self.roi_size)
+        self.frames = 0
+        self.reacquisitions = 0
+
+    def predict(self):
+        """Expected spot position (y, x) in the next frame."""
+        return None if self.center is None else self.center + self.velocity
+
+    def set_sigmas(self, sx, sy):
+        """Size the ROI from fitted sigmas, e.g. sx, sy of FocusMetric.fit."""
+        if np.isfinite(sx) and np.isfinite(sy):
+            self._resize(max(abs(sx), abs(sy)))
+
+    def _resize(self, sigma):
+        target = np.clip(2 * self.sigma_scale * sigma, self.min_size, self.max_size)
+        self.size += self.size_smoothing * (target - self.size)
+
+    def acquire(self, frame):
+        """Position (y, x) of the spot from a full, downsampled frame scan."""
+        step = max(1, int(self.sigma_locate // 8))
+        im = to_gray(frame[::step, ::step], self.channel)
+        im = blur.gaussf(im, self.sigma_locate / step, "box")
+        y, x = np.unravel_index(np.argmax(im), im.shape)
+        return np.array([y * step + step // 2, x * step + step // 2], dtype=float)
+
+    def _measure(self, frame, center, half):
+        # spot centroid, sigmas and peak-to-noise ratio within the window
+        shape = frame.shape[:2]
+        y0, x0 = (max(0, int(round(c - half))) for c in center)
+        y1, x1 = (min(n, int(round(c + half)) + 1) for c, n in zip(center, shape))
+        if y1 - y0 < 3 or x1 - x0 < 3:
+            return None
+        window = to_gray(frame[y0:y1, x0:x1], self.channel)
+        base = np.median(window)
+        noise = 1.4826 * np.median(np.abs(window - base)) + 1e-9
+        window = window - base
+        peak = window.max()
+        window[window < self.threshold * peak] = 0
+        total = window.sum()
+        if total <= 0:
+            return None
+        cy = np.dot(np.arange(window.shape[0]), window.sum(axis=1)) / total
+        cx = np.dot(np.arange(window.shape[1]), window.sum(axis=0)) / total
+        sx, sy = moment_sigmas(window)
+        # a centroid close to a window edge (that is not the sensor edge)
+        # means the spot is partly outside the window
+        s = max(sx, sy, 1.0)
+        cut = (y0 > 0 and cy < s) or (x0 > 0 and cx < s) or \
+              (y1 < shape[0] and window.shape[0] - 1 - cy < s) or \
+              (x1 < shape[1] and window.shape[1] - 1 - cx < s)
+        return {"center": np.array([y0 + cy, x0 + cx]), "sigma": max(sx, sy), "snr": peak / noise, "cut": cut}
+
+    def update(self, frame):
+        """Locate the spot in frame and return a dict with center (y, x),
+        roi (size x size crop, padded at the sensor edges), size, snr and
+        reacquired."""
+        frame = np.asarray(frame)
+        self.frames += 1
+        predicted = self.predict()
+        found = None
+        if predicted is not None:
+            found = self._measure(frame, predicted, self.size * (0.5 + self.margin))
+            if found is not None and (found["snr"] < self.min_snr or found["cut"]):
+                found = None
+        reacquired = found is None
+        if reacquired:
+            self.reacquisitions += 1
+            self.velocity[:] = 0
+            predicted = self.acquire(frame)
+            found = self._measure(frame, predicted, self.size * (0.5 + self.margin))
+        if found is None:
+            # nothing usable: keep the coarse position, do not update the filter
+            self.center = predicted
+            snr = 0.0
+        else:
+            residual = found["center"] - predicted
+            self.center = found["center"] if reacquired else predicted + self.alpha * residual
+            if not reacquired:
+                self.velocity += self.beta * residual
+            if self.auto_size:
+                self._resize(found["sigma"])
+            snr = found["snr"]
+        size = int(round(self.size))
+        center = tuple(int(round(c)) for c in self.center)
+        if frame.ndim == 3:
+            roi = core.extract(frame, (size, size, frame.shape[2]), center + (frame.shape[2] // 2,))
+        else:
+            roi = core.extract(frame, (size, size), center)
+        roi = to_gray(roi, self.channel)
+        return {"center": center, "roi": roi, "size": size, "snr": snr, "reacquired": reacquired}
@@ -1,17 +1,17 @@
 #%%
+import logging
+
 import numpy as np
-import matplotlib.pyplot as plt
-import tifffile as tiff
-import NanoImagingPack as nip
-import NanoImagingPack as nip
-import tifffile as tif
-import numpy as np
-import matplotlib.pyplot as plt
 import tifffile as tiff
-try:
-    from scipy.optimize import curve_fit
-except ImportError:
-    print("Unable to import curve_fit from scipy.optimize.")
+
+# SciPy is loaded by focusd on first use (NanoImagingPack only for
+# backend="nip"), matplotlib only by the diagnostics thread
+from focusd.focus_algorithm import FocusMetric
+from focusd.calibration import Calibration
+from focusd.diagnostics import DiagnosticsSink, render_focus_fit
+from focusd.profiling import Profiler
+
+logging.basicConfig(level=logging.INFO)
 
 
 # %%
@@ -55,26 +55,25 @@ x_c = []
 x_sigma = []
 y_sigma = []
 i_values = []
+focus_values = []
 background = 40	# Background value to remove from image
 
 
 Range = 240  	# Number of files
 zval = 1    	# Step size in microns
-plotY = 1			# 1 to plot preview of fit, 0 to remove and run through stack
+plotY = 1			# 1 to save previews of the fit (autofocus_fit_<step>.png), 0 to run through the stack
 starting = 1	# Start point for scan, if you want to start in the middle set to int(Range/2) instead
 
-# Define the model function. In our case, a 1D Gaussian.
-def Gaussian1D(xdata, i0, x0, sX, amp):
-    x = xdata
-    x0 = float(x0)
-    eq = i0+amp*np.exp(-((x-x0)**2/2/sX**2))
-    return eq
-
-def DoubleGaussian1D(xdata, i0, x0, sX, amp, dist):
-    x = xdata
-    x0 = float(x0)
-    eq = i0+amp*np.exp(-((x-(x0-dist/2))**2/2/sX**2)) +  amp*np.exp(-((x-(x0+dist/2))**2/2/sX**2))
-    return eq
+# blur backend: "fft" (same result as nip.gaussf, without NanoImagingPack), "nip", "ndimage", "iir" or "box"
+# mode: "blur" smooths the 2D crop, "project" smooths only the projections (faster)
+# the script has no main guard, so the plots are rendered in a thread (a worker
+# process would re-run the script under the spawn start method)
+if plotY:
+    sink = DiagnosticsSink(render_focus_fit, outdir=".", prefix="autofocus_fit", every=10, worker="thread")
+# per-stage timing (locate, crop, blur, projection, fit, publish), logged every 5 s; set enabled=False to switch it off
+profiler = Profiler(log_interval=5)
+metric = FocusMetric(radius=300, background=background, sigma_locate=111, sigma_smooth=11, backend="fft", mode="blur",
+                     profiler=profiler)
 
 
 # To read the acquired images and apply the Gaussian fitting
@@ -85,84 +84,29 @@ for i in range(starting,Range,2):
     img = images[i][:,:,-2]
 
     #img = np.mean(images[i], axis=-1)  # Convert to grayscale by averaging RGB channels
-    radius = 300
-    
-    im = np.asarray(img).astype(float)
-    im_gauss = nip.gaussf(im, 111)  # Apply Gaussian filter to smooth the image
-    max_coord = np.unravel_index(np.argmax(im_gauss), im_gauss.shape)  # Find the coordinates of the maximum pixel value
-    # crop the image around the maximum pixel value with a cricle of radius 100 pixels
-    im = nip.extract(im, (radius*2,radius*2), max_coord)
     #tif.imwrite("autufocus_shifted_r.tif", nip.extract(im, (radius*2,radius*2), max_coord), append=True)
-    
-    # apply a Gaussian filter to the image to smooth it
-    im = nip.gaussf(im, 11)
-    im = im-np.mean(im)/2
-    im[im<background] = 0			# Threshold
-    #im = im/np.max(im)		# Normalise to 1
-    
-    # 1D Gaussian
-    h1, w1 = im.shape
-    x = np.arange(w1)
-    y = np.arange(h1)
 
-    projX = np.mean(im, axis=0)  # Project along y-axis
-    projY = np.mean(im, axis=1)  # Project along x-axis
-    
-    
-    # Initial guess for the gauss fit
-    i0 = np.mean(projX)  # Background level
-    amp = np.max(projX) - i0  # Amplitude of the Gaussian
-    sX = np.std(projX)  # Standard deviation of the Gaussian
-    amp = np.max(projX) - i0  # Amplitude of the Gaussian
-    sY = np.std(projY)  # Standard deviation of the Gaussian
-    init_guess_x = [i0, w1/2, sX, amp, 100]  # Initial guess for x fit
-    init_guess_y = [i0, h1/2, sY, amp]  # Initial guess for y fit
-    
-    # Do x fit
-    poptx, pcov = curve_fit(DoubleGaussian1D, x, projX, p0=init_guess_x, maxfev = 50000)
-    x0 = poptx[1]
-    sx = poptx[2]
-    #init_guess_x.clear()
-    #init_guess_x.append(poptx)
-    # Do y fit
-    popty, pcov = curve_fit(Gaussian1D, y, projY, p0=init_guess_y, maxfev = 50000)
-    y0 = popty[1]
-    sy = popty[2]
-    
-    
-    # Replaces initial guess with final guess
-    #init_guess_y.clear()
-    #init_guess_y.append(popt)
-   
-    #x_sigma.append(sx)
-    #y_sigma.append(sy)
-    #x_c.append(poptx[1])
+    # locate the spot, crop, smooth, threshold, project and fit
+    result = metric.evaluate(img)
+    sx, sy = result["sx"], result["sy"]
 
     # compute the focus value as the ratio of the two fitted sigmas
     focus_value = sx / sy
-    print(f"Focus value for step {i}: {focus_value:.2f} (sx: {sx:.2f}, sy: {sy:.2f})")
-    # Optional plot, uncomment if you want live preview during calibration that shows fit
-
-    # plot the fit
-    plt.figure(figsize=(10, 5))
-    plt.title(f'Autofocus Fit for Step {i} with Focus Value {focus_value:.2f}')
-    plt.subplot(1, 3, 1)
-    plt.plot(x, DoubleGaussian1D(x, *poptx), label='Fit')
-    plt.plot(x, projX, label='Data')
-    plt.title('X Fit')
-    plt.xlabel('X Position')
-    plt.ylabel('Intensity')
-    plt.legend()
-    plt.subplot(1, 3, 2)
-    plt.plot(y, Gaussian1D(y, *popty), label='Fit')      
-    plt.plot(y, projY, label='Data')
-    plt.title('Y Fit')
-    plt.xlabel('Y Position')
-    plt.ylabel('Intensity')
-    plt.legend()
-    plt.subplot(1, 3, 3)
-    plt.plot((x0,x0+sx),(y0,y0))
-    plt.plot((x0,x0),(y0,y0+sy))
-    plt.imshow(im)    
-    plt.savefig(f'autofocus_fit_{i}.png')
-    plt.show()
+    # handing the result on (log, calibration list, plot queue) is the publish stage
+    with profiler.stage("publish"):
+        print(f"Focus value for step {i}: {focus_value:.2f} (sx: {sx:.2f}, sy: {sy:.2f})")
+        focus_values.append(focus_value)
+
+        # a rendering thread plots the fit (every 10th step and anomalies), so plotting does not slow down the sweep
+        if plotY:
+            sink.submit(i, result)
+    profiler.frame_done()
+
+if plotY:
+    sink.close()
+print(profiler.log_line())
+
+#%% save the z-calibration (focus value -> z offset in microns) for the focus lock
+calibration = Calibration.build(np.array(i_values)*zval, focus_values, meta={"file": mFile, "zval": zval})
+calibration.save("autofocus_calibration.npz")
+print(f"Calibrated focus range {calibration.focus_range}, set point at z={calibration.z_ref:.1f} um")
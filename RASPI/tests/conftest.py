@@ -0,0 +1,5 @@
+import os
+import sys
+
+# focusd lives in RASPI/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+from scipy import ndimage
+
+from focusd import blur
+from focusd.benchmarks.blur import SIGMAS, spot
+
+
+@pytest.mark.parametrize("backend", ["iir", "box"])
+@pytest.mark.parametrize("sigma", (0.3, 2) + SIGMAS)
+def test_matches_ndimage(backend, sigma):
+    # the frame of focusd.benchmarks.blur, the box cascade is least accurate
+    # near the borders at sigma=111
+    im = spot((600, 600))
+    # iir and box pad like mode="nearest"
+    reference = ndimage.gaussian_filter(im, sigma, mode="nearest")
+    err = np.max(np.abs(blur.gaussf(im, sigma, backend) - reference)) / np.max(reference)
+    assert err < (0.015 if backend == "iir" else 0.05)
+
+
+def test_small_sigma_blurs():
+    im = spot((64, 64))
+    for backend in ("iir", "box"):
+        assert blur.effective_backend(backend, 0.3) == "ndimage"
+        assert not np.allclose(blur.gaussf(im, 0.5, backend), im)
+
+
+def test_fft_matches_core():
+    from focusd import core
+
+    im = spot((64, 80))
+    np.testing.assert_allclose(blur.gaussf(im, 3, "fft"), core.gaussf(im, 3))
+    np.testing.assert_allclose(blur.gaussf1d(im[0], 3, "fft"), core.gaussf(im[0], 3))
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        blur.gaussf(np.zeros((4, 4)), 1, "gpu")
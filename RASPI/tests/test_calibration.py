@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from focusd.calibration import Calibration
+
+
+def sweep(n=41):
+    z = np.linspace(-20, 20, n)
+    return z, np.exp(z / 15)
+
+
+def test_z_offset_inverts_the_sweep():
+    z, focus = sweep()
+    cal = Calibration.build(z, focus)
+    # F=1 at z=0 is the set point
+    assert abs(cal.z_offset(1.0)) < 1e-3
+    assert np.allclose([cal.z_offset(f) for f in focus[5:-5]], z[5:-5], atol=0.05)
+    np.testing.assert_allclose(cal.z_offsets(focus[5:-5]), [cal.z_offset(f) for f in focus[5:-5]], atol=1e-6)
+
+
+def test_save_load(tmp_path):
+    z, focus = sweep()
+    cal = Calibration.build(z, focus, meta={"camera": "ESP32"})
+    path = str(tmp_path / "calibration.npz")
+    cal.save(path)
+    loaded = Calibration.load(path)
+    np.testing.assert_array_equal(loaded.z_lut, cal.z_lut)
+    assert loaded.focus_range == cal.focus_range
+    assert loaded.z_ref == cal.z_ref and loaded.focus_ref == cal.focus_ref
+    assert loaded.meta == cal.meta
+    for f in np.linspace(0.1, 5, 50):
+        assert loaded.z_offset(f) == cal.z_offset(f)
+
+
+def test_load_rejects_other_versions(tmp_path):
+    z, focus = sweep()
+    path = str(tmp_path / "calibration.npz")
+    Calibration.build(z, focus).save(path)
+    with np.load(path) as data:
+        fields = dict(data)
+    fields["version"] = 99
+    np.savez(path, **fields)
+    with pytest.raises(ValueError):
+        Calibration.load(path)
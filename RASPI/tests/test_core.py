@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from focusd import core
+
+
+def reference_extract(im, size, center, pad_value=0.0):
+    # pad generously, then cut the window starting at center - size // 2
+    pad = max(size) + max(abs(c) for c in center)
+    padded = np.pad(im, pad, constant_values=pad_value)
+    y0, x0 = center[0] - size[0] // 2 + pad, center[1] - size[1] // 2 + pad
+    return padded[y0:y0 + size[0], x0:x0 + size[1]]
+
+
+@pytest.mark.parametrize("center", [(0, 0), (5, 3), (29, 39), (-3, 50), (15, 20), (40, -10), (100, 100)])
+@pytest.mark.parametrize("size", [(8, 8), (7, 9), (30, 40), (50, 60)])
+def test_extract_at_the_edges(size, center):
+    im = np.arange(30 * 40, dtype=float).reshape(30, 40) + 1
+    if min(center) < 0:
+        # a negative center counts from the end, as in nip.extract
+        shifted = tuple(c + n if c < 0 else c for c, n in zip(center, im.shape))
+    else:
+        shifted = center
+    out = core.extract(im, size, center, pad_value=-1)
+    assert out.shape == size
+    np.testing.assert_array_equal(out, reference_extract(im, size, shifted, pad_value=-1))
+
+
+def test_extract_inside_is_a_view():
+    im = np.zeros((30, 40))
+    assert np.shares_memory(core.extract(im, (10, 10), (15, 20)), im)
+
+
+def test_extract_defaults():
+    im = np.random.default_rng(0).random((30, 40))
+    np.testing.assert_array_equal(core.extract(im), im)
+    np.testing.assert_array_equal(core.extract(im, 10), im[10:20, 15:25])
+
+
+def test_gaussf_preserves_the_sum():
+    im = np.random.default_rng(0).random((32, 48))
+    out = core.gaussf(im, (2, 5))
+    assert out.shape == im.shape
+    assert np.isclose(out.sum(), im.sum())
+    np.testing.assert_array_equal(core.gaussf(im, 0), im)
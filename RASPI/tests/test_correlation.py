@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+from scipy import signal
+
+from focusd.correlation import TemplateBank, correlate_stack, window_sums
+
+
+def data(seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.random((5, 24, 30)), rng.random((3, 7, 9))
+
+
+def brute_ncc(frame, template):
+    h, w = template.shape
+    t = template - template.mean()
+    out = np.zeros((frame.shape[0] - h + 1, frame.shape[1] - w + 1))
+    for i in range(out.shape[0]):
+        for j in range(out.shape[1]):
+            f = frame[i:i + h, j:j + w] - frame[i:i + h, j:j + w].mean()
+            out[i, j] = np.sum(f * t) / np.sqrt(np.sum(f * f) * np.sum(t * t))
+    return out
+
+
+@pytest.mark.parametrize("mode", ["full", "valid"])
+def test_ncc_matches_brute_force(mode):
+    frames, templates = data()
+    bank = TemplateBank(templates, frames.shape[1:], mode=mode)
+    ncc = bank.ncc(frames[0])
+    for k, template in enumerate(templates):
+        np.testing.assert_allclose(ncc[k], brute_ncc(frames[0], template), atol=1e-10)
+
+
+def test_correlate_matches_scipy():
+    frames, templates = data()
+    bank = TemplateBank(templates, frames.shape[1:])
+    maps = bank.correlate(frames[1])
+    for k, template in enumerate(templates):
+        np.testing.assert_allclose(maps[k], signal.correlate(frames[1], template), atol=1e-10)
+    valid = TemplateBank(templates, frames.shape[1:], mode="valid").correlate(frames[1])
+    np.testing.assert_allclose(valid[0], signal.correlate(frames[1], templates[0], mode="valid"), atol=1e-10)
+
+
+def test_window_sums():
+    im = np.random.default_rng(1).random((12, 15))
+    sums = window_sums(im, (3, 4))
+    assert sums[2, 5] == pytest.approx(im[2:5, 5:9].sum())
+    assert sums.shape == (10, 12)
+
+
+@pytest.mark.parametrize("score", ["max", "mean", "ncc"])
+def test_correlate_stack_matches_the_bank(score):
+    frames, templates = data()
+    bank = TemplateBank(templates, frames.shape[1:])
+    expected = np.stack([bank.scores(frame, score) for frame in frames])
+    np.testing.assert_allclose(correlate_stack(frames, templates, score), expected, atol=1e-10)
+    np.testing.assert_allclose(correlate_stack(frames, templates, score, processes=2, chunk=2), expected,
+                               atol=1e-10)
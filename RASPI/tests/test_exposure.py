@@ -0,0 +1,41 @@
+import numpy as np
+
+from focusd.exposure import AutoExposure
+
+
+def spot(peak, dtype=float, size=32):
+    y, x = np.mgrid[:size, :size] - size / 2
+    return (peak * np.exp(-(x**2 + y**2) / (2 * 6**2))).astype(dtype)
+
+
+def test_float_peak_below_full_scale_is_not_saturated():
+    # a clipped top just below full scale, as the float ROIs of SpotTracker
+    roi = np.minimum(spot(300), 254.5)
+    assert roi.max() == 254.5
+    auto = AutoExposure(confirm_frames=1, settle_frames=0)
+    peak, saturated = auto.stats(roi)
+    assert saturated == 0
+    assert peak > 0.99
+
+
+def test_saturated_pixels_are_counted():
+    roi = np.minimum(spot(400), 255)
+    _, saturated = AutoExposure().stats(roi)
+    assert saturated == np.count_nonzero(roi >= 255) / roi.size
+    _, saturated_int = AutoExposure().stats(roi.astype(np.uint8))
+    assert saturated_int == saturated
+
+
+def test_float_and_integer_levels_agree():
+    roi = spot(150)
+    auto = AutoExposure()
+    assert auto.stats(roi)[0] == auto.stats(np.round(roi).astype(np.uint8))[0]
+
+
+def test_brightens_a_dim_spot_and_darkens_a_saturated_one():
+    auto = AutoExposure(exposure=100, confirm_frames=1, settle_frames=0)
+    assert auto.update(spot(60))["exposure"] > 100
+    auto = AutoExposure(exposure=100, confirm_frames=1, settle_frames=0)
+    assert auto.update(np.minimum(spot(400), 255))["exposure"] < 100
+    # in the target band nothing changes
+    assert AutoExposure(confirm_frames=1, settle_frames=0).update(spot(180)) is None
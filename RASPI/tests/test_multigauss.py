@@ -0,0 +1,31 @@
+import numpy as np
+
+from focusd.benchmarks.multigauss import GPRMS, GUESS, gaussian
+from focusd.multigauss import MultiGaussian2D, fit_spots
+
+
+def example(seed=0, noise=0.1):
+    # the four spots of PYTHON/IMAGE_Processing/Fit2DData.py
+    x, y = np.linspace(-5, 4, 75), np.linspace(-3, 7, 150)
+    X, Y = np.meshgrid(x, y)
+    Z = sum(gaussian(X, Y, *p) for p in GPRMS) + noise * np.random.default_rng(seed).standard_normal(X.shape)
+    return x, y, Z
+
+
+def test_fit_matches_truth():
+    x, y, Z = example()
+    model = MultiGaussian2D(x, y, offset=False)
+    popt, _ = model.fit(Z, [p for prms in GUESS for p in prms])
+    fitted = np.abs(popt.reshape(4, 5))
+    np.testing.assert_allclose(fitted, np.abs(GPRMS), atol=0.15)
+
+
+def test_fit_spots_finds_all_spots():
+    for seed in range(3):
+        x, y, Z = example(seed)
+        popt, _, n_spots = fit_spots(Z, x, y, max_spots=6, offset=False)
+        assert n_spots == len(GPRMS)
+        centers = sorted(map(tuple, np.round(popt.reshape(n_spots, 5)[:, :2], 1)))
+        np.testing.assert_allclose(centers, sorted(p[:2] for p in GPRMS), atol=0.1)
+        rms = np.sqrt(np.mean((Z - MultiGaussian2D(x, y, offset=False)(popt))**2))
+        assert rms < 0.11
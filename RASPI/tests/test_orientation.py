@@ -0,0 +1,54 @@
+import math
+
+import numpy as np
+import pytest
+
+from focusd.orientation import FILTERS, OrientationTracker, Smoother
+
+
+def wrapped_series(n=200, seed=0):
+    # a slowly drifting axis plus noise, reported modulo pi/2 as by hough_ellipse
+    rng = np.random.default_rng(seed)
+    truth = np.cumsum(rng.normal(0, 0.2, n)) + 0.3
+    return truth, np.mod(truth, np.pi / 2)
+
+
+def test_unwrap_matches_np_unwrap():
+    _, wrapped = wrapped_series()
+    tracker = OrientationTracker(filter="none", min_ellipticity=0)
+    unwrapped = np.array([tracker.update(o)["orientation"] for o in wrapped])
+    reference = np.unwrap(wrapped, period=np.pi / 2)
+    offset = (unwrapped - reference) / (np.pi / 2)
+    # the same series up to a constant multiple of the period
+    np.testing.assert_allclose(offset, np.round(offset[0]), atol=1e-9)
+
+
+def test_round_samples_do_not_move_the_axis():
+    tracker = OrientationTracker(filter="none", min_ellipticity=0.1)
+    tracker.update(0.4, 10, 5)
+    state = tracker.update(1.2, 10, 9.5)
+    assert state["axis"] == pytest.approx(0.4)
+    assert state["smoothed"] == pytest.approx(0.4)
+
+
+def test_z_changes_sign_through_focus():
+    tracker = OrientationTracker(filter="none")
+    above = tracker.update(0.2, 12, 6)["z"]
+    # the same spot elongated along the other axis is reported with swapped roles
+    below = tracker.update(0.2, 6, 12)["z"]
+    assert above > 0 > below
+    assert above == pytest.approx(-below)
+    assert tracker.update(0.2 + math.pi / 2, 6, 12)["orientation"] == pytest.approx(0.2)
+
+
+@pytest.mark.parametrize("filter", FILTERS)
+def test_smoothers_follow_a_constant(filter):
+    smoother = Smoother(filter)
+    for _ in range(50):
+        value = smoother.update(2.0)
+    assert value == pytest.approx(2.0)
+
+
+def test_unknown_filter():
+    with pytest.raises(ValueError):
+        Smoother("kalman")
@@ -0,0 +1,53 @@
+import pytest
+
+from focusd import sources
+from focusd.sources import SerialCamSource
+
+
+class FakeSerial:
+    # the DTR/RTS lines and close() that reset() uses
+    dtr = rts = True
+
+    def __init__(self, port):
+        self.port = port
+
+    def close(self):
+        pass
+
+
+class FakeCamSource(SerialCamSource):
+    def _connect(self, port):
+        return FakeSerial(port)
+
+
+@pytest.fixture
+def ports(monkeypatch):
+    available = ["/dev/ttyACM0"]
+    monkeypatch.setattr(sources, "find_ports", lambda manufacturers=None: list(available))
+    return available
+
+
+def test_reset_finds_a_reenumerated_device(ports):
+    camera = FakeCamSource()
+    camera.open()
+    assert camera.serial.port == "/dev/ttyACM0"
+    ports[:] = ["/dev/ttyACM1"]
+    camera.reset(boot_time=0)
+    assert camera.port == "/dev/ttyACM1"
+    assert camera.serial.port == "/dev/ttyACM1"
+
+
+def test_reset_keeps_a_given_port(ports):
+    camera = FakeCamSource(port="/dev/ttyACM0")
+    camera.open()
+    ports[:] = ["/dev/ttyACM1"]
+    camera.reset(boot_time=0)
+    assert camera.serial.port == "/dev/ttyACM0"
+
+
+def test_reset_sends_the_settings_again(ports):
+    camera = FakeCamSource()
+    camera.open()
+    camera.meta = {"exposure": 100.0, "gain": 2.0}
+    camera.reset(boot_time=0)
+    assert sorted(camera._pending.values()) == ["g2", "t100"]